@@ -1,3 +1,4 @@
+import hashlib
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -38,4 +39,94 @@ else:
     DATABASE_URL = f"sqlite+aiosqlite:///{DB_PATH}"
 
 # Timezone
-TIMEZONE = "Europe/Moscow"
\ No newline at end of file
+TIMEZONE = "Europe/Moscow"
+
+# Кэш окупаемости авто (/api/get-cars): 0 отключает кэш
+PAYBACK_CACHE_SIZE = int(os.getenv("PAYBACK_CACHE_SIZE", "1024"))
+PAYBACK_CACHE_TTL = float(os.getenv("PAYBACK_CACHE_TTL", "300"))
+
+# Хранить счётчик BP за всё время в users.bp_total_earned (O(1) для /api/get-bp-stats)
+BP_TOTAL_COUNTER = os.getenv("BP_TOTAL_COUNTER", "1").lower() not in ("0", "false", "no")
+
+# Кэш telegram_id -> пользователь (id, has_platinum_vip)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
+# Роль процесса (python -m bot.main [role]): all - всё в одном процессе, web - только API,
+# bot - только апдейты Telegram, scheduler - планировщик и отправка outbox
+PROCESS_ROLE = os.getenv("PROCESS_ROLE", "all").lower()
+
+
+def set_process_role(role: str):
+    """Задать роль текущего процесса (bot.main); читать её как bot.config.PROCESS_ROLE"""
+    global PROCESS_ROLE
+    PROCESS_ROLE = role
+
+# Получение апдейтов: polling (getUpdates, локальная разработка) или webhook - Telegram
+# шлёт апдейты на WEBHOOK_URL + WEBHOOK_PATH встроенного ASGI-сервера (нужен WEB_SERVER=asgi).
+# WEBHOOK_URL - публичный адрес процесса, который принимает апдейты (роль all или bot),
+# задаётся явно: без него режим webhook не запустится.
+# Секрет по умолчанию выводится из токена - одинаковый у всех процессов бота
+BOT_UPDATES = os.getenv("BOT_UPDATES", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32]
+WEBHOOK_PATH = f"/telegram/webhook/{WEBHOOK_SECRET}"
+
+# Режим веб-сервера в bot.main: asgi (API в event loop бота на его async-движке),
+# thread (Flask в потоке бота), gunicorn (отдельный процесс), none
+WEB_SERVER = os.getenv("WEB_SERVER", "asgi").lower()
+
+# Пул соединений к PostgreSQL.
+# DB_MAX_CONNECTIONS - общий бюджет соединений на все процессы (бот + воркеры веб-сервера
+# или все реплики ролей), делится между движками; DB_POOL_SIZE / DB_MAX_OVERFLOW
+# переопределяют расчёт (в переменных сервиса - для одной роли)
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "20"))
+DB_POOL_SIZE = os.getenv("DB_POOL_SIZE")
+DB_MAX_OVERFLOW = os.getenv("DB_MAX_OVERFLOW")
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1").lower() not in ("0", "false", "no")
+DB_POOL_WARMUP = os.getenv("DB_POOL_WARMUP", "1").lower() not in ("0", "false", "no")
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "2"))
+WEB_THREADS = int(os.getenv("WEB_THREADS", "4"))
+
+# Раздельные роли (web/bot/scheduler): сколько реплик каждой роли развёрнуто, чтобы
+# DB_MAX_CONNECTIONS делился на все процессы. Реплика scheduler получает
+# SCHEDULER_DB_CONNECTIONS (у лидера два из них всё время заняты: advisory lock и
+# LISTEN планировщика), остаток - поровну между репликами web и bot
+WEB_REPLICAS = int(os.getenv("WEB_REPLICAS", "2"))
+BOT_REPLICAS = int(os.getenv("BOT_REPLICAS", "1"))
+SCHEDULER_REPLICAS = int(os.getenv("SCHEDULER_REPLICAS", "2"))
+SCHEDULER_DB_CONNECTIONS = int(os.getenv("SCHEDULER_DB_CONNECTIONS", "4"))
+
+# Планировщик событий (окончание аренды, таймеры): горизонт загрузки из БД и период
+# пересинхронизации (подхватывает записи других процессов без NOTIFY), в секундах
+SCHEDULER_RESYNC = int(os.getenv("SCHEDULER_RESYNC", "300"))
+SCHEDULER_HORIZON = max(int(os.getenv("SCHEDULER_HORIZON", "3600")), SCHEDULER_RESYNC * 2)
+
+# Выбор лидера для фоновых задач (планировщик, outbox) среди реплик: лидер проверяет
+# блокировку/продлевает аренду раз в LEADER_HEARTBEAT секунд; аренда SQLite истекает
+# через LEADER_LEASE_TTL, после чего её забирает другой процесс
+LEADER_HEARTBEAT = float(os.getenv("LEADER_HEARTBEAT", "5"))
+LEADER_LEASE_TTL = max(float(os.getenv("LEADER_LEASE_TTL", "15")), LEADER_HEARTBEAT * 2)
+
+# Отправка сообщений из outbox: общий лимит и лимит на чат (сообщений в секунду),
+# размер пачки, период опроса таблицы (сек) и число попыток при сетевых ошибках
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "25"))
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+
+# Час по Москве, в который начинается новый BP-день (сброс BP-заданий)
+BP_RESET_HOUR = int(os.getenv("BP_RESET_HOUR", "7"))
+
+# Хранилище FSM (состояния сценариев бота) в БД: брошенное состояние живёт FSM_STATE_TTL
+# секунд с последнего изменения, истёкшие строки удаляются раз в FSM_PURGE_INTERVAL.
+# Кэш в процессе (FSM_CACHE_SIZE записей на FSM_CACHE_TTL секунд) - только при polling: там
+# процесс бота один и кэш всегда актуален. При webhook апдейты одного чата могут попасть
+# в разные реплики, и кэш отдал бы устаревшее состояние - состояние всегда читается из БД
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", str(7 * 24 * 3600)))
+FSM_PURGE_INTERVAL = float(os.getenv("FSM_PURGE_INTERVAL", "3600"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "600")) if BOT_UPDATES == "polling" else 0.0
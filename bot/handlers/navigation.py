@@ -1,12 +1,14 @@
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
 import os
-from sqlalchemy import select
+from sqlalchemy import select, insert, literal
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.keyboards.keyboards import get_main_keyboard, get_resell_menu, get_rental_menu, get_open_app_keyboard
-from bot.models.database import User
+from bot.models.database import User, OutboxMessage
 from bot.models.init_db import db
+from bot.tasks.outbox import outbox_sender
+from bot.utils.datetime_helper import utc_now
 
 ADMIN_ID = 360028214
 
@@ -80,27 +82,29 @@ async def msg_handler(message: Message):
         text = parts[1]
         await message.answer(f'⏳ Отправляю "{text}" всем пользователям...')
         
-        # Получаем всех пользователей из БД
+        # Ставим сообщение всем пользователям в outbox одним INSERT ... SELECT,
+        # отправка с учётом лимитов Telegram идёт в фоне (bot/tasks/outbox.py)
+        broadcast_text = f'📢 Сообщение от администратора:\n\n{text}'
+        # Python-default (utc_now) в INSERT ... SELECT не подставляется - время передаём явно
+        now = utc_now()
         async with db.get_session() as session:
-            result = await session.execute(select(User))
-            users = result.scalars().all()
-        
-        await message.answer(f'📊 Найдено пользователей: {len(users)}')
-        
-        # Отправляем сообщение каждому
-        sent = 0
-        failed = 0
-        for user in users:
-            try:
-                await message.bot.send_message(
-                    user.telegram_id, 
-                    f'📢 Сообщение от администратора:\n\n{text}'
+            result = await session.execute(
+                insert(OutboxMessage).from_select(
+                    ["chat_id", "text", "created_at", "available_at", "attempts"],
+                    select(
+                        User.telegram_id,
+                        literal(broadcast_text),
+                        literal(now, OutboxMessage.created_at.type),
+                        literal(now, OutboxMessage.available_at.type),
+                        literal(0)
+                    )
                 )
-                sent += 1
-            except Exception as e:
-                failed += 1
+            )
+            queued = result.rowcount
+            await session.commit()
+        outbox_sender.wake()
         
-        await message.answer(f'✅ Отправлено: {sent}\n❌ Ошибок: {failed}')
+        await message.answer(f'✅ Поставлено в очередь отправки: {queued}')
     except Exception as e:
         import traceback
         error_msg = f'❌ Критическая ошибка: {str(e)}\n{traceback.format_exc()}'
@@ -7,13 +7,16 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 import pytz
 
-from bot.models.database import User, Car, Rental
+from bot.models.database import Car, Rental
 from bot.models.init_db import db
+from bot.models.users import afind_user, aget_or_create_user
 from bot.keyboards.keyboards import (
     get_rental_menu, get_back_keyboard, get_cancel_keyboard
 )
-from bot.utils.statistics import RentalStatistics
-from bot.utils.datetime_helper import format_datetime, get_moscow_now
+from bot.utils.statistics import RentalStatistics, PERIODS
+from bot.utils.datetime_helper import format_datetime, get_moscow_now, MOSCOW_TZ
+from bot.utils.cache import payback_cache
+from bot.tasks.notifications import schedule_rental
 
 router = Router()
 
@@ -66,15 +69,7 @@ async def receive_car_cost(message: Message, state: FSMContext):
         session = db.get_session()
         try:
             # Получаем или создаем пользователя
-            user = await session.execute(
-                select(User).where(User.telegram_id == message.from_user.id)
-            )
-            user = user.scalar_one_or_none()
-            
-            if not user:
-                user = User(telegram_id=message.from_user.id, username=message.from_user.username)
-                session.add(user)
-                await session.flush()
+            user = await aget_or_create_user(session, message.from_user.id, message.from_user.username)
             
             # Создаем новый автомобиль
             car = Car(
@@ -84,6 +79,7 @@ async def receive_car_cost(message: Message, state: FSMContext):
             )
             session.add(car)
             await session.commit()
+            payback_cache.invalidate(user.id)
             
             await message.answer(
                 f"✅ Автомобиль '{data['name']}' успешно добавлен!\n"
@@ -104,10 +100,7 @@ async def show_my_cars(callback: CallbackQuery):
     session = db.get_session()
     
     try:
-        user = await session.execute(
-            select(User).where(User.telegram_id == callback.from_user.id)
-        )
-        user = user.scalar_one_or_none()
+        user = await afind_user(session, callback.from_user.id)
         
         if not user:
             await callback.message.edit_text(
@@ -259,7 +252,6 @@ async def receive_rental_end_time(message: Message, state: FSMContext):
         text = message.text
         is_past = data.get('is_past', False)
         
-        tz_moscow = pytz.timezone('Europe/Moscow')
         now_moscow = get_moscow_now()  # Это уже aware datetime в Moscow TZ
         
         # Если это прошлая аренда, время может быть в прошлом
@@ -268,7 +260,7 @@ async def receive_rental_end_time(message: Message, state: FSMContext):
             time_parts = text.split(":")
             # Предполагаем дату сегодня (в Москве)
             start_date = now_moscow.date()
-            start_time = tz_moscow.localize(datetime.combine(start_date, datetime.strptime(text, "%H:%M").time()))
+            start_time = MOSCOW_TZ.localize(datetime.combine(start_date, datetime.strptime(text, "%H:%M").time()))
             
             # Конец аренды = начало + hours
             end_time = start_time + timedelta(hours=data['hours'])
@@ -289,10 +281,7 @@ async def receive_rental_end_time(message: Message, state: FSMContext):
         session = db.get_session()
         try:
             # Получаем пользователя
-            user = await session.execute(
-                select(User).where(User.telegram_id == message.from_user.id)
-            )
-            user = user.scalar_one()
+            user = await aget_or_create_user(session, message.from_user.id, message.from_user.username)
             
             # Конвертируем в UTC для хранения в БД
             utc_tz = pytz.UTC
@@ -311,6 +300,8 @@ async def receive_rental_end_time(message: Message, state: FSMContext):
             )
             session.add(rental)
             await session.commit()
+            payback_cache.invalidate(user.id)
+            schedule_rental(rental.id, end_time_utc)
             
             total_income = data['price_per_hour'] * data['hours']
             past_label = "📅 (прошлая аренда)" if is_past else ""
@@ -342,6 +333,7 @@ async def delete_car(callback: CallbackQuery):
         
         await session.delete(car)
         await session.commit()
+        payback_cache.invalidate(car.user_id)
         
         await callback.message.edit_text(
             f"✅ Автомобиль '{car.name}' удален",
@@ -353,76 +345,124 @@ async def delete_car(callback: CallbackQuery):
     await callback.answer()
 
 
+PERIOD_TITLES = {
+    "day": "за день",
+    "week": "за неделю",
+    "month": "за месяц",
+    "all": "за всё время",
+}
+
+# Запас до лимита Telegram в 4096 символов
+MAX_STATS_TEXT = 3900
+
+
+def format_rental_summary(title: str, summary: dict, with_cars: bool = True) -> str:
+    """Текст статистики аренды: итоги за все периоды и разбивка по машинам"""
+    text = f"{title}\n\n"
+    for period in PERIODS:
+        text += f"💵 Доход {PERIOD_TITLES[period]}: {summary['total'][period]:.2f}₽\n"
+    
+    if with_cars and summary["cars"]:
+        text += "\n🚗 По автомобилям (день / неделя / месяц / всё время):\n"
+        for car in summary["cars"]:
+            income = car["income"]
+            line = (
+                f"• {car['name']}: {income['day']:.0f} / {income['week']:.0f} / "
+                f"{income['month']:.0f} / {income['all']:.0f}₽\n"
+            )
+            if len(text) + len(line) > MAX_STATS_TEXT:
+                text += "…\n"
+                break
+            text += line
+    return text
+
+
+@router.callback_query(F.data == "rental_statistics")
+async def show_rental_statistics(callback: CallbackQuery, state: FSMContext):
+    """Статистика аренды за все периоды с разбивкой по машинам (один запрос)"""
+    await state.update_data(stats_car_id=None)
+    session = db.get_session()
+    
+    try:
+        user = await afind_user(session, callback.from_user.id)
+        
+        if not user:
+            await callback.message.edit_text(
+                "❌ У вас нет данных",
+                reply_markup=get_back_keyboard()
+            )
+            await callback.answer()
+            return
+        
+        summary = await RentalStatistics.get_summary(session, user.id)
+        text = format_rental_summary("📈 Статистика аренды:", summary)
+        
+        await callback.message.edit_text(text, reply_markup=get_back_keyboard())
+    finally:
+        await session.close()
+    
+    await callback.answer()
+
+
 @router.callback_query(F.data.startswith("car_stats_"))
-async def show_car_statistics_menu(callback: CallbackQuery, state: FSMContext):
-    """Показать меню выбора периода для статистики по конкретному авто"""
+async def show_car_statistics(callback: CallbackQuery, state: FSMContext):
+    """Статистика по конкретному авто за все периоды"""
     car_id = int(callback.data.split("_")[2])
     await state.update_data(stats_car_id=car_id)
+    session = db.get_session()
+    
+    try:
+        user = await afind_user(session, callback.from_user.id)
+        summary = await RentalStatistics.get_summary(session, user.id, car_id=car_id) if user else None
+        
+        if not summary or not summary["cars"]:
+            await callback.message.edit_text(
+                "❌ Автомобиль не найден",
+                reply_markup=get_back_keyboard()
+            )
+            await callback.answer()
+            return
+        
+        car_name = summary["cars"][0]["name"]
+        text = format_rental_summary(f"📈 Статистика по {car_name}:", summary, with_cars=False)
+        
+        await callback.message.edit_text(text, reply_markup=get_back_keyboard())
+    finally:
+        await session.close()
     
-    from bot.keyboards.keyboards import get_statistics_period_keyboard
-    await callback.message.edit_text(
-        "📈 Выберите период для статистики:",
-        reply_markup=get_statistics_period_keyboard()
-    )
     await callback.answer()
 
 
 @router.callback_query(F.data.startswith("period_"))
-async def show_car_statistics(callback: CallbackQuery, state: FSMContext):
-    """Показать статистику по конкретному авто или по всем"""
+async def show_period_statistics(callback: CallbackQuery, state: FSMContext):
+    """Статистика аренды за один период (кнопки периодов из старых сообщений)"""
     data = await state.get_data()
     car_id = data.get('stats_car_id')
     period = callback.data.split("_")[1]
+    if period not in PERIODS:
+        period = "all"
     
     session = db.get_session()
     
     try:
-        if car_id:
-            # Статистика по конкретному авто
-            income = await RentalStatistics.get_income_by_car(session, car_id, period)
-            
-            car = await session.execute(select(Car).where(Car.id == car_id))
-            car = car.scalar_one()
-            
-            period_text = {
-                "day": "за день",
-                "week": "за неделю",
-                "month": "за месяц",
-                "all": "за всё время"
-            }.get(period, "за всё время")
-            
-            text = f"📈 Статистика по {car.name} {period_text}:\n\n"
-            text += f"💵 Доход: {income:.2f}₽"
-            
-            await callback.message.edit_text(text, reply_markup=get_back_keyboard())
-        else:
-            # Статистика по всем авто
-            user = await session.execute(
-                select(User).where(User.telegram_id == callback.from_user.id)
+        user = await afind_user(session, callback.from_user.id)
+        
+        if not user:
+            await callback.message.edit_text(
+                "❌ У вас нет данных",
+                reply_markup=get_back_keyboard()
             )
-            user = user.scalar_one_or_none()
-            
-            if not user:
-                await callback.message.edit_text(
-                    "❌ У вас нет данных",
-                    reply_markup=get_back_keyboard()
-                )
-                await callback.answer()
-                return
-            
-            income = await RentalStatistics.get_total_income(session, user.id, period)
-            
-            period_text = {
-                "day": "за день",
-                "week": "за неделю",
-                "month": "за месяц",
-                "all": "за всё время"
-            }.get(period, "за всё время")
-            
-            text = f"📈 Статистика аренды {period_text}:\n\n"
-            text += f"💵 Доход: {income:.2f}₽"
-            
-            await callback.message.edit_text(text, reply_markup=get_back_keyboard())
+            await callback.answer()
+            return
+        
+        summary = await RentalStatistics.get_summary(session, user.id, car_id=car_id)
+        if car_id and summary["cars"]:
+            text = f"📈 Статистика по {summary['cars'][0]['name']} {PERIOD_TITLES[period]}:\n\n"
+        else:
+            text = f"📈 Статистика аренды {PERIOD_TITLES[period]}:\n\n"
+        text += f"💵 Доход: {summary['total'][period]:.2f}₽"
+        
+        await callback.message.edit_text(text, reply_markup=get_back_keyboard())
     finally:
         await session.close()
     
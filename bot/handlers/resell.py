@@ -5,8 +5,9 @@ from aiogram.fsm.state import StatesGroup, State
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from bot.models.database import User, Item, Sale, CategoryEnum
+from bot.models.database import Item, Sale, CategoryEnum
 from bot.models.init_db import db
+from bot.models.users import afind_user, aget_or_create_user
 from bot.keyboards.keyboards import (
     get_resell_menu, get_category_keyboard, get_back_keyboard, get_cancel_keyboard
 )
@@ -108,15 +109,7 @@ async def receive_item_photo(message: Message, state: FSMContext):
     
     try:
         # Получаем или создаем пользователя
-        user = await session.execute(
-            select(User).where(User.telegram_id == message.from_user.id)
-        )
-        user = user.scalar_one_or_none()
-        
-        if not user:
-            user = User(telegram_id=message.from_user.id, username=message.from_user.username)
-            session.add(user)
-            await session.flush()
+        user = await aget_or_create_user(session, message.from_user.id, message.from_user.username)
         
         # Получаем file_id если загружена фотография
         photo_file_id = None
@@ -153,10 +146,7 @@ async def show_inventory(callback: CallbackQuery, state: FSMContext):
     session = db.get_session()
     
     try:
-        user = await session.execute(
-            select(User).where(User.telegram_id == callback.from_user.id)
-        )
-        user = user.scalar_one_or_none()
+        user = await afind_user(session, callback.from_user.id)
         
         if not user:
             await callback.message.edit_text(
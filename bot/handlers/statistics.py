@@ -3,35 +3,29 @@ from aiogram.types import CallbackQuery
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from bot.models.database import User
 from bot.models.init_db import db
-from bot.keyboards.keyboards import get_statistics_period_keyboard, get_back_keyboard
-from bot.utils.statistics import ResellStatistics, RentalStatistics
+from bot.models.users import afind_user
+from bot.keyboards.keyboards import get_back_keyboard
+from bot.utils.statistics import ResellStatistics, PERIODS
 
 router = Router()
 
 
-@router.callback_query(F.data == "resell_statistics")
-async def show_resell_statistics_menu(callback: CallbackQuery):
-    """Показать меню выбора периода для статистики перекупа"""
-    await callback.message.edit_text(
-        "📈 Выберите период для статистики:",
-        reply_markup=get_statistics_period_keyboard()
-    )
-    await callback.answer()
+PERIOD_TITLES = {
+    "day": "📅 За день",
+    "week": "🗓 За неделю",
+    "month": "📆 За месяц",
+    "all": "♾ За всё время",
+}
 
 
-@router.callback_query(F.data.startswith("period_"))
+@router.callback_query(F.data == "resell_statistics")
 async def show_resell_statistics(callback: CallbackQuery):
-    """Показать статистику перекупа за выбранный период"""
-    period = callback.data.split("_")[1]
+    """Показать статистику перекупа сразу за все периоды (один запрос)"""
     session = db.get_session()
     
     try:
-        user = await session.execute(
-            select(User).where(User.telegram_id == callback.from_user.id)
-        )
-        user = user.scalar_one_or_none()
+        user = await afind_user(session, callback.from_user.id)
         
         if not user:
             await callback.message.edit_text(
@@ -41,27 +35,21 @@ async def show_resell_statistics(callback: CallbackQuery):
             await callback.answer()
             return
         
-        # Получаем статистику
-        income = await ResellStatistics.get_income(session, user.id, period)
-        expenses = await ResellStatistics.get_expenses(session, user.id, period)
-        profit = await ResellStatistics.get_profit(session, user.id, period)
-        
-        period_text = {
-            "day": "за день",
-            "week": "за неделю",
-            "month": "за месяц",
-            "all": "за всё время"
-        }.get(period, "за всё время")
+        summary = await ResellStatistics.get_summary(session, user.id)
         
-        text = f"📈 Статистика {period_text}:\n\n"
-        text += f"💵 Доход: {income:.2f}₽\n"
-        text += f"💸 Расходы: {expenses:.2f}₽\n"
-        text += f"📊 Прибыль: {profit:.2f}₽\n"
+        text = "📈 Статистика перекупа:\n"
+        for period in PERIODS:
+            stats = summary[period]
+            text += f"\n{PERIOD_TITLES[period]}:\n"
+            text += f"💵 Доход: {stats['income']:.2f}₽\n"
+            text += f"💸 Расходы: {stats['expenses']:.2f}₽\n"
+            text += f"📊 Прибыль: {stats['profit']:.2f}₽\n"
         
+        profit = summary["all"]["profit"]
         if profit > 0:
-            text += f"✅ Успешно!"
+            text += f"\n✅ Успешно!"
         elif profit < 0:
-            text += f"⚠️ Убыток!"
+            text += f"\n⚠️ Убыток!"
         
         await callback.message.edit_text(text, reply_markup=get_back_keyboard())
     finally:
@@ -76,10 +64,7 @@ async def show_sales_history(callback: CallbackQuery):
     session = db.get_session()
     
     try:
-        user = await session.execute(
-            select(User).where(User.telegram_id == callback.from_user.id)
-        )
-        user = user.scalar_one_or_none()
+        user = await afind_user(session, callback.from_user.id)
         
         if not user:
             await callback.message.edit_text(
@@ -128,13 +113,3 @@ async def show_sales_history(callback: CallbackQuery):
         await session.close()
     
     await callback.answer()
-
-
-@router.callback_query(F.data == "rental_statistics")
-async def show_rental_statistics_menu(callback: CallbackQuery):
-    """Показать меню выбора периода для статистики аренды"""
-    await callback.message.edit_text(
-        "📈 Выберите период для статистики:",
-        reply_markup=get_statistics_period_keyboard()
-    )
-    await callback.answer()
@@ -1,19 +1,26 @@
 import asyncio
 import logging
+import signal
 import subprocess
+import sys
 import os
 from pathlib import Path
 import ssl
 from datetime import datetime, timedelta
 from aiogram import Bot, Dispatcher
 from aiogram.types import BotCommand, MenuButtonWebApp, MenuButtonDefault, WebAppInfo
-from aiogram.fsm.storage.memory import MemoryStorage
 import threading
 
-from bot.config import BOT_TOKEN
+from bot.config import (
+    BOT_TOKEN, WEB_SERVER, WEB_WORKERS, WEB_THREADS,
+    BOT_UPDATES, WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_PATH, PROCESS_ROLE, set_process_role
+)
 from bot.models.init_db import db
 from bot.handlers import navigation, resell, statistics, rental
-from bot.tasks.notifications import check_rental_notifications
+from bot.tasks.scheduler import run_scheduler
+from bot.tasks.outbox import send_outbox_messages
+from bot.tasks.leader import run_as_leader
+from bot.utils.fsm_storage import DatabaseStorage
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -145,56 +152,8 @@ async def set_default_app_button(bot: Bot):
     except Exception as e:
         logger.error(f"❌ Ошибка при установке Default Web App Button: {e}")
 
-async def main():
-    """Главная функция"""
-    # Логируем информацию о конфигурации
-    from bot.config import DATABASE_URL
-    logger.info(f"🔍 Database configuration:")
-    logger.info(f"   DATABASE_URL: {DATABASE_URL}")
-    
-    if "postgresql" in DATABASE_URL or "postgres" in DATABASE_URL:
-        logger.info(f"   Using PostgreSQL (persistent database)")
-        # Запускаем миграции для PostgreSQL
-        logger.info("🔧 Running PostgreSQL migrations...")
-        try:
-            from migrate_postgresql import migrate_postgresql
-            success = migrate_postgresql()
-            if not success:
-                logger.warning("⚠️ Migrations completed with warnings, but continuing...")
-        except Exception as e:
-            logger.warning(f"⚠️ Could not run migrations: {e}")
-            import traceback
-            logger.warning(traceback.format_exc())
-    else:
-        logger.info(f"   Using SQLite (local)")
-    
-    logger.info(f"   RAILWAY_ENVIRONMENT: {os.getenv('RAILWAY_ENVIRONMENT', 'NOT SET')}")
-    
-    # Инициализируем БД
-    await db.init()
-    logger.info("✅ Database initialized")
-    
-    # Создаем бот и диспетчер
-    bot = Bot(token=BOT_TOKEN)
-    storage = MemoryStorage()
-    dp = Dispatcher(storage=storage)
-    
-    # Регистрируем роутеры
-    dp.include_router(navigation.router)
-    dp.include_router(resell.router)
-    dp.include_router(statistics.router)
-    dp.include_router(rental.router)
-    
-    # Устанавливаем команды
-    await set_bot_commands(bot)
-    logger.info("Bot commands set")
-    
-    # Устанавливаем Menu Button
-    await set_menu_button(bot)
-    
-    # Устанавливаем Default Web App Button
-    await set_default_app_button(bot)
-    
+def start_web_thread():
+    """Запустить Flask dev-сервер в daemon-потоке бота (локальная разработка)"""
     # На production (Railway) используем HTTP без SSL
     # Railway автоматически добавляет HTTPS на уровне reverse proxy
     logger.info("🔧 Importing Flask web server...")
@@ -243,19 +202,302 @@ async def main():
     else:
         logger.info(f"✅ Web server thread is alive and listening on 0.0.0.0:{port}")
     
-    # Запускаем фоновую задачу уведомлений
-    notification_task = asyncio.create_task(check_rental_notifications(bot))
+    return web_thread
+
+
+def start_asgi_server(api: bool = True):
+    """Запустить ASGI-сервер (bot.web.asgi) задачей в event loop процесса.
+
+    api=False - только приём webhook, без Flask-приложения (роль bot).
+    """
+    from bot.web.asgi import serve_api
+
+    port = int(os.getenv("PORT", "5000"))
+    cert_file = key_file = None
+    if os.getenv("RAILWAY_ENVIRONMENT") is None:
+        # Локально: HTTPS, если есть сертификаты (на Railway HTTPS даёт reverse proxy)
+        cert_file, key_file = ensure_ssl_certs()
+    logger.info(f"🌐 Starting ASGI web server in the event loop on port {port} (API: {api})")
+    return asyncio.create_task(serve_api(port, cert_file, key_file, api=api))
+
+
+def check_webhook_config(role: str):
+    """Остановить запуск, если webhook выбран, но Telegram некуда слать апдейты.
+
+    Без явного WEBHOOK_URL (или с адресом веб-сервиса у роли bot, где нет пути
+    webhook) Telegram получал бы 404, и апдейты терялись бы.
+    """
+    if BOT_UPDATES != "webhook" or role not in ("all", "bot"):
+        return
+    if not WEBHOOK_URL:
+        raise SystemExit("BOT_UPDATES=webhook needs WEBHOOK_URL - public URL of the process that receives updates")
+    web_app_url = os.getenv("WEB_APP_URL", "").rstrip("/")
+    if role == "bot" and WEBHOOK_URL == web_app_url:
+        raise SystemExit(
+            "Role 'bot' receives the webhook on its own server: WEBHOOK_URL must be the bot service URL, "
+            "not WEB_APP_URL"
+        )
+
+
+def use_webhook(role: str = "all") -> bool:
+    """Режим webhook, если он выбран и возможен; иначе - polling.
+
+    Роль all принимает webhook на общем ASGI-сервере (нужен WEB_SERVER=asgi),
+    роль bot поднимает для него свой сервер без API.
+    """
+    if BOT_UPDATES != "webhook":
+        return False
+    if role == "all" and WEB_SERVER != "asgi":
+        logger.warning(f"⚠️  BOT_UPDATES=webhook needs WEB_SERVER=asgi (now {WEB_SERVER}), falling back to polling")
+        return False
+    return True
+
+
+async def wait_for_stop(*tasks):
+    """Ждать SIGTERM/SIGINT или завершения любой из задач (её ошибка пробрасывается)"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    stop_task = asyncio.create_task(stop.wait())
+    try:
+        done, _pending = await asyncio.wait({stop_task, *tasks}, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task is not stop_task and not task.cancelled():
+                task.result()
+    finally:
+        stop_task.cancel()
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, web_task):
+    """Получать апдейты через webhook до SIGTERM/SIGINT или остановки веб-сервера.
+
+    Webhook при остановке не снимается: пока процесс перезапускается, Telegram
+    копит апдейты и доставит их новому процессу.
+    """
+    from bot.web.asgi import mount_webhook
+
+    webhook = mount_webhook(WEBHOOK_PATH, WEBHOOK_SECRET, bot, dp)
+    await dp.emit_startup(bot=bot, dispatcher=dp, bots=[bot])
+    await bot.set_webhook(
+        f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logger.info(f"✅ Webhook set: {WEBHOOK_URL}/telegram/webhook/***")
+
+    try:
+        await wait_for_stop(web_task)
+    finally:
+        await webhook.close()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, bots=[bot])
+        logger.info("Webhook stopped")
+
+
+async def receive_updates(bot: Bot, dp: Dispatcher, web_task, role: str):
+    """Получать апдейты: webhook на ASGI-сервере или polling"""
+    if web_task is not None and use_webhook(role):
+        await run_webhook(bot, dp, web_task)
+        return
+    # getUpdates не работает, пока установлен webhook
+    await bot.delete_webhook()
+    logger.info("Starting bot polling...")
+    await dp.start_polling(bot)
+
+
+def start_background_tasks(bot: Bot):
+    """Планировщик (аренды, таймеры) и отправка outbox - только в реплике-лидере"""
+    return asyncio.create_task(run_as_leader(
+        "background", lambda: [run_scheduler(), send_outbox_messages(bot)]
+    ))
+
+
+def start_gunicorn():
+    """Запустить веб-сервер в отдельном процессе gunicorn (см. gunicorn.conf.py)"""
+    config_path = Path(__file__).parent.parent / "gunicorn.conf.py"
+    command = [sys.executable, "-m", "gunicorn", "-c", str(config_path), "bot.web.app:app"]
+    logger.info(f"🚀 Starting gunicorn: {' '.join(command)}")
+    logger.info(f"   Workers: {WEB_WORKERS}, threads: {WEB_THREADS}")
+    return subprocess.Popen(command)
+
+
+def stop_gunicorn(process):
+    """Остановить процесс gunicorn (SIGTERM - graceful shutdown)"""
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    logger.info("Web server process stopped")
+
+
+async def init_database():
+    """Миграции PostgreSQL и инициализация async-движка (нужны любой роли)"""
+    # Логируем информацию о конфигурации
+    from bot.config import DATABASE_URL
+    logger.info(f"🔍 Database configuration:")
+    logger.info(f"   DATABASE_URL: {DATABASE_URL}")
+    
+    if "postgresql" in DATABASE_URL or "postgres" in DATABASE_URL:
+        logger.info(f"   Using PostgreSQL (persistent database)")
+        # Запускаем миграции для PostgreSQL
+        logger.info("🔧 Running PostgreSQL migrations...")
+        try:
+            from migrate_postgresql import migrate_postgresql
+            success = migrate_postgresql()
+            if not success:
+                logger.warning("⚠️ Migrations completed with warnings, but continuing...")
+        except Exception as e:
+            logger.warning(f"⚠️ Could not run migrations: {e}")
+            import traceback
+            logger.warning(traceback.format_exc())
+    else:
+        logger.info(f"   Using SQLite (local)")
+    
+    logger.info(f"   RAILWAY_ENVIRONMENT: {os.getenv('RAILWAY_ENVIRONMENT', 'NOT SET')}")
+    
+    # Инициализируем БД
+    await db.init()
+    logger.info("✅ Database initialized")
+
+
+async def create_dispatcher(bot: Bot) -> Dispatcher:
+    """Диспетчер с роутерами; заодно команды и кнопки Web App бота"""
+    # Состояния сценариев - в БД: переживают деплой и общие для реплик
+    storage = DatabaseStorage(db)
+    dp = Dispatcher(storage=storage)
+    
+    # Регистрируем роутеры
+    dp.include_router(navigation.router)
+    dp.include_router(resell.router)
+    dp.include_router(statistics.router)
+    dp.include_router(rental.router)
+    
+    # Устанавливаем команды
+    await set_bot_commands(bot)
+    logger.info("Bot commands set")
+    
+    # Устанавливаем Menu Button
+    await set_menu_button(bot)
+    
+    # Устанавливаем Default Web App Button
+    await set_default_app_button(bot)
+    return dp
+
+
+async def run_all():
+    """Всё в одном процессе: бот, веб-сервер (WEB_SERVER), планировщик и outbox"""
+    bot = Bot(token=BOT_TOKEN)
+    dp = await create_dispatcher(bot)
+    
+    web_process = None
+    web_task = None
+    if WEB_SERVER == "asgi":
+        # API в том же loop и на том же пуле, что и бот: без потоков и второго движка
+        web_task = start_asgi_server()
+    elif WEB_SERVER == "gunicorn":
+        # Production: отдельный процесс gunicorn (несколько воркеров и потоков),
+        # API не делит GIL с polling'ом бота
+        web_process = start_gunicorn()
+    elif WEB_SERVER == "none":
+        logger.info("⚪ Web server disabled (WEB_SERVER=none)")
+    else:
+        start_web_thread()
+    
+    # Запускаем фоновые задачи: планировщик (аренды, таймеры) и отправку сообщений из outbox
+    background_task = start_background_tasks(bot)
     
-    # Запускаем polling
     try:
-        logger.info("Starting bot polling...")
-        await dp.start_polling(bot)
+        await receive_updates(bot, dp, web_task, "all")
     finally:
-        notification_task.cancel()
+        background_task.cancel()
+        await asyncio.gather(background_task, return_exceptions=True)
+        if web_process is not None:
+            stop_gunicorn(web_process)
+        if web_task is not None:
+            web_task.cancel()
+            await asyncio.gather(web_task, return_exceptions=True)
         await bot.session.close()
+
+
+async def run_web():
+    """Только API (ASGI): без Bot, Dispatcher и фоновых задач"""
+    if WEB_SERVER != "asgi":
+        # gunicorn запускается сам: gunicorn -c gunicorn.conf.py bot.web.app:app
+        raise SystemExit(f"Role 'web' serves the ASGI API, WEB_SERVER={WEB_SERVER} is not supported")
+    web_task = start_asgi_server()
+    try:
+        await wait_for_stop(web_task)
+    finally:
+        web_task.cancel()
+        await asyncio.gather(web_task, return_exceptions=True)
+
+
+async def run_bot():
+    """Только апдейты Telegram: обработчики, polling или webhook (свой сервер без API).
+
+    Сообщения outbox и события планировщика обрабатывает роль scheduler: записи
+    отсюда она подхватывает опросом outbox и NOTIFY/пересинхронизацией.
+    """
+    bot = Bot(token=BOT_TOKEN)
+    dp = await create_dispatcher(bot)
+    web_task = start_asgi_server(api=False) if use_webhook("bot") else None
+    try:
+        await receive_updates(bot, dp, web_task, "bot")
+    finally:
+        if web_task is not None:
+            web_task.cancel()
+            await asyncio.gather(web_task, return_exceptions=True)
+        await bot.session.close()
+
+
+async def run_scheduler_worker():
+    """Только фоновые задачи: планировщик (аренды, таймеры) и отправка outbox.
+
+    Bot нужен лишь для отправки сообщений - апдейты здесь не принимаются.
+    Реплик может быть несколько: задачи работают в лидере, остальные ждут.
+    """
+    bot = Bot(token=BOT_TOKEN)
+    background_task = start_background_tasks(bot)
+    logger.info("⏰ Scheduler worker started")
+    try:
+        await wait_for_stop(background_task)
+    finally:
+        background_task.cancel()
+        await asyncio.gather(background_task, return_exceptions=True)
+        await bot.session.close()
+
+
+ROLE_RUNNERS = {
+    "all": run_all,
+    "web": run_web,
+    "bot": run_bot,
+    "scheduler": run_scheduler_worker,
+}
+
+
+async def main(role: str = None):
+    """Главная функция: role (или PROCESS_ROLE) - какую часть приложения запускать"""
+    role = (role or PROCESS_ROLE).lower()
+    if role not in ROLE_RUNNERS:
+        raise SystemExit(f"Unknown role '{role}', expected one of: {', '.join(ROLE_RUNNERS)}")
+    check_webhook_config(role)
+    # Роль из аргумента видна остальным модулям (кэши, бюджет пула) через bot.config
+    set_process_role(role)
+    logger.info(f"🚀 Starting process role: {role}")
+    
+    await init_database()
+    try:
+        await ROLE_RUNNERS[role]()
+    finally:
         await db.close()
         logger.info("Bot stopped")
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else None))
@@ -1,16 +1,40 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey, Enum, BigInteger
+from sqlalchemy import Column, Integer, String, Float, DateTime, Date, Boolean, Text, ForeignKey, Enum, BigInteger, Index
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from datetime import datetime
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import event, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
 import enum
 
+from bot.utils.datetime_helper import get_moscow_date, get_bp_day, bp_day_date, utc_now, to_utc
+from bot.utils.bp_history import BP_DAY_BITS, task_mask
+
 Base = declarative_base()
 
-# Импортируем функцию для получения времени в Москве
-def get_current_moscow_time():
-    """Получить текущее время в Москве"""
-    from bot.utils.datetime_helper import get_moscow_now
-    return get_moscow_now()
+
+class UTCDateTime(TypeDecorator):
+    """Время в UTC с tzinfo.
+
+    PostgreSQL хранит его как timestamptz, SQLite - как UTC без смещения;
+    из БД всегда возвращается aware UTC. Время без tzinfo на входе считается UTC.
+    """
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        value = to_utc(value)
+        if dialect.name == "sqlite":
+            return value.replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return to_utc(value)
 
 
 class CategoryEnum(enum.Enum):
@@ -27,8 +51,9 @@ class User(Base):
     id = Column(Integer, primary_key=True)
     telegram_id = Column(BigInteger, unique=True, nullable=False)  # BigInteger для поддержки больших ID
     username = Column(String(255), nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(UTCDateTime, default=utc_now)
     has_platinum_vip = Column(Boolean, default=False)  # Есть ли платинум VIP
+    bp_total_earned = Column(Integer, nullable=True)  # Счётчик BP за всё время (NULL - ещё не посчитан)
     
     items = relationship("Item", back_populates="user", cascade="all, delete-orphan")
     cars = relationship("Car", back_populates="user", cascade="all, delete-orphan")
@@ -39,13 +64,17 @@ class User(Base):
 
 class Item(Base):
     __tablename__ = "items"
+    __table_args__ = (
+        # Инвентарь и проданные товары пользователя
+        Index("ix_items_user_sold", "user_id", "sold"),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     name = Column(String(255), nullable=False)
     category = Column(Enum(CategoryEnum), nullable=False)
     purchase_price = Column(Float, nullable=False)
-    purchase_date = Column(DateTime, default=datetime.utcnow)
+    purchase_date = Column(UTCDateTime, default=utc_now)
     comment = Column(Text, nullable=True)
     photo_file_id = Column(String(255), nullable=True)
     sold = Column(Boolean, default=False)
@@ -58,9 +87,9 @@ class Sale(Base):
     __tablename__ = "sales"
     
     id = Column(Integer, primary_key=True)
-    item_id = Column(Integer, ForeignKey("items.id"), nullable=False)
+    item_id = Column(Integer, ForeignKey("items.id"), nullable=False, index=True)
     sale_price = Column(Float, nullable=False)
-    sale_date = Column(DateTime, default=get_current_moscow_time)  # Используем Московское время
+    sale_date = Column(UTCDateTime, default=utc_now, index=True)
     
     item = relationship("Item", back_populates="sale")
 
@@ -69,10 +98,10 @@ class Car(Base):
     __tablename__ = "cars"
     
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     name = Column(String(255), nullable=False)
     cost = Column(Float, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(UTCDateTime, default=utc_now)
     
     user = relationship("User", back_populates="cars")
     rentals = relationship("Rental", back_populates="car", cascade="all, delete-orphan")
@@ -80,16 +109,27 @@ class Car(Base):
 
 class Rental(Base):
     __tablename__ = "rentals"
+    __table_args__ = (
+        # Активные аренды пользователя (rental_end > now)
+        Index("ix_rentals_user_rental_end", "user_id", "rental_end"),
+        # Поиск неуведомлённых закончившихся аренд
+        Index("ix_rentals_notified_rental_end", "notified", "rental_end"),
+        # Доход пользователя за период (rental_start >= начало периода)
+        Index("ix_rentals_user_start_income", "user_id", "rental_start", "total_income"),
+        # Доход по машинам (группировка по car_id без чтения таблицы)
+        Index("ix_rentals_car_start_income", "car_id", "rental_start", "total_income"),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    car_id = Column(Integer, ForeignKey("cars.id"), nullable=False)
+    car_id = Column(Integer, ForeignKey("cars.id"), nullable=False, index=True)
     price_per_hour = Column(Float, nullable=False)
     hours = Column(Integer, nullable=False)
-    rental_start = Column(DateTime, default=get_current_moscow_time)
-    rental_end = Column(DateTime, nullable=False)
+    rental_start = Column(UTCDateTime, default=utc_now)
+    rental_end = Column(UTCDateTime, nullable=False)
     is_past = Column(Boolean, default=False)  # Флаг для уже прошедших аренд
     notified = Column(Boolean, default=False)
+    total_income = Column(Float, nullable=True)  # price_per_hour * hours, поддерживается при записи
     
     user = relationship("User", back_populates="rentals")
     car = relationship("Car", back_populates="rentals")
@@ -97,30 +137,52 @@ class Rental(Base):
 
 class BuyPrice(Base):
     __tablename__ = "buy_prices"
+    __table_args__ = (
+        # Общая лента скупа: сортировка и курсорная пагинация по (created_at, id)
+        # (покрывает и запросы только по created_at)
+        Index("ix_buy_prices_created_at_id", "created_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    item_id = Column(Integer, ForeignKey("items.id"), nullable=True)  # Связь с товаром
+    item_id = Column(Integer, ForeignKey("items.id"), nullable=True, index=True)  # Связь с товаром
     seller_name = Column(String(255), nullable=True)  # Имя того, кто добавил цену
     item_name = Column(String(255), nullable=False)
     price = Column(Float, nullable=False)
     price_text = Column(String(255), nullable=True)  # Оригинальный текст (300-350к, 5G и т.д.)
     sale_price = Column(Float, nullable=True)  # Цена продажи (заполняется при продаже)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(UTCDateTime, default=utc_now)
     
     user = relationship("User", back_populates="buy_prices")
     item = relationship("Item", backref="buy_price_record")
 
 
+class BuyPriceTotals(Base):
+    """Итоги общей ленты скупа (одна строка, поддерживается при вставке/удалении BuyPrice)"""
+    __tablename__ = "buy_price_totals"
+    
+    id = Column(Integer, primary_key=True)
+    purchases_count = Column(Integer, nullable=False, default=0)
+    total_price = Column(Float, nullable=False, default=0)
+
+
 class BPTask(Base):
     """Задания для фарма BP"""
     __tablename__ = "bp_tasks"
+    __table_args__ = (
+        # Бит в bp_day_bits уникален: два задания с одним битом портили бы историю друг друга
+        Index(
+            "uq_bp_tasks_bit", "bit", unique=True,
+            postgresql_where=text("bit IS NOT NULL"), sqlite_where=text("bit IS NOT NULL")
+        ),
+    )
     
     id = Column(Integer, primary_key=True)
     name = Column(String(255), nullable=False)
     category = Column(String(50), nullable=False)  # "Легкие", "Средние", "Тяжелые"
     bp_without_vip = Column(Integer, nullable=False)  # BP без платинум VIP
     bp_with_vip = Column(Integer, nullable=False)    # BP с платинум VIP
+    bit = Column(Integer, nullable=True)  # Номер бита в bp_day_bits.bits (назначается при вставке)
     
     completions = relationship("BPCompletion", back_populates="task", cascade="all, delete-orphan")
 
@@ -128,14 +190,350 @@ class BPTask(Base):
 class BPCompletion(Base):
     """Отслеживание выполнения BP заданий"""
     __tablename__ = "bp_completions"
+    __table_args__ = (
+        # Выполненные за BP-день задания (get-bp-tasks / toggle-bp-task) и BP за период (get-bp-stats)
+        Index("ix_bp_completions_user_bp_day", "user_id", "bp_day", "is_completed"),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     task_id = Column(Integer, ForeignKey("bp_tasks.id"), nullable=False)
-    completed_at = Column(DateTime, default=get_current_moscow_time)
-    completed_date = Column(DateTime, nullable=False)  # Дата в Москве (для группировки по дням)
+    completed_at = Column(UTCDateTime, default=utc_now)
+    completed_date = Column(UTCDateTime, nullable=False)  # Начало BP-дня
+    bp_day = Column(Integer, nullable=True)  # Номер BP-дня (get_bp_day), заполняется при вставке
     is_completed = Column(Boolean, default=True)
     bp_earned = Column(Integer, nullable=False)  # Сколько BP получено (с учётом VIP)
     
     user = relationship("User")
-    task = relationship("BPTask", back_populates="completions")
\ No newline at end of file
+    task = relationship("BPTask", back_populates="completions")
+
+
+class DailyUserStats(Base):
+    """Дневные итоги пользователя по московскому дню.
+
+    Поддерживаются событиями ниже в той же транзакции, что и запись товара,
+    продажи, аренды или BP-задания; полный пересчёт - rebuild_daily_stats.py.
+    """
+    __tablename__ = "daily_user_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    income = Column(Float, nullable=False, default=0)  # Продажи за день
+    expenses = Column(Float, nullable=False, default=0)  # Закупка проданных товаров, купленных в этот день
+    profit = Column(Float, nullable=False, default=0)  # Прибыль продаж за день (продажа - закупка)
+    sales_count = Column(Integer, nullable=False, default=0)
+    purchases = Column(Float, nullable=False, default=0)  # Закупка всех товаров, купленных в этот день
+    purchases_count = Column(Integer, nullable=False, default=0)
+    rental_income = Column(Float, nullable=False, default=0)  # Доход аренд, начатых в этот день
+    rental_hours = Column(Integer, nullable=False, default=0)
+    rentals_count = Column(Integer, nullable=False, default=0)
+    bp_earned = Column(Integer, nullable=False, default=0)  # BP за BP-день, начинающийся в этот день
+
+
+class BPDayBits(Base):
+    """Выполненные за BP-день задания пользователя одним числом.
+
+    Бит BPTask.bit установлен, если задание выполнено; bp_earned - сумма BP
+    за день. Ведётся событиями BPCompletion и хранит историю и после того,
+    как старые bp_completions удалены (compact_bp_history.py).
+    """
+    __tablename__ = "bp_day_bits"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    bp_day = Column(Integer, primary_key=True)
+    bits = Column(BigInteger, nullable=False, default=0)
+    bp_earned = Column(Integer, nullable=False, default=0)
+
+
+# Колонки-счётчики DailyUserStats (всё, кроме ключа)
+DAILY_STATS_COLUMNS = (
+    "income", "expenses", "profit", "sales_count", "purchases", "purchases_count",
+    "rental_income", "rental_hours", "rentals_count", "bp_earned",
+)
+
+
+class Timer(Base):
+    """Таймеры пользователя (вкладка «Таймеры»); уведомление отправляет планировщик бота"""
+    __tablename__ = "timers"
+    __table_args__ = (
+        # Загрузка идущих таймеров планировщиком
+        Index("ix_timers_paused_end_time", "is_paused", "end_time"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    name = Column(String(255), nullable=False)
+    duration = Column(Integer, nullable=False)  # Полная длительность, сек
+    end_time = Column(UTCDateTime, nullable=True)  # UTC окончания, пока таймер идёт
+    remaining = Column(Float, nullable=True)  # Остаток в секундах, пока таймер на паузе
+    is_paused = Column(Boolean, nullable=False, default=False)
+    created_at = Column(UTCDateTime, default=utc_now)
+
+    user = relationship("User")
+
+
+class OutboxMessage(Base):
+    """Исходящие сообщения Telegram (outbox): пишутся в транзакции вызывающего кода,
+    отправляются фоновой задачей бота (bot/tasks/outbox.py)"""
+    __tablename__ = "outbox_messages"
+    __table_args__ = (
+        # Выборка готовых к отправке сообщений по порядку
+        Index("ix_outbox_messages_available_at_id", "available_at", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(BigInteger, nullable=False)
+    text = Column(Text, nullable=False)
+    parse_mode = Column(String(20), nullable=True)
+    created_at = Column(UTCDateTime, default=utc_now)
+    available_at = Column(UTCDateTime, nullable=False, default=utc_now)  # UTC, не раньше которого отправлять
+    attempts = Column(Integer, nullable=False, default=0)
+
+
+class LeaderLease(Base):
+    """Аренда лидерства фоновых задач для SQLite (bot/tasks/leader.py).
+
+    Лидер продлевает expires_at; если он пропал, после истечения аренду
+    забирает другой процесс. На PostgreSQL вместо строки - advisory lock.
+    """
+    __tablename__ = "leader_leases"
+
+    name = Column(String(64), primary_key=True)
+    holder = Column(String(128), nullable=False)
+    expires_at = Column(UTCDateTime, nullable=False)
+
+
+class FSMRecord(Base):
+    """Состояние FSM aiogram (bot/utils/fsm_storage.py): переживает перезапуск и общее для реплик.
+
+    Запись продлевается при каждом изменении; истёкшие (брошенные сценарии)
+    не читаются и периодически удаляются.
+    """
+    __tablename__ = "fsm_states"
+
+    key = Column(String(255), primary_key=True)  # bot_id:chat_id:user_id:thread_id:destiny
+    state = Column(String(255), nullable=True)
+    data = Column(Text, nullable=True)  # JSON
+    expires_at = Column(UTCDateTime, nullable=False, index=True)
+
+
+def add_daily_stats(connection, user_id, day, **deltas):
+    """Прибавить значения к дневным итогам (INSERT ... ON CONFLICT DO UPDATE)"""
+    deltas = {name: value for name, value in deltas.items() if value}
+    if not deltas or user_id is None or day is None:
+        return
+
+    insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+    values = {name: 0 for name in DAILY_STATS_COLUMNS}
+    values.update(deltas)
+    stmt = insert(DailyUserStats).values(user_id=user_id, day=day, **values)
+    table = DailyUserStats.__table__
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.day],
+        set_={name: table.c[name] + stmt.excluded[name] for name in deltas},
+    )
+    connection.execute(stmt)
+
+
+def _old_value(target, name):
+    """Значение атрибута до изменения в текущем flush"""
+    history = inspect(target).attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(target, name)
+
+
+def _item_purchase(connection, item_id):
+    return connection.execute(
+        select(Item.user_id, Item.purchase_price, Item.purchase_date).where(Item.id == item_id)
+    ).first()
+
+
+@event.listens_for(Item, "after_insert")
+def _item_inserted(mapper, connection, target):
+    add_daily_stats(
+        connection, target.user_id, get_moscow_date(target.purchase_date),
+        purchases=target.purchase_price, purchases_count=1
+    )
+
+
+@event.listens_for(Item, "after_delete")
+def _item_deleted(mapper, connection, target):
+    add_daily_stats(
+        connection, target.user_id, get_moscow_date(target.purchase_date),
+        purchases=-target.purchase_price, purchases_count=-1
+    )
+
+
+def _apply_sale(connection, sale, sign):
+    item = _item_purchase(connection, sale.item_id)
+    if item is None:
+        return
+    user_id, purchase_price, purchase_date = item
+    sale_date = sale.sale_date or utc_now()
+    add_daily_stats(
+        connection, user_id, get_moscow_date(sale_date),
+        income=sign * sale.sale_price,
+        profit=sign * (sale.sale_price - purchase_price),
+        sales_count=sign
+    )
+    add_daily_stats(
+        connection, user_id, get_moscow_date(purchase_date),
+        expenses=sign * purchase_price
+    )
+
+
+@event.listens_for(Sale, "after_insert")
+def _sale_inserted(mapper, connection, target):
+    _apply_sale(connection, target, 1)
+
+
+@event.listens_for(Sale, "after_delete")
+def _sale_deleted(mapper, connection, target):
+    _apply_sale(connection, target, -1)
+
+
+# Доход аренды храним в строке, чтобы статистика считалась SUM по индексу
+@event.listens_for(Rental, "before_insert")
+@event.listens_for(Rental, "before_update")
+def _rental_total_income(mapper, connection, target):
+    target.total_income = (target.price_per_hour or 0) * (target.hours or 0)
+
+
+@event.listens_for(Rental, "after_insert")
+def _rental_inserted(mapper, connection, target):
+    add_daily_stats(
+        connection, target.user_id, get_moscow_date(target.rental_start),
+        rental_income=target.total_income, rental_hours=target.hours, rentals_count=1
+    )
+
+
+@event.listens_for(Rental, "after_update")
+def _rental_updated(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[name].history.has_changes() for name in ("rental_start", "hours", "total_income")):
+        return  # например, только notified
+    old_start = _old_value(target, "rental_start")
+    add_daily_stats(
+        connection, target.user_id, get_moscow_date(old_start),
+        rental_income=-(_old_value(target, "total_income") or 0),
+        rental_hours=-_old_value(target, "hours"),
+        rentals_count=-1
+    )
+    _rental_inserted(mapper, connection, target)
+
+
+@event.listens_for(Rental, "after_delete")
+def _rental_deleted(mapper, connection, target):
+    add_daily_stats(
+        connection, target.user_id, get_moscow_date(target.rental_start),
+        rental_income=-(target.total_income or 0), rental_hours=-target.hours, rentals_count=-1
+    )
+
+
+@event.listens_for(BPCompletion, "before_insert")
+def _bp_completion_day(mapper, connection, target):
+    if target.bp_day is None:
+        target.bp_day = get_bp_day(target.completed_at or utc_now())
+
+
+def _bp_day(completion):
+    return bp_day_date(completion.bp_day)
+
+
+def _set_bp_day_bit(connection, completion, completed: bool):
+    """Отметить/снять задание в bp_day_bits и поправить сумму BP за день"""
+    bit = connection.execute(select(BPTask.bit).where(BPTask.id == completion.task_id)).scalar()
+    mask = task_mask(bit) if bit is not None else 0
+    delta = completion.bp_earned if completed else -completion.bp_earned
+    table = BPDayBits.__table__
+
+    if completed:
+        insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+        stmt = insert(BPDayBits).values(
+            user_id=completion.user_id, bp_day=completion.bp_day, bits=mask, bp_earned=delta
+        )
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.bp_day],
+            set_={
+                "bits": table.c.bits.op("|")(stmt.excluded.bits),
+                "bp_earned": table.c.bp_earned + stmt.excluded.bp_earned,
+            },
+        ))
+    else:
+        connection.execute(
+            table.update().where(
+                table.c.user_id == completion.user_id,
+                table.c.bp_day == completion.bp_day
+            ).values(
+                bits=table.c.bits.op("&")(~mask),
+                bp_earned=table.c.bp_earned + delta
+            )
+        )
+
+
+@event.listens_for(BPCompletion, "after_insert")
+def _bp_completion_inserted(mapper, connection, target):
+    if target.is_completed:
+        add_daily_stats(connection, target.user_id, _bp_day(target), bp_earned=target.bp_earned)
+        _set_bp_day_bit(connection, target, True)
+
+
+@event.listens_for(BPCompletion, "after_update")
+def _bp_completion_updated(mapper, connection, target):
+    was_completed = _old_value(target, "is_completed")
+    if was_completed != target.is_completed:
+        delta = target.bp_earned if target.is_completed else -target.bp_earned
+        add_daily_stats(connection, target.user_id, _bp_day(target), bp_earned=delta)
+        _set_bp_day_bit(connection, target, target.is_completed)
+
+
+@event.listens_for(BPCompletion, "after_delete")
+def _bp_completion_deleted(mapper, connection, target):
+    if target.is_completed:
+        add_daily_stats(connection, target.user_id, _bp_day(target), bp_earned=-target.bp_earned)
+        _set_bp_day_bit(connection, target, False)
+
+
+@event.listens_for(BPTask, "after_insert")
+def _bp_task_inserted(mapper, connection, target):
+    # Свободный бит ищем после INSERT: задания одной пачки вставляются разом,
+    # а здесь уже видны биты, выданные предыдущим заданиям пачки.
+    # Параллельная вставка (другая реплика сидирует каталог) может занять тот же бит -
+    # тогда uq_bp_tasks_bit отклонит UPDATE в SAVEPOINT, и берём следующий свободный
+    if target.bit is not None:
+        return
+    for _attempt in range(BP_DAY_BITS):
+        taken = set(connection.execute(select(BPTask.bit).where(BPTask.bit != None)).scalars())
+        bit = next((bit for bit in range(BP_DAY_BITS) if bit not in taken), None)
+        if bit is None:
+            return  # заданий больше, чем бит: в bp_day_bits это задание не попадёт
+        try:
+            with connection.begin_nested():
+                connection.execute(BPTask.__table__.update().where(BPTask.id == target.id).values(bit=bit))
+        except IntegrityError:
+            continue
+        set_committed_value(target, "bit", bit)
+        return
+
+
+# Поддерживаем итоги скупа в той же транзакции, что и запись в buy_prices.
+# Если строки итогов ещё нет, UPDATE ничего не меняет - её создаст первый читатель.
+@event.listens_for(BuyPrice, "after_insert")
+def _buy_price_inserted(mapper, connection, target):
+    connection.execute(
+        BuyPriceTotals.__table__.update().where(BuyPriceTotals.id == 1).values(
+            purchases_count=BuyPriceTotals.purchases_count + 1,
+            total_price=BuyPriceTotals.total_price + (target.price or 0)
+        )
+    )
+
+
+@event.listens_for(BuyPrice, "after_delete")
+def _buy_price_deleted(mapper, connection, target):
+    connection.execute(
+        BuyPriceTotals.__table__.update().where(BuyPriceTotals.id == 1).values(
+            purchases_count=BuyPriceTotals.purchases_count - 1,
+            total_price=BuyPriceTotals.total_price - (target.price or 0)
+        )
+    )
@@ -0,0 +1,147 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from bot.models.database import Base
+
+logger = logging.getLogger(__name__)
+
+
+# Горячие запросы приложения и индексы, которые они должны использовать.
+# Используются для проверки планов (EXPLAIN) в migrate_indexes.py
+HOT_QUERIES = [
+    (
+        "get-bp-tasks: выполненные сегодня",
+        "bp_completions",
+        "SELECT task_id FROM bp_completions WHERE user_id = :user_id "
+        "AND bp_day = :id AND is_completed = :flag",
+    ),
+    (
+        "get-bp-stats / get-bp-history: BP-дни за период",
+        "bp_day_bits",
+        "SELECT bp_day, bits, bp_earned FROM bp_day_bits WHERE user_id = :user_id AND bp_day >= :id",
+    ),
+    (
+        "get-rentals: активные аренды",
+        "rentals",
+        "SELECT id FROM rentals WHERE user_id = :user_id AND rental_end > :start",
+    ),
+    (
+        "notifications: закончившиеся аренды",
+        "rentals",
+        "SELECT id FROM rentals WHERE notified = :flag AND rental_end <= :end",
+    ),
+    (
+        "get-cars: аренды машины",
+        "rentals",
+        "SELECT SUM(price_per_hour * hours) FROM rentals WHERE car_id = :id",
+    ),
+    (
+        "rental statistics: доход за период",
+        "rentals",
+        "SELECT SUM(total_income) FROM rentals WHERE user_id = :user_id AND rental_start >= :start",
+    ),
+    (
+        "rental statistics: доход по машинам",
+        "rentals",
+        "SELECT cars.id, SUM(rentals.total_income) FROM cars "
+        "LEFT OUTER JOIN rentals ON rentals.car_id = cars.id "
+        "WHERE cars.user_id = :user_id GROUP BY cars.id",
+    ),
+    (
+        "statistics: дневные итоги за период",
+        "daily_user_stats",
+        "SELECT SUM(income), SUM(expenses) FROM daily_user_stats WHERE user_id = :user_id AND day >= :start",
+    ),
+    (
+        "statistics: проданные товары",
+        "items",
+        "SELECT id FROM items WHERE user_id = :user_id AND sold = :flag",
+    ),
+    (
+        "get-sales: продажа товара",
+        "sales",
+        "SELECT id FROM sales WHERE item_id = :id",
+    ),
+    (
+        "sell-item: запись скупа товара",
+        "buy_prices",
+        "SELECT id FROM buy_prices WHERE item_id = :id",
+    ),
+    (
+        "get-purchases: лента скупа",
+        "buy_prices",
+        "SELECT id FROM buy_prices ORDER BY created_at DESC, id DESC LIMIT 50",
+    ),
+    (
+        "FSM storage: удаление истёкших состояний",
+        "fsm_states",
+        "DELETE FROM fsm_states WHERE expires_at <= :start",
+    ),
+]
+
+
+def ensure_indexes(bind):
+    """Создать индексы моделей, которых нет в существующих таблицах.
+
+    create_all создаёт индексы только вместе с новой таблицей, поэтому для
+    уже развёрнутых SQLite/PostgreSQL баз индексы добавляются здесь.
+    bind - Engine или Connection. Каждый индекс создаётся в своей транзакции
+    (на Connection - в SAVEPOINT): на PostgreSQL ошибка CREATE INDEX обрывает
+    транзакцию, и без этого следующие индексы и миграции падали бы вместе с ней.
+    """
+    created = 0
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                if isinstance(bind, Connection):
+                    with bind.begin_nested():
+                        index.create(bind=bind, checkfirst=True)
+                else:
+                    with bind.begin() as connection:
+                        index.create(bind=connection, checkfirst=True)
+                created += 1
+            except Exception as e:
+                logger.error(f"❌ Could not create index {index.name}: {e}")
+    logger.info(f"✅ Database indexes created/verified ({created})")
+
+
+def explain_hot_queries(engine):
+    """Планы горячих запросов: список (название, таблица, план, есть ли полный скан)"""
+    params = {
+        "user_id": 1,
+        "id": 1,
+        "flag": True,
+        "start": datetime(2000, 1, 1),
+        "end": datetime(2100, 1, 1),
+    }
+    is_postgres = engine.dialect.name == "postgresql"
+
+    results = []
+    with engine.connect() as connection:
+        if is_postgres:
+            # На маленьких таблицах планировщик выбирает Seq Scan даже при наличии индекса,
+            # запрещаем его, чтобы проверить, что индекс вообще применим
+            connection.execute(text("SET enable_seqscan = off"))
+
+        for name, table, sql in HOT_QUERIES:
+            prefix = "EXPLAIN " if is_postgres else "EXPLAIN QUERY PLAN "
+            rows = connection.execute(text(prefix + sql), params).fetchall()
+            if is_postgres:
+                plan = "\n".join(row[0] for row in rows)
+                full_scan = f"Seq Scan on {table}" in plan
+            else:
+                plan = "\n".join(row[-1] for row in rows)
+                # "SCAN t USING INDEX ..." - обход по индексу, полный скан - только "SCAN t"
+                full_scan = any(
+                    line.strip() in (f"SCAN {table}", f"SCAN TABLE {table}")
+                    for line in plan.splitlines()
+                )
+            results.append((name, table, plan, full_scan))
+
+        if is_postgres:
+            connection.execute(text("RESET enable_seqscan"))
+
+    return results
@@ -1,7 +1,13 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import text
-from bot.config import DATABASE_URL
+from bot.config import DATABASE_URL, DB_POOL_WARMUP
+from bot.models.pool import pool_kwargs, warm_up_async
+from bot.models.indexes import ensure_indexes
+from bot.models.migrations import (
+    add_rental_total_income, normalize_timestamps_to_utc, add_bp_day,
+    add_bp_task_bits, ensure_bp_day_bits, ensure_daily_stats
+)
 from bot.models.database import Base
 import logging
 
@@ -19,18 +25,29 @@ class Database:
         logger.info(f"📍 Database URL: {DATABASE_URL}")
 
         try:
-            self.engine = create_async_engine(DATABASE_URL, echo=False)
+            self.engine = create_async_engine(DATABASE_URL, echo=False, **pool_kwargs(DATABASE_URL, "bot"))
             self.async_session = sessionmaker(
                 self.engine, class_=AsyncSession, expire_on_commit=False
             )
 
             async with self.engine.begin() as conn:
                 await conn.run_sync(Base.metadata.create_all)
+                await conn.run_sync(add_rental_total_income)
+                await conn.run_sync(normalize_timestamps_to_utc)
+                await conn.run_sync(add_bp_day)
+                await conn.run_sync(add_bp_task_bits)
+                await conn.run_sync(ensure_bp_day_bits)
+                await conn.run_sync(ensure_daily_stats)
+                # Индексы для уже существующих таблиц
+                await conn.run_sync(ensure_indexes)
                 
                 # Автоматическая миграция telegram_id типа если это PostgreSQL
                 if "postgresql" in DATABASE_URL.lower():
                     await self._fix_telegram_id_type(conn)
 
+            if DB_POOL_WARMUP:
+                await warm_up_async(self.engine)
+
             logger.info("✅ Database initialized successfully")
         except Exception as e:
             logger.error(f"❌ Database initialization failed: {e}")
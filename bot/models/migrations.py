@@ -0,0 +1,309 @@
+import logging
+
+from sqlalchemy import inspect, text, select, insert, delete, update, table, column, bindparam, DateTime, Integer
+
+from bot.models.database import (
+    Item, Sale, Rental, BPTask, BPCompletion, BPDayBits, DailyUserStats, DAILY_STATS_COLUMNS
+)
+from bot.utils.datetime_helper import moscow_dates, to_naive_utc_many, get_bp_day, bp_day_date
+from bot.utils.bp_history import BP_DAY_BITS, task_mask
+
+logger = logging.getLogger(__name__)
+
+# Как старый код писал время в каждую колонку:
+#   "utc"   - datetime.utcnow() без tzinfo: стенные часы UTC в обеих БД
+#   "aware" - aware UTC (аренды): SQLite отбрасывает tzinfo -> UTC;
+#             PostgreSQL переводит в часовой пояс сессии
+#   "moscow" - aware московское время: SQLite -> московские стенные часы;
+#             PostgreSQL - часовой пояс сессии
+LEGACY_TIMESTAMPS = {
+    "users": {"created_at": "utc"},
+    "items": {"purchase_date": "utc"},
+    "sales": {"sale_date": "moscow"},
+    "cars": {"created_at": "utc"},
+    "rentals": {"rental_start": "aware", "rental_end": "aware"},
+    "buy_prices": {"created_at": "utc"},
+    "bp_completions": {"completed_at": "moscow", "completed_date": "moscow"},
+    "timers": {"end_time": "utc", "created_at": "utc"},
+    "outbox_messages": {"created_at": "utc", "available_at": "utc"},
+}
+
+# PRAGMA user_version SQLite-базы, начиная с которой все времена хранятся в UTC
+SQLITE_UTC_VERSION = 1
+
+# Ключ pg_advisory_xact_lock, чтобы бот и веб не мигрировали одновременно
+_PG_MIGRATION_LOCK = 710001
+
+
+def add_rental_total_income(connection):
+    """Добавить rentals.total_income и заполнить её для старых аренд.
+
+    Вызывается и ботом (conn.run_sync), и веб-сервером при старте;
+    connection - sync Connection (PostgreSQL или SQLite).
+    """
+    columns = [column["name"] for column in inspect(connection).get_columns("rentals")]
+    if "total_income" not in columns:
+        logger.info("🔧 Adding total_income column to rentals table...")
+        connection.execute(text("ALTER TABLE rentals ADD COLUMN total_income FLOAT"))
+        logger.info("✅ total_income column added")
+
+    result = connection.execute(
+        text("UPDATE rentals SET total_income = price_per_hour * hours WHERE total_income IS NULL")
+    )
+    if result.rowcount:
+        logger.info(f"✅ total_income filled for {result.rowcount} rentals")
+
+
+def normalize_timestamps_to_utc(connection):
+    """Перевести все колонки времени в UTC (UTCDateTime в database.py).
+
+    PostgreSQL: timestamp -> timestamptz с интерпретацией старых значений по
+    LEGACY_TIMESTAMPS; уже сконвертированные колонки пропускаются.
+    SQLite: московские значения сдвигаются в UTC, факт миграции хранится в
+    PRAGMA user_version.
+    """
+    if connection.dialect.name == "postgresql":
+        _normalize_postgresql(connection)
+    else:
+        _normalize_sqlite(connection)
+
+
+def _normalize_postgresql(connection):
+    connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _PG_MIGRATION_LOCK})
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+
+    for table_name, columns in LEGACY_TIMESTAMPS.items():
+        if table_name not in tables:
+            continue
+        existing = {col["name"]: col["type"] for col in inspector.get_columns(table_name)}
+        for column_name, source in columns.items():
+            column_type = existing.get(column_name)
+            if column_type is None or getattr(column_type, "timezone", False):
+                continue
+            zone = "'UTC'" if source == "utc" else "current_setting('TimeZone')"
+            logger.info(f"🔧 Converting {table_name}.{column_name} to timestamptz...")
+            connection.execute(text(
+                f"ALTER TABLE {table_name} ALTER COLUMN {column_name} "
+                f"TYPE TIMESTAMP WITH TIME ZONE USING {column_name} AT TIME ZONE {zone}"
+            ))
+
+
+def _normalize_sqlite(connection):
+    # Пустая запись берёт блокировку на запись до чтения user_version,
+    # чтобы второй процесс не сдвинул те же строки ещё раз
+    connection.execute(text("UPDATE users SET id = id WHERE 0 = 1"))
+    version = connection.execute(text("PRAGMA user_version")).scalar()
+    if version >= SQLITE_UTC_VERSION:
+        return
+
+    for table_name, columns in LEGACY_TIMESTAMPS.items():
+        for column_name, source in columns.items():
+            if source != "moscow":
+                continue
+            legacy = table(table_name, column("id", Integer), column(column_name, DateTime))
+            rows = connection.execute(
+                select(legacy.c.id, legacy.c[column_name]).where(legacy.c[column_name] != None)
+            ).all()
+            if not rows:
+                continue
+            utc_values = to_naive_utc_many([row[1] for row in rows], naive_is_utc=False)
+            connection.execute(
+                update(legacy).where(legacy.c.id == bindparam("row_id")).values({column_name: bindparam("utc_value")}),
+                [{"row_id": row[0], "utc_value": value} for row, value in zip(rows, utc_values)]
+            )
+            logger.info(f"✅ {table_name}.{column_name}: {len(rows)} values moved from Moscow time to UTC")
+
+    connection.execute(text(f"PRAGMA user_version = {SQLITE_UTC_VERSION}"))
+
+
+def add_bp_day(connection):
+    """Добавить bp_completions.bp_day и заполнить его для старых записей.
+
+    BP-день считается по completed_at (время отметки) с BP_RESET_HOUR.
+    Вызывать после normalize_timestamps_to_utc.
+    """
+    columns = [column["name"] for column in inspect(connection).get_columns("bp_completions")]
+    if "bp_day" not in columns:
+        logger.info("🔧 Adding bp_day column to bp_completions table...")
+        connection.execute(text("ALTER TABLE bp_completions ADD COLUMN bp_day INTEGER"))
+        logger.info("✅ bp_day column added")
+
+    rows = connection.execute(
+        select(BPCompletion.id, BPCompletion.completed_at, BPCompletion.completed_date)
+        .where(BPCompletion.bp_day == None)
+    ).all()
+    if not rows:
+        return
+
+    connection.execute(
+        update(BPCompletion.__table__)
+        .where(BPCompletion.__table__.c.id == bindparam("row_id"))
+        .values(bp_day=bindparam("bp_day_value")),
+        [
+            {"row_id": row_id, "bp_day_value": get_bp_day(completed_at or completed_date)}
+            for row_id, completed_at, completed_date in rows
+        ]
+    )
+    logger.info(f"✅ bp_day filled for {len(rows)} BP completions")
+
+
+def add_bp_task_bits(connection):
+    """Добавить bp_tasks.bit и выдать свободные биты заданиям без него (по порядку id)"""
+    columns = [column["name"] for column in inspect(connection).get_columns("bp_tasks")]
+    if "bit" not in columns:
+        logger.info("🔧 Adding bit column to bp_tasks table...")
+        connection.execute(text("ALTER TABLE bp_tasks ADD COLUMN bit INTEGER"))
+        logger.info("✅ bit column added")
+
+    tasks = connection.execute(select(BPTask.id, BPTask.bit).order_by(BPTask.id)).all()
+    # До уникального индекса uq_bp_tasks_bit параллельные вставки могли выдать один бит
+    # двум заданиям: бит остаётся у задания с меньшим id, остальным выдаём новые
+    owners = {}
+    duplicates = []
+    for index, (task_id, bit) in enumerate(tasks):
+        if bit is None:
+            continue
+        if bit in owners:
+            duplicates.append(task_id)
+            tasks[index] = (task_id, None)
+        else:
+            owners[bit] = task_id
+    if duplicates:
+        connection.execute(update(BPTask).where(BPTask.id.in_(duplicates)).values(bit=None))
+        logger.warning(
+            f"⚠️  BP tasks {duplicates} shared a bit with another task; bp_day_bits for them may be mixed, "
+            f"rebuild it with rebuild_bp_day_bits while bp_completions are complete"
+        )
+
+    taken = {bit for _, bit in tasks if bit is not None}
+    free = (bit for bit in range(BP_DAY_BITS) if bit not in taken)
+    assigned = 0
+    for task_id, bit in tasks:
+        if bit is not None:
+            continue
+        bit = next(free, None)
+        if bit is None:
+            logger.warning(f"⚠️  More than {BP_DAY_BITS} BP tasks, task {task_id} is not tracked in bp_day_bits")
+            break
+        connection.execute(update(BPTask).where(BPTask.id == task_id).values(bit=bit))
+        assigned += 1
+    if assigned:
+        logger.info(f"✅ Bits assigned to {assigned} BP tasks")
+
+
+def rebuild_bp_day_bits(connection):
+    """Пересчитать bp_day_bits по bp_completions. Возвращает число записанных дней.
+
+    История, уже удалённая из bp_completions (compact_bp_history.py), при этом
+    теряется - запускать только пока bp_completions полные.
+    """
+    rows = {}
+    completions = connection.execute(
+        select(BPCompletion.user_id, BPCompletion.bp_day, BPCompletion.bp_earned, BPTask.bit)
+        .outerjoin(BPTask, BPTask.id == BPCompletion.task_id)
+        .where(BPCompletion.is_completed == True)
+    )
+    for user_id, bp_day, bp_earned, bit in completions:
+        row = rows.setdefault((user_id, bp_day), {"bits": 0, "bp_earned": 0})
+        if bit is not None:
+            row["bits"] |= task_mask(bit)
+        row["bp_earned"] += bp_earned
+
+    connection.execute(delete(BPDayBits))
+    if rows:
+        connection.execute(
+            insert(BPDayBits),
+            [{"user_id": user_id, "bp_day": bp_day, **values} for (user_id, bp_day), values in rows.items()]
+        )
+    return len(rows)
+
+
+def ensure_bp_day_bits(connection):
+    """Заполнить bp_day_bits при первом запуске и пересчитать по ним BP в дневных итогах"""
+    if connection.execute(select(BPDayBits.user_id).limit(1)).first() is not None:
+        return
+    if connection.execute(select(BPCompletion.id).limit(1)).first() is None:
+        return
+
+    logger.info("🔧 Filling bp_day_bits from bp_completions...")
+    count = rebuild_bp_day_bits(connection)
+    logger.info(f"✅ bp_day_bits filled: {count} user-days")
+
+    if connection.execute(select(DailyUserStats.user_id).limit(1)).first() is not None:
+        rebuild_daily_stats(connection)
+
+
+def compact_bp_history(connection, keep_days: int):
+    """Удалить bp_completions старше keep_days BP-дней (история остаётся в bp_day_bits).
+
+    Удаление массовое, без событий ORM: bp_day_bits и daily_user_stats не меняются.
+    Возвращает число удалённых записей.
+    """
+    first_kept_day = get_bp_day() - max(keep_days, 1) + 1
+    result = connection.execute(delete(BPCompletion).where(BPCompletion.bp_day < first_kept_day))
+    return result.rowcount
+
+
+def rebuild_daily_stats(connection):
+    """Пересчитать daily_user_stats с нуля по товарам, продажам, арендам и bp_day_bits.
+
+    Те же правила, что и у событий в database.py: день - московская дата
+    времени (все времена хранятся в UTC), для BP - дата начала BP-дня.
+    Возвращает число записанных дней.
+    """
+    rows = {}
+
+    def add(user_id, day, **deltas):
+        row = rows.get((user_id, day))
+        if row is None:
+            row = rows[(user_id, day)] = {name: 0 for name in DAILY_STATS_COLUMNS}
+        for name, value in deltas.items():
+            row[name] += value or 0
+
+    items = connection.execute(
+        select(Item.user_id, Item.purchase_price, Item.purchase_date, Sale.sale_price, Sale.sale_date)
+        .outerjoin(Sale, Sale.item_id == Item.id)
+    ).all()
+    purchase_days = moscow_dates([row[2] for row in items])
+    sale_days = moscow_dates([row[4] for row in items])
+    for (user_id, purchase_price, _, sale_price, _), purchase_day, sale_day in zip(items, purchase_days, sale_days):
+        add(user_id, purchase_day, purchases=purchase_price, purchases_count=1)
+        if sale_price is None:
+            continue
+        add(user_id, sale_day, income=sale_price, profit=sale_price - purchase_price, sales_count=1)
+        add(user_id, purchase_day, expenses=purchase_price)
+
+    rentals = connection.execute(
+        select(Rental.user_id, Rental.rental_start, Rental.hours, Rental.total_income)
+    ).all()
+    rental_days = moscow_dates([row[1] for row in rentals])
+    for (user_id, _, hours, total_income), day in zip(rentals, rental_days):
+        add(user_id, day, rental_income=total_income, rental_hours=hours, rentals_count=1)
+
+    bp_days = connection.execute(select(BPDayBits.user_id, BPDayBits.bp_day, BPDayBits.bp_earned))
+    for user_id, bp_day, bp_earned in bp_days:
+        add(user_id, bp_day_date(bp_day), bp_earned=bp_earned)
+
+    connection.execute(delete(DailyUserStats))
+    if rows:
+        connection.execute(
+            insert(DailyUserStats),
+            [{"user_id": user_id, "day": day, **values} for (user_id, day), values in rows.items()]
+        )
+    return len(rows)
+
+
+def ensure_daily_stats(connection):
+    """Заполнить daily_user_stats при первом запуске (таблица пуста, а данные уже есть)"""
+    if connection.execute(select(DailyUserStats.user_id).limit(1)).first() is not None:
+        return
+    if not any(
+        connection.execute(select(model.id).limit(1)).first() is not None
+        for model in (Item, Rental, BPCompletion)
+    ):
+        return
+
+    logger.info("🔧 Filling daily_user_stats from existing data...")
+    count = rebuild_daily_stats(connection)
+    logger.info(f"✅ daily_user_stats filled: {count} user-days")
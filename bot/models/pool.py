@@ -0,0 +1,126 @@
+import logging
+
+from sqlalchemy import text
+
+from bot import config
+from bot.config import (
+    DB_MAX_CONNECTIONS, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE,
+    DB_POOL_TIMEOUT, DB_POOL_PRE_PING, WEB_SERVER, WEB_WORKERS, WEB_THREADS,
+    WEB_REPLICAS, BOT_REPLICAS, SCHEDULER_REPLICAS, SCHEDULER_DB_CONNECTIONS
+)
+
+logger = logging.getLogger(__name__)
+
+# Меньше соединений движку не даём. Лидер фоновых задач (роли all, scheduler) всё время
+# лидерства держит два соединения пула: advisory lock (bot/tasks/leader.py) и LISTEN
+# планировщика (DueScheduler._listen) - им нужны ещё столько же сверх минимума
+MIN_ENGINE_CONNECTIONS = 2
+LEADER_PINNED_CONNECTIONS = 2
+LEADER_ROLES = ("all", "scheduler")
+
+
+def _engines_in_budget():
+    """Сколько движков делят бюджет соединений в роли all: async-движок бота + по одному на веб-процесс.
+
+    В режиме asgi API работает на движке бота, отдельного веб-движка нет.
+    """
+    if WEB_SERVER == "asgi":
+        return 1
+    web_processes = WEB_WORKERS if WEB_SERVER == "gunicorn" else 1
+    return 1 + web_processes
+
+
+def _connection_share(process_role: str) -> int:
+    """Доля DB_MAX_CONNECTIONS для одного движка процесса с ролью process_role.
+
+    all - бюджет делится между движками этого процесса и gunicorn; раздельные
+    роли - scheduler берёт SCHEDULER_DB_CONNECTIONS на реплику, остаток поровну
+    между всеми репликами web и bot.
+    """
+    if process_role == "all":
+        return DB_MAX_CONNECTIONS // _engines_in_budget()
+    if process_role == "scheduler":
+        return SCHEDULER_DB_CONNECTIONS
+
+    remaining = DB_MAX_CONNECTIONS - SCHEDULER_REPLICAS * SCHEDULER_DB_CONNECTIONS
+    share = remaining // max(1, WEB_REPLICAS + BOT_REPLICAS)
+    if share < MIN_ENGINE_CONNECTIONS:
+        logger.warning(
+            f"⚠️  DB_MAX_CONNECTIONS={DB_MAX_CONNECTIONS} is too small for {WEB_REPLICAS} web + "
+            f"{BOT_REPLICAS} bot + {SCHEDULER_REPLICAS}x{SCHEDULER_DB_CONNECTIONS} scheduler connections"
+        )
+    return share
+
+
+def pool_kwargs(database_url: str, role: str) -> dict:
+    """Параметры пула для create_engine / create_async_engine.
+
+    role - "bot" (async-движок aiogram) или "web" (sync-движок Flask); долю
+    бюджета определяет роль процесса (bot.config.PROCESS_ROLE).
+    Для SQLite возвращаем пустой dict - там остаются настройки по умолчанию.
+    """
+    if "postgresql" not in database_url and "postgres" not in database_url:
+        return {}
+
+    process_role = config.PROCESS_ROLE
+    minimum = MIN_ENGINE_CONNECTIONS
+    if process_role in LEADER_ROLES and role == "bot":
+        minimum += LEADER_PINNED_CONNECTIONS
+    per_engine = max(minimum, _connection_share(process_role))
+    pool_size = int(DB_POOL_SIZE) if DB_POOL_SIZE else (per_engine + 1) // 2
+    max_overflow = int(DB_MAX_OVERFLOW) if DB_MAX_OVERFLOW else max(0, per_engine - pool_size)
+
+    if role == "web" and pool_size + max_overflow < WEB_THREADS:
+        logger.warning(
+            f"⚠️  Web pool ({pool_size}+{max_overflow}) is smaller than WEB_THREADS={WEB_THREADS}, "
+            f"requests will wait for connections"
+        )
+
+    logger.info(
+        f"🔌 DB pool for {role} (process role {process_role}): pool_size={pool_size}, "
+        f"max_overflow={max_overflow}, recycle={DB_POOL_RECYCLE}s, pre_ping={DB_POOL_PRE_PING}"
+    )
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def _warmup_count(engine) -> int:
+    size = getattr(engine.pool, "size", None)
+    return size() if callable(size) else 1
+
+
+def warm_up(engine):
+    """Открыть pool_size соединений заранее, чтобы первые запросы не платили за connect"""
+    connections = []
+    try:
+        for _ in range(_warmup_count(engine)):
+            connection = engine.connect()
+            connection.execute(text("SELECT 1"))
+            connections.append(connection)
+        logger.info(f"✅ DB pool warmed up ({len(connections)} connections)")
+    except Exception as e:
+        logger.warning(f"⚠️  DB pool warm-up failed: {e}")
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+async def warm_up_async(engine):
+    """Async-вариант warm_up для движка бота"""
+    connections = []
+    try:
+        for _ in range(_warmup_count(engine.sync_engine)):
+            connection = await engine.connect()
+            await connection.execute(text("SELECT 1"))
+            connections.append(connection)
+        logger.info(f"✅ Async DB pool warmed up ({len(connections)} connections)")
+    except Exception as e:
+        logger.warning(f"⚠️  Async DB pool warm-up failed: {e}")
+    finally:
+        for connection in connections:
+            await connection.close()
@@ -0,0 +1,111 @@
+"""
+Общее получение пользователя по telegram_id для Flask (sync) и aiogram (async).
+
+Результат кэшируется в LRU: telegram_id -> ResolvedUser(id, has_platinum_vip)
+(только в роли all - см. ProcessLocalCache).
+Существующий пользователь читается SELECT'ом в сессии вызывающего кода;
+только нового создаёт INSERT ... ON CONFLICT в отдельной короткой транзакции,
+поэтому два одновременных первых запроса не создают дубликаты, а откат
+транзакции обработчика не оставляет в кэше несуществующий id.
+"""
+from collections import namedtuple
+
+from sqlalchemy import select, func
+from sqlalchemy.dialects import postgresql, sqlite
+
+from bot.config import USER_CACHE_SIZE, USER_CACHE_TTL
+from bot.models.database import User
+from bot.utils.cache import ProcessLocalCache
+
+ResolvedUser = namedtuple("ResolvedUser", ["id", "has_platinum_vip"])
+
+user_cache = ProcessLocalCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+def _upsert_statement(dialect_name: str, telegram_id: int, username: str = None):
+    """INSERT ... ON CONFLICT (telegram_id) с возвратом id и VIP-флага"""
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    stmt = insert(User).values(telegram_id=telegram_id, username=username, has_platinum_vip=False)
+    # DO UPDATE (а не DO NOTHING), чтобы RETURNING вернул строку и при конфликте
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.telegram_id],
+        set_={"username": func.coalesce(stmt.excluded.username, User.username)},
+    )
+    return stmt.returning(User.id, User.has_platinum_vip)
+
+
+def _select_statement(telegram_id: int):
+    return select(User.id, User.has_platinum_vip).where(User.telegram_id == telegram_id)
+
+
+def _remember(telegram_id: int, row):
+    resolved = ResolvedUser(row[0], bool(row[1]))
+    user_cache.set(telegram_id, resolved)
+    return resolved
+
+
+def forget_user(telegram_id: int):
+    """Сбросить кэш пользователя (после изменения has_platinum_vip)"""
+    user_cache.invalidate(telegram_id)
+
+
+# === SYNC (Flask) ===
+
+def find_user(session, telegram_id: int):
+    """Найти пользователя (ResolvedUser или None), не создавая его"""
+    cached = user_cache.get(telegram_id)
+    if cached is not None:
+        return cached
+
+    row = session.execute(_select_statement(telegram_id)).first()
+    if row is None:
+        return None
+    return _remember(telegram_id, row)
+
+
+def get_or_create_user(session, telegram_id: int, username: str = None):
+    """Получить пользователя, создав его при отсутствии.
+
+    Сначала обычный SELECT в сессии вызывающего кода; upsert (запись) - только
+    для нового пользователя.
+    """
+    found = find_user(session, telegram_id)
+    if found is not None:
+        return found
+
+    engine = session.get_bind()
+    with engine.begin() as connection:
+        row = connection.execute(
+            _upsert_statement(engine.dialect.name, telegram_id, username)
+        ).first()
+    return _remember(telegram_id, row)
+
+
+# === ASYNC (aiogram) ===
+
+async def afind_user(session, telegram_id: int):
+    """Найти пользователя (ResolvedUser или None), не создавая его"""
+    cached = user_cache.get(telegram_id)
+    if cached is not None:
+        return cached
+
+    result = await session.execute(_select_statement(telegram_id))
+    row = result.first()
+    if row is None:
+        return None
+    return _remember(telegram_id, row)
+
+
+async def aget_or_create_user(session, telegram_id: int, username: str = None):
+    """Получить пользователя, создав его при отсутствии (см. get_or_create_user)"""
+    found = await afind_user(session, telegram_id)
+    if found is not None:
+        return found
+
+    engine = session.bind
+    async with engine.begin() as connection:
+        result = await connection.execute(
+            _upsert_statement(engine.dialect.name, telegram_id, username)
+        )
+        row = result.first()
+    return _remember(telegram_id, row)
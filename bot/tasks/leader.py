@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+import zlib
+from datetime import timedelta
+
+from sqlalchemy import text, update, insert, delete, or_
+from sqlalchemy.exc import IntegrityError
+
+from bot.config import LEADER_HEARTBEAT, LEADER_LEASE_TTL
+from bot.models.database import LeaderLease
+from bot.utils.datetime_helper import utc_now
+
+logger = logging.getLogger(__name__)
+
+# Первый ключ advisory lock лидерства (второй - crc32 имени), рядом с ключом миграции времени
+LEADER_LOCK_NAMESPACE = 710002
+
+# Кто держит аренду SQLite: уникален для процесса, виден в leader_leases
+HOLDER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class AdvisoryLock:
+    """Лидерство на PostgreSQL: сессионный pg_try_advisory_lock на отдельном соединении.
+
+    Блокировка живёт, пока живо соединение: если процесс упал или потерял связь
+    с БД, PostgreSQL снимает её сам, и следующая попытка другой реплики успешна.
+    После каждого запроса - commit, чтобы соединение не висело "idle in transaction"
+    (сессионная блокировка commit переживает).
+    """
+
+    def __init__(self, engine, name: str):
+        self._engine = engine
+        self._params = {"namespace": LEADER_LOCK_NAMESPACE, "key": zlib.crc32(name.encode()) & 0x7FFFFFFF}
+        self._connection = None
+
+    async def acquire(self) -> bool:
+        connection = await self._engine.connect()
+        try:
+            result = await connection.execute(
+                text("SELECT pg_try_advisory_lock(:namespace, :key)"), self._params
+            )
+            acquired = bool(result.scalar())
+            await connection.commit()
+        except Exception:
+            await connection.close()
+            raise
+        if not acquired:
+            await connection.close()
+            return False
+        self._connection = connection
+        return True
+
+    async def renew(self) -> bool:
+        """Проверить, что соединение живо и блокировка всё ещё за ним"""
+        try:
+            result = await self._connection.execute(
+                text(
+                    "SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND granted"
+                    " AND pid = pg_backend_pid() AND classid = :namespace AND objid = :key"
+                ),
+                self._params
+            )
+            held = bool(result.scalar())
+            await self._connection.commit()
+            return held
+        except Exception as e:
+            logger.warning(f"Leader lock check failed: {e}")
+            return False
+
+    async def release(self):
+        connection, self._connection = self._connection, None
+        if connection is None:
+            return
+        try:
+            await connection.execute(text("SELECT pg_advisory_unlock(:namespace, :key)"), self._params)
+            await connection.commit()
+            await connection.close()
+        except Exception:
+            # Соединение сломано - не возвращаем его в пул; блокировку снимет сервер
+            try:
+                await connection.invalidate()
+                await connection.close()
+            except Exception as e:
+                logger.warning(f"Could not drop leader lock connection: {e}")
+
+
+class LeaseRow:
+    """Лидерство без advisory lock (SQLite): строка leader_leases со сроком аренды.
+
+    Захват и продление - один UPDATE, который проходит, только если аренда наша
+    или истекла; первая аренда - INSERT (второй процесс получит IntegrityError).
+    """
+
+    def __init__(self, engine, name: str, holder: str = HOLDER_ID):
+        self._engine = engine
+        self._name = name
+        self._holder = holder
+
+    async def acquire(self) -> bool:
+        now = utc_now()
+        async with self._engine.begin() as connection:
+            result = await connection.execute(
+                update(LeaderLease).where(
+                    LeaderLease.name == self._name,
+                    or_(LeaderLease.holder == self._holder, LeaderLease.expires_at < now)
+                ).values(holder=self._holder, expires_at=now + timedelta(seconds=LEADER_LEASE_TTL))
+            )
+            if result.rowcount:
+                return True
+        try:
+            async with self._engine.begin() as connection:
+                await connection.execute(
+                    insert(LeaderLease).values(
+                        name=self._name,
+                        holder=self._holder,
+                        expires_at=now + timedelta(seconds=LEADER_LEASE_TTL)
+                    )
+                )
+            return True
+        except IntegrityError:
+            return False
+
+    async def renew(self) -> bool:
+        try:
+            now = utc_now()
+            async with self._engine.begin() as connection:
+                result = await connection.execute(
+                    update(LeaderLease).where(
+                        LeaderLease.name == self._name,
+                        LeaderLease.holder == self._holder
+                    ).values(expires_at=now + timedelta(seconds=LEADER_LEASE_TTL))
+                )
+                return bool(result.rowcount)
+        except Exception as e:
+            logger.warning(f"Leader lease renewal failed: {e}")
+            return False
+
+    async def release(self):
+        try:
+            async with self._engine.begin() as connection:
+                await connection.execute(
+                    delete(LeaderLease).where(
+                        LeaderLease.name == self._name,
+                        LeaderLease.holder == self._holder
+                    )
+                )
+        except Exception as e:
+            logger.warning(f"Could not release leader lease: {e}")
+
+
+class LeaderElection:
+    """Запуск фоновых задач только в одной реплике.
+
+    Процесс раз в LEADER_HEARTBEAT секунд пытается стать лидером name; лидер
+    запускает задачи start() и с тем же периодом подтверждает лидерство. Если
+    подтвердить не удалось (связь с БД, истёкшая аренда) или задача упала, задачи
+    отменяются и лидерство освобождается. Реплика, потерявшая лидерство, снова
+    становится кандидатом. Другая реплика забирает лидерство за LEADER_HEARTBEAT
+    секунд после падения лидера на PostgreSQL и за LEADER_LEASE_TTL на SQLite.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.is_leader = False
+
+    def _backend(self, engine):
+        if engine.dialect.name == "postgresql":
+            return AdvisoryLock(engine, self.name)
+        return LeaseRow(engine, self.name)
+
+    async def run(self, start):
+        """start() -> список корутин, которые выполняются, пока процесс - лидер"""
+        # Импорт здесь: как и планировщику, модулю нужен async-движок уже после db.init()
+        from bot.models.init_db import db
+
+        backend = self._backend(db.engine)
+        while True:
+            try:
+                acquired = await backend.acquire()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Leader election '{self.name}' failed: {e}")
+                acquired = False
+
+            if not acquired:
+                await asyncio.sleep(LEADER_HEARTBEAT)
+                continue
+
+            self.is_leader = True
+            logger.info(f"👑 Became leader for '{self.name}' ({HOLDER_ID})")
+            tasks = [asyncio.create_task(coroutine) for coroutine in start()]
+            try:
+                await self._lead(backend, tasks)
+            finally:
+                self.is_leader = False
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                await backend.release()
+                logger.info(f"Stepped down as leader for '{self.name}'")
+            # Даём другой реплике забрать лидерство, пока мы не вернулись в кандидаты
+            await asyncio.sleep(LEADER_HEARTBEAT)
+
+    async def _lead(self, backend, tasks):
+        while True:
+            done, _pending = await asyncio.wait(tasks, timeout=LEADER_HEARTBEAT)
+            for task in done:
+                error = None if task.cancelled() else task.exception()
+                logger.error(f"Leader task for '{self.name}' stopped: {error!r}")
+                return
+            if not await backend.renew():
+                logger.warning(f"⚠️  Lost leadership for '{self.name}'")
+                return
+
+
+async def run_as_leader(name: str, start):
+    """Выполнять корутины start() только в процессе, который сейчас лидер name"""
+    await LeaderElection(name).run(start)
@@ -1,73 +1,76 @@
-import asyncio
 import logging
 from datetime import datetime
-import pytz
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update
 
 from bot.models.database import Rental, Car, User
-from bot.models.init_db import db
-from bot.utils.datetime_helper import get_moscow_now
+from bot.tasks.outbox import enqueue_message
+from bot.tasks.scheduler import scheduler
+from bot.utils.datetime_helper import format_datetime
 
 logger = logging.getLogger(__name__)
 
+KIND = "rental"
 
-async def check_rental_notifications(bot):
-    """Проверить окончившиеся аренды и отправить уведомления"""
-    while True:
-        try:
-            # Используем async with для правильного управления сессией
-            async with db.get_session() as session:
-                # Получаем все неуведомленные аренды, время которых истекло
-                rentals = await session.execute(
-                    select(Rental).where(Rental.notified == False)
-                )
-                rentals = rentals.scalars().all()
-                
-                now = get_moscow_now()
-                
-                for rental in rentals:
-                    # Преобразуем rental_end к московскому времени для корректного сравнения
-                    tz = pytz.timezone('Europe/Moscow')
-                    rental_end = rental.rental_end
-                    if rental_end.tzinfo is None:
-                        rental_end = rental_end.replace(tzinfo=pytz.UTC).astimezone(tz)
-                    
-                    if now >= rental_end:
-                        # Получаем информацию о машине и пользователе
-                        car = await session.execute(
-                            select(Car).where(Car.id == rental.car_id)
-                        )
-                        car = car.scalar_one()
-                        
-                        user = await session.execute(
-                            select(User).where(User.id == rental.user_id)
-                        )
-                        user = user.scalar_one()
-                        
-                        message_text = (
-                            f"✅ Автомобиль вернулся с аренды!\n\n"
-                            f"🚗 Автомобиль: {car.name}\n"
-                            f"💰 Цена за час: {rental.price_per_hour}₽\n"
-                            f"⏰ Количество часов: {rental.hours}\n"
-                            f"💵 Общий доход: {rental.price_per_hour * rental.hours}₽\n"
-                            f"🕐 Время окончания: {rental.rental_end.strftime('%d.%m.%Y %H:%M')}"
-                        )
-                        
-                        try:
-                            await bot.send_message(
-                                chat_id=user.telegram_id,
-                                text=message_text
-                            )
-                            
-                            # Помечаем как уведомленного
-                            rental.notified = True
-                            await session.commit()
-                            logger.info(f"Notification sent for rental {rental.id}")
-                        except Exception as e:
-                            logger.error(f"Failed to send notification: {e}")
-        except Exception as e:
-            logger.error(f"Error in rental notification check: {e}")
-        
-        # Проверяем каждые 60 секунд
-        await asyncio.sleep(60)
+
+def schedule_rental(rental_id: int, rental_end: datetime, bind=None):
+    """Запланировать уведомление об окончании аренды (из любого потока/процесса)"""
+    scheduler.schedule(KIND, rental_id, rental_end, bind=bind)
+
+
+async def load_pending_rentals(session, horizon_end: datetime):
+    """Неуведомлённые аренды, заканчивающиеся до horizon_end (индекс notified, rental_end)"""
+    result = await session.execute(
+        select(Rental.id, Rental.rental_end).where(
+            Rental.notified == False,
+            Rental.rental_end <= horizon_end
+        )
+    )
+    return result.all()
+
+
+async def notify_rentals(session, rental_ids):
+    """Поставить уведомления по наступившим арендам в outbox (машина и пользователь - одним запросом).
+
+    Сообщения и отметка notified пишутся в одной транзакции, отправкой
+    (лимиты, повторы) занимается outbox_sender.
+    """
+    result = await session.execute(
+        select(
+            Rental.id,
+            Rental.price_per_hour,
+            Rental.hours,
+            Rental.rental_end,
+            Car.name,
+            User.telegram_id
+        ).join(
+            Car, Car.id == Rental.car_id
+        ).join(
+            User, User.id == Rental.user_id
+        ).where(
+            Rental.id.in_(rental_ids),
+            Rental.notified == False
+        )
+    )
+    rows = result.all()
+    if not rows:
+        return
+
+    for rental_id, price_per_hour, hours, rental_end, car_name, telegram_id in rows:
+        message_text = (
+            f"✅ Автомобиль вернулся с аренды!\n\n"
+            f"🚗 Автомобиль: {car_name}\n"
+            f"💰 Цена за час: {price_per_hour}₽\n"
+            f"⏰ Количество часов: {hours}\n"
+            f"💵 Общий доход: {price_per_hour * hours}₽\n"
+            f"🕐 Время окончания: {format_datetime(rental_end)}"
+        )
+        enqueue_message(session, telegram_id, message_text)
+
+    # Помечаем как уведомленные одним UPDATE
+    await session.execute(
+        update(Rental).where(Rental.id.in_([row[0] for row in rows])).values(notified=True)
+    )
+    logger.info(f"Queued notifications for rentals {[row[0] for row in rows]}")
+
+
+scheduler.register(KIND, load_pending_rentals, notify_rentals)
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from sqlalchemy import select, delete, update
+
+from bot.config import (
+    OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_BATCH_SIZE,
+    OUTBOX_POLL_INTERVAL, OUTBOX_MAX_ATTEMPTS
+)
+from bot.models.database import OutboxMessage
+from bot.utils.datetime_helper import utc_now
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_message(session, chat_id: int, text: str, parse_mode: str = None):
+    """Поставить сообщение в outbox в текущей транзакции (sync или async сессия).
+
+    Сообщение уйдёт только после commit вызывающего кода. После commit можно
+    вызвать outbox_sender.wake(), чтобы не ждать очередного опроса таблицы.
+    """
+    message = OutboxMessage(chat_id=chat_id, text=text, parse_mode=parse_mode)
+    session.add(message)
+    return message
+
+
+class OutboxSender:
+    """Фоновая отправка сообщений из outbox_messages.
+
+    Все сообщения идут через bot (один aiohttp-клиент aiogram) с общим лимитом
+    OUTBOX_GLOBAL_RATE и лимитом OUTBOX_CHAT_RATE на чат. На 429 отправка
+    приостанавливается на retry_after. Доставка "хотя бы один раз": строка
+    удаляется сразу после успешной отправки, своей короткой транзакцией.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._wakeup = None
+        self._db = None
+        self._next_global_slot = 0.0
+        self._chat_slots = {}  # chat_id -> time.monotonic(), раньше которого в чат не пишем
+        self._paused_until = 0.0
+
+    def wake(self):
+        """Разбудить отправку (можно вызывать из любого потока, например из Flask)"""
+        if self._loop is None:
+            # Отправка работает в другом процессе - сообщение заберёт опрос таблицы
+            return
+
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self._loop:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _wait_global_slot(self):
+        """Общий лимит: не чаще OUTBOX_GLOBAL_RATE сообщений в секунду"""
+        now = time.monotonic()
+        start = max(now, self._next_global_slot, self._paused_until)
+        if start > now:
+            await asyncio.sleep(start - now)
+        self._next_global_slot = start + 1 / OUTBOX_GLOBAL_RATE
+
+    def _prune_chat_slots(self):
+        now = time.monotonic()
+        self._chat_slots = {chat_id: slot for chat_id, slot in self._chat_slots.items() if slot > now}
+
+    async def _record(self, statement):
+        """Записать результат отправки одного сообщения в своей короткой транзакции.
+
+        shield: если задачу отменят (лидерство потеряно) уже после отправки,
+        запись всё равно дойдёт до БД и сообщение не уйдёт повторно.
+        """
+        async def execute():
+            async with self._db.engine.begin() as connection:
+                await connection.execute(statement)
+
+        await asyncio.shield(execute())
+
+    async def _send_batch(self, bot):
+        """Отправить одну пачку. Возвращает (пачка была полной, через сколько секунд есть смысл повторить).
+
+        Пачка читается и сессия закрывается сразу: отправка идёт вне транзакции,
+        а каждый результат (DELETE или перенос попытки) пишется сразу после отправки.
+        """
+        async with self._db.get_session() as session:
+            result = await session.execute(
+                select(
+                    OutboxMessage.id, OutboxMessage.chat_id, OutboxMessage.text,
+                    OutboxMessage.parse_mode, OutboxMessage.attempts
+                ).where(
+                    OutboxMessage.available_at <= utc_now()
+                ).order_by(
+                    OutboxMessage.available_at, OutboxMessage.id
+                ).limit(OUTBOX_BATCH_SIZE)
+            )
+            messages = result.all()
+
+        retry_in = None
+        for message in messages:
+            now = time.monotonic()
+            if self._paused_until > now:
+                break
+
+            chat_slot = self._chat_slots.get(message.chat_id, 0.0)
+            if chat_slot > now:
+                # В этот чат уже писали - дождёмся его окна, порядок внутри чата сохраняется
+                wait = chat_slot - now
+                retry_in = wait if retry_in is None else min(retry_in, wait)
+                continue
+
+            await self._wait_global_slot()
+            done = delete(OutboxMessage).where(OutboxMessage.id == message.id)
+            try:
+                await bot.send_message(
+                    chat_id=message.chat_id,
+                    text=message.text,
+                    parse_mode=message.parse_mode
+                )
+            except TelegramRetryAfter as e:
+                logger.warning(f"Telegram flood control, pausing outbox for {e.retry_after}s")
+                self._paused_until = time.monotonic() + e.retry_after
+                break
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                # Бот заблокирован, чат не найден и т.п. - повтор не поможет
+                logger.warning(f"Dropping outbox message {message.id} to {message.chat_id}: {e}")
+                await self._record(done)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                attempts = message.attempts + 1
+                if attempts >= OUTBOX_MAX_ATTEMPTS:
+                    logger.error(f"Giving up outbox message {message.id} after {attempts} attempts: {e}")
+                    await self._record(done)
+                else:
+                    logger.error(f"Failed to send outbox message {message.id}: {e}")
+                    await self._record(
+                        update(OutboxMessage).where(OutboxMessage.id == message.id).values(
+                            attempts=attempts,
+                            available_at=utc_now() + timedelta(seconds=2 ** attempts)
+                        )
+                    )
+            else:
+                await self._record(done)
+            finally:
+                self._chat_slots[message.chat_id] = time.monotonic() + 1 / OUTBOX_CHAT_RATE
+
+        if len(self._chat_slots) > 10000:
+            self._prune_chat_slots()
+
+        paused_for = self._paused_until - time.monotonic()
+        if paused_for > 0:
+            retry_in = paused_for
+        return len(messages) == OUTBOX_BATCH_SIZE, retry_in
+
+    async def run(self, bot):
+        """Основной цикл: отправляем пачки, между ними ждём wake() или опроса таблицы"""
+        # Импорт здесь: модуль подключают и веб-процессы (enqueue/wake), которым async-движок бота не нужен
+        from bot.models.init_db import db
+
+        self._db = db
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+
+        try:
+            while True:
+                try:
+                    self._wakeup.clear()
+                    full, retry_in = await self._send_batch(bot)
+                    if full and retry_in is None:
+                        continue
+
+                    timeout = OUTBOX_POLL_INTERVAL if retry_in is None else min(retry_in, OUTBOX_POLL_INTERVAL)
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Error in outbox sender: {e}")
+                    await asyncio.sleep(5)
+        finally:
+            # Отправка остановлена (например, процесс потерял лидерство) - wake() снова no-op
+            self._loop = None
+
+
+outbox_sender = OutboxSender()
+
+
+async def send_outbox_messages(bot):
+    """Запустить фоновую отправку сообщений из outbox"""
+    await outbox_sender.run(bot)
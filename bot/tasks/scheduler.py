@@ -0,0 +1,247 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+import pytz
+from sqlalchemy import text
+
+from bot.config import SCHEDULER_HORIZON, SCHEDULER_RESYNC
+
+logger = logging.getLogger(__name__)
+
+# Канал PostgreSQL NOTIFY: веб-процессы и роль bot будят планировщик после записи
+NOTIFY_CHANNEL = "bot_scheduler"
+
+
+def to_naive_utc(dt: datetime) -> datetime:
+    """Куча хранит время в UTC без tzinfo - приводим к тому же виду"""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(pytz.UTC).replace(tzinfo=None)
+    return dt
+
+
+def _utcnow() -> datetime:
+    return datetime.utcnow()
+
+
+class DueScheduler:
+    """Единый планировщик событий по времени (окончание аренды, таймеры).
+
+    Держит min-heap (due, kind, key) ближайших событий и спит до самого раннего
+    из них. Для каждого вида событий регистрируются две корутины:
+    load(session, horizon_end) -> [(key, due), ...] и fire(session, keys).
+    Куча заполняется запросами load на горизонт SCHEDULER_HORIZON и
+    пересинхронизируется раз в SCHEDULER_RESYNC секунд, а также по NOTIFY из
+    других процессов (PostgreSQL). Записи в этом процессе попадают в кучу
+    сразу через schedule().
+    """
+
+    def __init__(self):
+        self._kinds = {}
+        self._heap = []
+        self._scheduled = {}  # (kind, key) -> due, чтобы пропускать устаревшие записи кучи
+        self._loop = None
+        self._wakeup = None
+        self._resync_requested = False
+        self._db = None
+
+    def register(self, kind: str, load, fire):
+        """Зарегистрировать вид событий"""
+        self._kinds[kind] = (load, fire)
+
+    def schedule(self, kind: str, key: int, due: datetime, bind=None):
+        """Запланировать/перепланировать событие. Можно вызывать из любого потока.
+
+        bind - sync Engine вызывающего кода: если планировщик работает в другом
+        процессе, через него отправляется NOTIFY. Без bind (async-код, например
+        обработчики роли bot) NOTIFY уходит задачей через async-движок бота. Для
+        SQLite событие подхватит пересинхронизация.
+        """
+        if self._loop is None:
+            if bind is None:
+                _notify_remote_async()
+            else:
+                _notify_remote(bind)
+            return
+        self._call_in_loop(self._push, kind, key, to_naive_utc(due))
+
+    def unschedule(self, kind: str, key: int):
+        """Снять событие (пауза/отмена). fire всё равно перепроверяет состояние в БД"""
+        if self._loop is None:
+            return
+        self._call_in_loop(self._remove, kind, key)
+
+    def _call_in_loop(self, callback, *args):
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self._loop:
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
+
+    def _push(self, kind: str, key: int, due: datetime):
+        if self._scheduled.get((kind, key)) == due:
+            return
+        self._scheduled[(kind, key)] = due
+        heapq.heappush(self._heap, (due, kind, key))
+        self._wakeup.set()
+
+    def _remove(self, kind: str, key: int):
+        self._scheduled.pop((kind, key), None)
+
+    def _request_resync(self):
+        self._resync_requested = True
+        self._wakeup.set()
+
+    async def _resync(self):
+        """Загрузить события всех видов, наступающие в пределах горизонта"""
+        horizon_end = _utcnow() + timedelta(seconds=SCHEDULER_HORIZON)
+        loaded = 0
+        async with self._db.get_session() as session:
+            for kind, (load, _fire) in self._kinds.items():
+                for key, due in await load(session, horizon_end):
+                    self._push(kind, key, to_naive_utc(due))
+                    loaded += 1
+        logger.info(f"Scheduler resynced: {loaded} pending events, {len(self._heap)} in queue")
+
+    def _pop_due(self, now: datetime):
+        """Снять с кучи все наступившие события: {kind: [key, ...]}"""
+        due = {}
+        while self._heap and self._heap[0][0] <= now:
+            when, kind, key = heapq.heappop(self._heap)
+            if self._scheduled.get((kind, key)) != when:
+                continue  # устаревшая запись (событие перепланировали или сняли)
+            del self._scheduled[(kind, key)]
+            due.setdefault(kind, []).append(key)
+        return due
+
+    async def _fire(self, due):
+        from bot.tasks.outbox import outbox_sender
+
+        for kind, keys in due.items():
+            _load, fire = self._kinds[kind]
+            try:
+                async with self._db.get_session() as session:
+                    await fire(session, keys)
+                    await session.commit()
+            except Exception as e:
+                logger.error(f"Error firing {kind} events {keys}: {e}")
+        outbox_sender.wake()
+
+    async def _listen(self):
+        """Держать соединение с LISTEN, чтобы веб-процессы могли разбудить планировщик"""
+        async with self._db.engine.connect() as connection:
+            raw = await connection.get_raw_connection()
+            await raw.driver_connection.add_listener(
+                NOTIFY_CHANNEL, lambda *args: self._request_resync()
+            )
+            logger.info(f"Scheduler listening on '{NOTIFY_CHANNEL}'")
+            await asyncio.Event().wait()
+
+    async def run(self):
+        """Основной цикл: спим до ближайшего события или до пересинхронизации"""
+        # Импорт здесь: модуль подключают и веб-процессы (schedule()), которым async-движок бота не нужен
+        from bot.models.init_db import db
+
+        self._db = db
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        resync_interval = timedelta(seconds=SCHEDULER_RESYNC)
+        next_resync = _utcnow()
+
+        listen_task = None
+        if db.engine.dialect.name == "postgresql":
+            listen_task = asyncio.create_task(self._listen())
+
+        try:
+            while True:
+                try:
+                    now = _utcnow()
+                    if now >= next_resync or self._resync_requested:
+                        self._resync_requested = False
+                        await self._resync()
+                        next_resync = now + resync_interval
+
+                    due = self._pop_due(_utcnow())
+                    if due:
+                        await self._fire(due)
+                        continue
+
+                    if self._resync_requested:
+                        continue  # NOTIFY пришёл во время пересинхронизации/отправки
+
+                    wake_at = next_resync
+                    if self._heap and self._heap[0][0] < wake_at:
+                        wake_at = self._heap[0][0]
+                    timeout = max(0.0, (wake_at - _utcnow()).total_seconds())
+
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Error in scheduler loop: {e}")
+                    await asyncio.sleep(5)
+        finally:
+            if listen_task is not None:
+                listen_task.cancel()
+            # Планировщик остановлен (например, процесс потерял лидерство): schedule()
+            # снова будит планировщик другого процесса, куча перезагрузится при запуске
+            self._loop = None
+            self._heap.clear()
+            self._scheduled.clear()
+
+
+def _notify_remote(bind):
+    """NOTIFY для планировщика в другом процессе (только PostgreSQL, sync Engine)"""
+    if bind is None or bind.dialect.name != "postgresql":
+        return
+    try:
+        with bind.begin() as connection:
+            connection.execute(text("SELECT pg_notify(:channel, '')"), {"channel": NOTIFY_CHANNEL})
+    except Exception as e:
+        logger.warning(f"Could not notify scheduler: {e}")
+
+
+# Ссылки на задачи NOTIFY из async-кода, чтобы их не собрал GC до выполнения
+_notify_tasks = set()
+
+
+def _notify_remote_async():
+    """NOTIFY из async-кода процесса без планировщика (async-движок бота, только PostgreSQL)"""
+    from bot.models.init_db import db
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    if db.engine is None or db.engine.dialect.name != "postgresql":
+        return
+
+    async def notify():
+        try:
+            async with db.engine.begin() as connection:
+                await connection.execute(text("SELECT pg_notify(:channel, '')"), {"channel": NOTIFY_CHANNEL})
+        except Exception as e:
+            logger.warning(f"Could not notify scheduler: {e}")
+
+    task = loop.create_task(notify())
+    _notify_tasks.add(task)
+    task.add_done_callback(_notify_tasks.discard)
+
+
+scheduler = DueScheduler()
+
+
+async def run_scheduler():
+    """Запустить планировщик (аренды и таймеры регистрируются при импорте своих модулей)"""
+    import bot.tasks.notifications
+    import bot.tasks.timers
+
+    await scheduler.run()
@@ -0,0 +1,64 @@
+import logging
+from datetime import datetime
+from sqlalchemy import select, delete
+
+from bot.models.database import Timer, User
+from bot.tasks.outbox import enqueue_message
+from bot.tasks.scheduler import scheduler
+from bot.utils.datetime_helper import utc_now
+
+logger = logging.getLogger(__name__)
+
+KIND = "timer"
+
+
+def schedule_timer(timer_id: int, end_time: datetime, bind=None):
+    """Запланировать окончание таймера (из любого потока/процесса)"""
+    scheduler.schedule(KIND, timer_id, end_time, bind=bind)
+
+
+def unschedule_timer(timer_id: int):
+    """Снять таймер с планировщика (пауза/отмена)"""
+    scheduler.unschedule(KIND, timer_id)
+
+
+async def load_pending_timers(session, horizon_end: datetime):
+    """Идущие таймеры, заканчивающиеся до horizon_end (индекс is_paused, end_time)"""
+    result = await session.execute(
+        select(Timer.id, Timer.end_time).where(
+            Timer.is_paused == False,
+            Timer.end_time <= horizon_end
+        )
+    )
+    return result.all()
+
+
+async def finish_timers(session, timer_ids):
+    """Поставить уведомления о завершённых таймерах в outbox и удалить таймеры.
+
+    Состояние перепроверяется в БД: таймер могли поставить на паузу, отменить
+    или перезапустить в другом процессе.
+    """
+    result = await session.execute(
+        select(Timer.id, Timer.name, User.telegram_id).join(
+            User, User.id == Timer.user_id
+        ).where(
+            Timer.id.in_(timer_ids),
+            Timer.is_paused == False,
+            Timer.end_time <= utc_now()
+        )
+    )
+    rows = result.all()
+    if not rows:
+        return
+
+    for timer_id, name, telegram_id in rows:
+        enqueue_message(session, telegram_id, f"⏰ Таймер \"{name}\" завершён!")
+
+    await session.execute(
+        delete(Timer).where(Timer.id.in_([row[0] for row in rows]))
+    )
+    logger.info(f"Finished timers {[row[0] for row in rows]}")
+
+
+scheduler.register(KIND, load_pending_timers, finish_timers)
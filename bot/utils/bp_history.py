@@ -0,0 +1,78 @@
+from bot.utils.datetime_helper import bp_day_date
+
+# Сколько заданий помещается в bp_day_bits.bits (BIGINT со знаком - старший бит не используем)
+BP_DAY_BITS = 63
+
+
+def task_mask(bit: int) -> int:
+    """Маска задания с номером бита bit"""
+    return 1 << bit
+
+
+def iter_bits(bits: int):
+    """Номера установленных битов (младший бит за шаг)"""
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+def streaks(days) -> tuple:
+    """(текущая, самая длинная) серия BP-дней подряд с выполненными заданиями.
+
+    days - возрастающие номера BP-дней с ненулевым набором битов. Текущая серия
+    заканчивается сегодня или вчера (сегодняшний день ещё может продолжиться).
+    """
+    longest = current = 0
+    previous = None
+    for day in days:
+        current = current + 1 if previous is not None and day == previous + 1 else 1
+        longest = max(longest, current)
+        previous = day
+    return current, longest
+
+
+def summarize_bp_history(rows, tasks, first_day: int, today: int) -> dict:
+    """Сводка истории BP по строкам bp_day_bits.
+
+    rows - (bp_day, bits, bp_earned) по возрастанию bp_day в [first_day, today];
+    tasks - (id, name, bit) заданий с назначенным битом.
+    """
+    total_days = today - first_day + 1
+    counts = [0] * BP_DAY_BITS
+    heatmap = []
+    active_days = []
+
+    for bp_day, bits, bp_earned in rows:
+        if bits:
+            active_days.append(bp_day)
+            for bit in iter_bits(bits):
+                counts[bit] += 1
+        heatmap.append({
+            'date': bp_day_date(bp_day).isoformat(),
+            'tasks': bits.bit_count(),
+            'bp': bp_earned,
+        })
+
+    current, longest = streaks(active_days)
+    if active_days and active_days[-1] < today - 1:
+        current = 0
+
+    return {
+        'from': bp_day_date(first_day).isoformat(),
+        'to': bp_day_date(today).isoformat(),
+        'days': total_days,
+        'active_days': len(active_days),
+        'current_streak': current,
+        'longest_streak': longest,
+        'heatmap': heatmap,
+        'tasks': [
+            {
+                'id': task_id,
+                'name': name,
+                'days': counts[bit],
+                'rate': round(counts[bit] / total_days, 4),
+            }
+            for task_id, name, bit in tasks
+        ],
+    }
@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+
+from bot import config
+from bot.config import PAYBACK_CACHE_SIZE, PAYBACK_CACHE_TTL
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш в памяти процесса с необязательным TTL"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Получить значение (None/default если нет или истекло)"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Сохранить значение, вытесняя самые старые записи"""
+        if self.maxsize <= 0:
+            return
+
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """Удалить значение по ключу"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Очистить кэш"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ProcessLocalCache(LRUCache):
+    """LRU-кэш, который сбрасывают (invalidate) только записи в этом же процессе.
+
+    Верен, пока все записи идут через один процесс: роль all с API в нём же
+    (asgi/thread). Когда API и бот разнесены по процессам и репликам (роли
+    web/bot, gunicorn), запись в другом процессе не сбросит значение здесь,
+    поэтому кэш выключен: get всегда промах, set ничего не хранит.
+    """
+
+    @staticmethod
+    def enabled() -> bool:
+        return config.PROCESS_ROLE == "all" and config.WEB_SERVER != "gunicorn"
+
+    def get(self, key, default=None):
+        if not self.enabled():
+            return default
+        return super().get(key, default)
+
+    def set(self, key, value):
+        if self.enabled():
+            super().set(key, value)
+
+
+# Окупаемость авто по пользователю: users.id -> список машин с доходом.
+# Сбрасывается при любой записи в rentals/cars этого пользователя.
+payback_cache = ProcessLocalCache(maxsize=PAYBACK_CACHE_SIZE, ttl=PAYBACK_CACHE_TTL)
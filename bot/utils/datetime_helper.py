@@ -1,66 +1,185 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 import pytz
 
+from bot.config import BP_RESET_HOUR
+
+
+# Зона создаётся один раз на модуль (pytz.timezone каждый раз ищет её заново)
+MOSCOW_TZ = pytz.timezone('Europe/Moscow')
+
+# Начало отсчёта номеров BP-дней (get_bp_day)
+BP_EPOCH = date(1970, 1, 1)
+
 
 def get_moscow_now():
     """Получить текущее время в московском часовом поясе"""
-    tz = pytz.timezone('Europe/Moscow')
-    return datetime.now(tz)
+    return datetime.now(MOSCOW_TZ)
+
+
+def utc_now():
+    """Текущее время в UTC с tzinfo - так хранятся все времена в БД"""
+    return datetime.now(pytz.UTC)
+
+
+def to_utc(dt: datetime) -> datetime:
+    """Привести время к UTC с tzinfo (время без tzinfo считается UTC)"""
+    if dt.tzinfo is None:
+        return pytz.UTC.localize(dt)
+    return dt.astimezone(pytz.UTC)
+
+
+def in_range(column, start: datetime = None, end: datetime = None) -> list:
+    """Условия [start, end) по колонке времени в виде, который может использовать индекс.
+
+    Границы переводятся в UTC здесь, а не колонка в SQL, поэтому получаются
+    только сравнения column >= :start и column < :end.
+    """
+    conditions = []
+    if start is not None:
+        conditions.append(column >= to_utc(start))
+    if end is not None:
+        conditions.append(column < to_utc(end))
+    return conditions
+
+
+def get_bp_day(dt: datetime = None) -> int:
+    """Номер BP-дня: московский день со сдвигом на BP_RESET_HOUR, в днях от BP_EPOCH.
+
+    Время до BP_RESET_HOUR относится к предыдущему BP-дню.
+    """
+    moscow = get_moscow_now() if dt is None else to_moscow(dt)
+    return ((moscow.replace(tzinfo=None) - timedelta(hours=BP_RESET_HOUR)).date() - BP_EPOCH).days
+
+
+def bp_day_date(bp_day: int) -> date:
+    """Календарная дата (по Москве), в которую начинается BP-день"""
+    return BP_EPOCH + timedelta(days=bp_day)
+
+
+def to_moscow(dt: datetime, naive_is_utc: bool = True) -> datetime:
+    """Перевести время в Москву (с tzinfo); время без tzinfo - UTC или, при naive_is_utc=False, Москва"""
+    if dt.tzinfo is None:
+        if not naive_is_utc:
+            return MOSCOW_TZ.localize(dt)
+        dt = dt.replace(tzinfo=pytz.UTC)
+    return dt.astimezone(MOSCOW_TZ)
+
+
+class PeriodBounds:
+    """Границы дня, недели, месяца и BP-дня по Москве, посчитанные один раз.
+
+    Создаётся на запрос: bounds = PeriodBounds(); дальше все фильтры - это
+    диапазоны [start, end) в UTC (filter / utc_range). Периоды: "day", "week",
+    "month" и "bp_day" - BP-день с BP_RESET_HOUR до того же часа следующего дня.
+    """
+
+    def __init__(self, now: datetime = None):
+        self.now = to_moscow(now) if now is not None else get_moscow_now()
+        # localize заново: между началом месяца/недели и сейчас смещение зоны могло смениться
+        naive_now = self.now.replace(tzinfo=None)
+        day = naive_now.replace(hour=0, minute=0, second=0, microsecond=0)
+        week = day - timedelta(days=day.weekday())
+        month = day.replace(day=1)
+        # Номер текущего BP-дня - для равенства по bp_completions.bp_day
+        self.bp_day = get_bp_day(self.now)
+        bp_day = datetime.combine(bp_day_date(self.bp_day), datetime.min.time()).replace(hour=BP_RESET_HOUR)
+        next_month = (month + timedelta(days=32)).replace(day=1)
+
+        self._naive = {
+            "day": (day, day + timedelta(days=1)),
+            "week": (week, week + timedelta(weeks=1)),
+            "month": (month, next_month),
+            "bp_day": (bp_day, bp_day + timedelta(days=1)),
+        }
+        self._aware = {
+            period: (MOSCOW_TZ.localize(start), MOSCOW_TZ.localize(end))
+            for period, (start, end) in self._naive.items()
+        }
+
+    def start(self, period: str) -> datetime:
+        """Начало периода по Москве (с tzinfo)"""
+        return self._aware[period][0]
+
+    def end(self, period: str) -> datetime:
+        """Конец периода (не включительно) по Москве (с tzinfo)"""
+        return self._aware[period][1]
+
+    def utc_range(self, period: str):
+        """(start, end) в UTC с tzinfo"""
+        return tuple(to_utc(dt) for dt in self._aware[period])
+
+    def filter(self, column, period: str) -> list:
+        """Условия "column в текущем периоде" (см. in_range)"""
+        return in_range(column, *self._aware[period])
+
+
+def _moscow_offset(hour_start: datetime, naive_is_utc: bool) -> timedelta:
+    """Смещение Москвы от UTC для часа hour_start (UTC или московского)"""
+    if naive_is_utc:
+        return pytz.UTC.localize(hour_start).astimezone(MOSCOW_TZ).utcoffset()
+    return MOSCOW_TZ.localize(hour_start).utcoffset()
+
+
+def to_naive_utc_many(timestamps, naive_is_utc: bool = True) -> list:
+    """Перевести пачку времён в UTC без tzinfo (None остаётся None).
+
+    Смещение зоны кэшируется по часу, поэтому на N строк приходится столько
+    обращений к pytz, сколько в них разных часов.
+    """
+    offsets = {}
+    result = []
+    for dt in timestamps:
+        if dt is None:
+            result.append(None)
+        elif dt.tzinfo is not None:
+            result.append(dt.astimezone(pytz.UTC).replace(tzinfo=None))
+        elif naive_is_utc:
+            result.append(dt)
+        else:
+            hour = dt.replace(minute=0, second=0, microsecond=0)
+            offset = offsets.get(hour)
+            if offset is None:
+                offset = offsets[hour] = _moscow_offset(hour, False)
+            result.append(dt - offset)
+    return result
+
+
+def moscow_dates(timestamps, naive_is_utc: bool = True) -> list:
+    """Московские даты для пачки времён из БД (смещение кэшируется по часу)"""
+    offsets = {}
+    result = []
+    for dt in timestamps:
+        if dt is None:
+            result.append(None)
+            continue
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(pytz.UTC).replace(tzinfo=None)
+        elif not naive_is_utc:
+            result.append(dt.date())
+            continue
+        hour = dt.replace(minute=0, second=0, microsecond=0)
+        offset = offsets.get(hour)
+        if offset is None:
+            offset = offsets[hour] = _moscow_offset(hour, True)
+        result.append((dt + offset).date())
+    return result
+
+
+def get_moscow_date(dt: datetime, naive_is_utc: bool = True) -> date:
+    """Московская дата для времени из БД.
+
+    Время без tzinfo считается UTC или, при naive_is_utc=False, уже московским.
+    """
+    if dt.tzinfo is None and not naive_is_utc:
+        return dt.date()
+    return to_moscow(dt).date()
 
 
 def format_datetime(dt: datetime) -> str:
     """Форматировать дату и время для вывода"""
-    if dt.tzinfo is None:
-        tz = pytz.timezone('Europe/Moscow')
-        dt = dt.replace(tzinfo=pytz.UTC).astimezone(tz)
-    return dt.strftime("%d.%m.%Y %H:%M")
+    return to_moscow(dt).strftime("%d.%m.%Y %H:%M")
 
 
 def format_date(dt: datetime) -> str:
     """Форматировать только дату"""
-    if dt.tzinfo is None:
-        tz = pytz.timezone('Europe/Moscow')
-        dt = dt.replace(tzinfo=pytz.UTC).astimezone(tz)
-    return dt.strftime("%d.%m.%Y")
-
-
-def is_same_day(dt1: datetime, dt2: datetime = None) -> bool:
-    """Проверить, что две даты в один день"""
-    if dt2 is None:
-        dt2 = get_moscow_now()
-    
-    tz = pytz.timezone('Europe/Moscow')
-    if dt1.tzinfo is None:
-        dt1 = dt1.replace(tzinfo=pytz.UTC).astimezone(tz)
-    if dt2.tzinfo is None:
-        dt2 = dt2.replace(tzinfo=pytz.UTC).astimezone(tz)
-    
-    return dt1.date() == dt2.date()
-
-
-def is_same_week(dt1: datetime, dt2: datetime = None) -> bool:
-    """Проверить, что две даты в одну неделю"""
-    if dt2 is None:
-        dt2 = get_moscow_now()
-    
-    tz = pytz.timezone('Europe/Moscow')
-    if dt1.tzinfo is None:
-        dt1 = dt1.replace(tzinfo=pytz.UTC).astimezone(tz)
-    if dt2.tzinfo is None:
-        dt2 = dt2.replace(tzinfo=pytz.UTC).astimezone(tz)
-    
-    return dt1.isocalendar()[:2] == dt2.isocalendar()[:2]
-
-
-def is_same_month(dt1: datetime, dt2: datetime = None) -> bool:
-    """Проверить, что две даты в один месяц"""
-    if dt2 is None:
-        dt2 = get_moscow_now()
-    
-    tz = pytz.timezone('Europe/Moscow')
-    if dt1.tzinfo is None:
-        dt1 = dt1.replace(tzinfo=pytz.UTC).astimezone(tz)
-    if dt2.tzinfo is None:
-        dt2 = dt2.replace(tzinfo=pytz.UTC).astimezone(tz)
-    
-    return dt1.year == dt2.year and dt1.month == dt2.month
+    return to_moscow(dt).strftime("%d.%m.%Y")
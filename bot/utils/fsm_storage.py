@@ -0,0 +1,139 @@
+import enum
+import json
+import logging
+import time
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from sqlalchemy import select, delete
+from sqlalchemy.dialects import postgresql, sqlite
+
+from bot.config import FSM_STATE_TTL, FSM_PURGE_INTERVAL, FSM_CACHE_SIZE, FSM_CACHE_TTL
+from bot.models.database import FSMRecord, CategoryEnum
+from bot.utils.cache import LRUCache
+from bot.utils.datetime_helper import utc_now
+
+logger = logging.getLogger(__name__)
+
+# Enum'ы, которые сценарии кладут в данные FSM (JSON хранит их как {"__enum__", "name"})
+FSM_ENUMS = {cls.__name__: cls for cls in (CategoryEnum,)}
+
+
+def _encode(value):
+    if isinstance(value, enum.Enum) and type(value).__name__ in FSM_ENUMS:
+        return {"__enum__": type(value).__name__, "name": value.name}
+    raise TypeError(f"FSM data value of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode(obj):
+    if "__enum__" in obj and obj.keys() == {"__enum__", "name"}:
+        return FSM_ENUMS[obj["__enum__"]][obj["name"]]
+    return obj
+
+
+def dump_data(data: Dict[str, Any]) -> str:
+    return json.dumps(data, default=_encode, ensure_ascii=False)
+
+
+def load_data(raw: Optional[str]) -> Dict[str, Any]:
+    return json.loads(raw, object_hook=_decode) if raw else {}
+
+
+def storage_key(key: StorageKey) -> str:
+    """Строковый ключ записи (как у DefaultKeyBuilder aiogram)"""
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+
+class DatabaseStorage(BaseStorage):
+    """Хранилище FSM aiogram в таблице fsm_states вместо MemoryStorage.
+
+    Состояние и данные сценария пишутся сразу в БД (одна строка на ключ, upsert),
+    поэтому переживают перезапуск и видны всем репликам бота. При polling (процесс
+    бота один) перед БД - write-through LRU-кэш (state, data), и чтения не ходят в БД;
+    при webhook кэша нет (FSM_CACHE_TTL=0). Пустая запись (state=None, data={}) удаляется,
+    брошенные живут FSM_STATE_TTL секунд с последнего изменения.
+    """
+
+    def __init__(self, database):
+        # database - bot.models.init_db.db: движок берётся при обращении, после db.init()
+        self._database = database
+        maxsize = FSM_CACHE_SIZE if FSM_CACHE_TTL > 0 else 0
+        self._cache = LRUCache(maxsize=maxsize, ttl=FSM_CACHE_TTL)
+        self._next_purge = 0.0
+
+    @property
+    def _engine(self):
+        return self._database.engine
+
+    async def _load(self, key: str):
+        """(state, data) из кэша или БД; data - копия, её можно менять"""
+        record = self._cache.get(key)
+        if record is None:
+            async with self._engine.connect() as connection:
+                row = (await connection.execute(
+                    select(FSMRecord.state, FSMRecord.data).where(
+                        FSMRecord.key == key,
+                        FSMRecord.expires_at > utc_now()
+                    )
+                )).first()
+            record = (row[0], load_data(row[1])) if row else (None, {})
+            self._cache.set(key, record)
+        state, data = record
+        return state, dict(data)
+
+    async def _save(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        async with self._engine.begin() as connection:
+            if state is None and not data:
+                await connection.execute(delete(FSMRecord).where(FSMRecord.key == key))
+            else:
+                insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+                values = {
+                    "state": state,
+                    "data": dump_data(data),
+                    "expires_at": utc_now() + timedelta(seconds=FSM_STATE_TTL),
+                }
+                stmt = insert(FSMRecord).values(key=key, **values)
+                await connection.execute(stmt.on_conflict_do_update(
+                    index_elements=[FSMRecord.__table__.c.key],
+                    set_={name: stmt.excluded[name] for name in values},
+                ))
+            await self._maybe_purge(connection)
+        self._cache.set(key, (state, dict(data)))
+
+    async def _maybe_purge(self, connection):
+        """Удалить истёкшие записи, не чаще раза в FSM_PURGE_INTERVAL (индекс по expires_at)"""
+        now = time.monotonic()
+        if now < self._next_purge:
+            return
+        self._next_purge = now + FSM_PURGE_INTERVAL
+        result = await connection.execute(delete(FSMRecord).where(FSMRecord.expires_at <= utc_now()))
+        if result.rowcount:
+            logger.info(f"🧹 Purged {result.rowcount} expired FSM states")
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        record_key = storage_key(key)
+        current_state, data = await self._load(record_key)
+        if state == current_state:
+            return
+        await self._save(record_key, state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _data = await self._load(storage_key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record_key = storage_key(key)
+        state, current_data = await self._load(record_key)
+        if data == current_data:
+            return
+        await self._save(record_key, state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _state, data = await self._load(storage_key(key))
+        return data
+
+    async def close(self) -> None:
+        self._cache.clear()
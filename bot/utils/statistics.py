@@ -1,119 +1,103 @@
-from sqlalchemy import select, func
+from datetime import datetime
+from sqlalchemy import select, func, case
 from sqlalchemy.ext.asyncio import AsyncSession
-from bot.models.database import Item, Sale, Rental, User
-from bot.utils.datetime_helper import is_same_day, is_same_week, is_same_month, get_moscow_now
+from bot.models.database import Rental, Car, DailyUserStats
+from bot.utils.datetime_helper import PeriodBounds
+
+
+# Периоды статистики в порядке вывода
+PERIODS = ("day", "week", "month", "all")
 
 
 class ResellStatistics:
     @staticmethod
-    async def get_income(session: AsyncSession, user_id: int, period: str = "all"):
-        """Получить доход (сумму продаж) за период"""
-        query = select(func.sum(Sale.sale_price)).join(
-            Item, Sale.item_id == Item.id
-        ).where(Item.user_id == user_id)
+    async def get_summary(session: AsyncSession, user_id: int, now: datetime = None):
+        """Доход, расходы и прибыль за день/неделю/месяц/всё время одним запросом.
+
+        Возвращает {period: {"income", "expenses", "profit"}}. Читает дневные
+        итоги daily_user_stats (московские дни): доход - продажи за период,
+        расходы - закупка проданных товаров, купленных за период.
+        """
+        bounds = PeriodBounds(now)
         
-        if period != "all":
-            # Фильтруем по дате продажи
-            all_sales = await session.execute(
-                select(Sale).join(Item, Sale.item_id == Item.id).where(Item.user_id == user_id)
-            )
-            sales = all_sales.scalars().all()
-            
-            now = get_moscow_now()
-            filtered_sales = []
-            
-            for sale in sales:
-                if period == "day" and is_same_day(sale.sale_date, now):
-                    filtered_sales.append(sale.sale_price)
-                elif period == "week" and is_same_week(sale.sale_date, now):
-                    filtered_sales.append(sale.sale_price)
-                elif period == "month" and is_same_month(sale.sale_date, now):
-                    filtered_sales.append(sale.sale_price)
+        columns = []
+        for period in PERIODS:
+            if period == "all":
+                columns.append(func.coalesce(func.sum(DailyUserStats.income), 0))
+                columns.append(func.coalesce(func.sum(DailyUserStats.expenses), 0))
+                continue
             
-            return sum(filtered_sales) if filtered_sales else 0.0
+            in_period = DailyUserStats.day >= bounds.start(period).date()
+            columns.append(func.coalesce(func.sum(
+                case((in_period, DailyUserStats.income), else_=0)
+            ), 0))
+            columns.append(func.coalesce(func.sum(
+                case((in_period, DailyUserStats.expenses), else_=0)
+            ), 0))
         
-        result = await session.execute(query)
-        total = result.scalar()
-        return total or 0.0
-    
-    @staticmethod
-    async def get_expenses(session: AsyncSession, user_id: int, period: str = "all"):
-        """Получить расходы (сумму покупок) за период"""
-        all_items = await session.execute(
-            select(Item).where(Item.user_id == user_id, Item.sold == True)
+        result = await session.execute(
+            select(*columns).where(DailyUserStats.user_id == user_id)
         )
-        items = all_items.scalars().all()
-        
-        now = get_moscow_now()
-        total = 0.0
+        row = result.one()
         
-        for item in items:
-            if period == "all":
-                total += item.purchase_price
-            elif period == "day" and is_same_day(item.purchase_date, now):
-                total += item.purchase_price
-            elif period == "week" and is_same_week(item.purchase_date, now):
-                total += item.purchase_price
-            elif period == "month" and is_same_month(item.purchase_date, now):
-                total += item.purchase_price
-        
-        return total
-    
-    @staticmethod
-    async def get_profit(session: AsyncSession, user_id: int, period: str = "all"):
-        """Получить прибыль (доход - расходы) за период"""
-        income = await ResellStatistics.get_income(session, user_id, period)
-        expenses = await ResellStatistics.get_expenses(session, user_id, period)
-        return income - expenses
+        summary = {}
+        for index, period in enumerate(PERIODS):
+            income = float(row[index * 2])
+            expenses = float(row[index * 2 + 1])
+            summary[period] = {
+                "income": income,
+                "expenses": expenses,
+                "profit": income - expenses,
+            }
+        return summary
 
 
 class RentalStatistics:
     @staticmethod
-    async def get_income_by_car(session: AsyncSession, car_id: int, period: str = "all"):
-        """Получить доход по конкретному автомобилю"""
-        all_rentals = await session.execute(
-            select(Rental).where(Rental.car_id == car_id)
-        )
-        rentals = all_rentals.scalars().all()
+    def _period_start_utc(period: str, bounds: PeriodBounds = None):
+        """Начало периода в UTC или None для "all" """
+        if period not in ("day", "week", "month"):
+            return None
+        return (bounds or PeriodBounds()).utc_range(period)[0]
+    
+    @staticmethod
+    async def get_summary(session: AsyncSession, user_id: int, car_id: int = None, now: datetime = None):
+        """Доход с аренды за день/неделю/месяц/всё время по каждой машине и в сумме.
+
+        Один запрос: cars LEFT JOIN rentals с группировкой по машине. Возвращает
+        {"total": {period: income}, "cars": [{"id", "name", "income": {period: income}}]}.
+        """
+        bounds = PeriodBounds(now)
+        starts = {
+            period: RentalStatistics._period_start_utc(period, bounds)
+            for period in PERIODS
+        }
         
-        now = get_moscow_now()
-        total = 0.0
+        columns = []
+        for period in PERIODS:
+            if starts[period] is None:
+                columns.append(func.coalesce(func.sum(Rental.total_income), 0))
+            else:
+                columns.append(func.coalesce(func.sum(
+                    case((Rental.rental_start >= starts[period], Rental.total_income), else_=0)
+                ), 0))
         
-        for rental in rentals:
-            income = rental.price_per_hour * rental.hours
-            
-            if period == "all":
-                total += income
-            elif period == "day" and is_same_day(rental.rental_start, now):
-                total += income
-            elif period == "week" and is_same_week(rental.rental_start, now):
-                total += income
-            elif period == "month" and is_same_month(rental.rental_start, now):
-                total += income
+        filters = [Car.user_id == user_id]
+        if car_id is not None:
+            filters.append(Car.id == car_id)
         
-        return total
-    
-    @staticmethod
-    async def get_total_income(session: AsyncSession, user_id: int, period: str = "all"):
-        """Получить общий доход с аренды по всем автомобилям"""
-        all_rentals = await session.execute(
-            select(Rental).where(Rental.user_id == user_id)
+        result = await session.execute(
+            select(Car.id, Car.name, *columns).select_from(Car).outerjoin(
+                Rental, Rental.car_id == Car.id
+            ).where(*filters).group_by(Car.id, Car.name).order_by(Car.id)
         )
-        rentals = all_rentals.scalars().all()
         
-        now = get_moscow_now()
-        total = 0.0
-        
-        for rental in rentals:
-            income = rental.price_per_hour * rental.hours
-            
-            if period == "all":
-                total += income
-            elif period == "day" and is_same_day(rental.rental_start, now):
-                total += income
-            elif period == "week" and is_same_week(rental.rental_start, now):
-                total += income
-            elif period == "month" and is_same_month(rental.rental_start, now):
-                total += income
+        total = {period: 0.0 for period in PERIODS}
+        cars = []
+        for row in result.all():
+            income = {period: float(row[index + 2]) for index, period in enumerate(PERIODS)}
+            for period in PERIODS:
+                total[period] += income[period]
+            cars.append({"id": row[0], "name": row[1], "income": income})
         
-        return total
+        return {"total": total, "cars": cars}
@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func
+
+# Поддерживаемые шаги группировки для графиков
+GRANULARITIES = ("hour", "day", "week", "month")
+
+# Защита от слишком длинных графиков (например, hour за несколько лет)
+MAX_BUCKETS = 1000
+
+DAY_NAMES = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+
+# Формат ключа бакета; одинаковый для SQL и Python, чтобы склеивать результаты
+_KEY_FORMATS = {
+    "hour": "%Y-%m-%d %H:00",
+    "day": "%Y-%m-%d",
+    "week": "%Y-%m-%d",  # понедельник недели
+    "month": "%Y-%m",
+}
+
+_PG_KEY_FORMATS = {
+    "hour": "YYYY-MM-DD HH24:00",
+    "day": "YYYY-MM-DD",
+    "week": "YYYY-MM-DD",
+    "month": "YYYY-MM",
+}
+
+
+def bucket_key_expr(column, granularity: str, dialect_name: str, offset_minutes: int = 0):
+    """SQL-выражение ключа бакета для колонки времени.
+
+    Колонка хранит UTC (timestamptz в PostgreSQL, UTC без смещения в SQLite),
+    offset_minutes переводит её в локальное время (для Москвы +180) перед группировкой.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity}")
+
+    if dialect_name == "postgresql":
+        # timestamptz -> UTC без зоны, чтобы date_trunc не зависел от пояса сессии
+        shifted = func.timezone("UTC", column) + timedelta(minutes=offset_minutes)
+        return func.to_char(func.date_trunc(granularity, shifted), _PG_KEY_FORMATS[granularity])
+
+    # SQLite
+    shifted = func.datetime(column, f"{offset_minutes:+d} minutes")
+    if granularity == "week":
+        # Понедельник той же недели: откатываемся на 6 дней и идём до ближайшего понедельника
+        return func.date(shifted, "-6 days", "weekday 1")
+    return func.strftime(_KEY_FORMATS[granularity], shifted)
+
+
+def floor_to_bucket(dt: datetime, granularity: str) -> datetime:
+    """Начало бакета, в который попадает dt"""
+    if granularity == "hour":
+        return dt.replace(minute=0, second=0, microsecond=0)
+    day = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def _next_bucket(dt: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return dt + timedelta(hours=1)
+    if granularity == "day":
+        return dt + timedelta(days=1)
+    if granularity == "week":
+        return dt + timedelta(weeks=1)
+    if dt.month == 12:
+        return dt.replace(year=dt.year + 1, month=1)
+    return dt.replace(month=dt.month + 1)
+
+
+def iter_buckets(start: datetime, end: datetime, granularity: str):
+    """Начала всех бакетов в диапазоне [start, end) в локальном времени (без tzinfo)"""
+    start = start.replace(tzinfo=None)
+    end = end.replace(tzinfo=None)
+
+    buckets = []
+    current = floor_to_bucket(start, granularity)
+    while current < end:
+        buckets.append(current)
+        if len(buckets) > MAX_BUCKETS:
+            raise ValueError(f"Too many buckets for granularity '{granularity}', narrow the range")
+        current = _next_bucket(current, granularity)
+    return buckets
+
+
+def bucket_key(dt: datetime, granularity: str) -> str:
+    """Ключ бакета в том же формате, что возвращает bucket_key_expr"""
+    return floor_to_bucket(dt, granularity).strftime(_KEY_FORMATS[granularity])
+
+
+def bucket_label(dt: datetime, granularity: str, multi_day: bool = False) -> str:
+    """Подпись бакета для графика"""
+    if granularity == "hour":
+        return dt.strftime('%d.%m %H:00') if multi_day else dt.strftime('%H:00')
+    if granularity == "month":
+        return dt.strftime('%m.%Y')
+    return dt.strftime('%d.%m')
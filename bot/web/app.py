@@ -4,12 +4,30 @@ import logging
 import os
 import sys
 from pathlib import Path
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
-from bot.models.database import User, Item, Car, Sale, Rental, BuyPrice, CategoryEnum, BPTask, BPCompletion
-from bot.utils.datetime_helper import get_moscow_now
-from bot.config import DATABASE_URL
+from sqlalchemy import create_engine, text, func, and_, or_, case, select, literal, true
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import sessionmaker, scoped_session
+from bot.models.database import User, Item, Car, Sale, Rental, BuyPrice, BuyPriceTotals, CategoryEnum, BPTask, BPCompletion, BPDayBits, Timer, DailyUserStats
+from bot.models.users import find_user, get_or_create_user, forget_user
+from bot.utils.datetime_helper import get_moscow_now, utc_now, format_datetime, in_range, bp_day_date, MOSCOW_TZ, PeriodBounds
+from bot.utils.cache import ProcessLocalCache, payback_cache
+from bot.utils.bp_history import summarize_bp_history
+from bot.utils.timeseries import GRANULARITIES, DAY_NAMES, bucket_key_expr, bucket_key, bucket_label, iter_buckets
+from bot.config import DATABASE_URL, BP_TOTAL_COUNTER, DB_POOL_WARMUP, WEB_SERVER
+from bot.models.pool import pool_kwargs, warm_up
+from bot.models.init_db import db
+from bot.models.indexes import ensure_indexes
+from bot.models.migrations import (
+    add_rental_total_income, normalize_timestamps_to_utc, add_bp_day,
+    add_bp_task_bits, ensure_bp_day_bits, ensure_daily_stats
+)
+from bot.tasks.notifications import schedule_rental
+from bot.tasks.timers import schedule_timer, unschedule_timer
+from bot.tasks.outbox import enqueue_message, outbox_sender
 from datetime import datetime, timedelta
+import base64
+import greenlet
+import json
 import pytz
 
 logging.basicConfig(level=logging.INFO)
@@ -51,9 +69,23 @@ try:
         logger.info(f"   Using SQLite")
         connect_args = {"check_same_thread": False}
     
-    logger.info(f"   SYNC_DATABASE_URL: {SYNC_DATABASE_URL}")
-    sync_engine = create_engine(SYNC_DATABASE_URL, connect_args=connect_args)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=sync_engine)
+    if WEB_SERVER == "asgi" and db.engine is not None:
+        # ASGI в loop бота (bot.web.asgi): синхронный фасад async-движка бота - запросы
+        # идут через asyncpg/aiosqlite и общий пул; работает только внутри greenlet_spawn,
+        # запросы - это greenlet'ы одного потока, поэтому сессия - на greenlet
+        logger.info(f"   Using bot async engine (ASGI)")
+        sync_engine = db.engine.sync_engine
+        SessionLocal = scoped_session(
+            sessionmaker(autocommit=False, autoflush=False, bind=sync_engine),
+            scopefunc=greenlet.getcurrent
+        )
+    else:
+        logger.info(f"   SYNC_DATABASE_URL: {SYNC_DATABASE_URL}")
+        sync_engine = create_engine(
+            SYNC_DATABASE_URL, connect_args=connect_args, **pool_kwargs(SYNC_DATABASE_URL, "web")
+        )
+        # Одна сессия на запрос (на поток), закрывается в teardown_appcontext
+        SessionLocal = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=sync_engine))
     
     # Создаём все таблицы
     from bot.models.database import Base
@@ -152,6 +184,40 @@ try:
         import traceback
         logger.error(traceback.format_exc())
     
+    # Проверяем и добавляем bp_total_earned колонку (счётчик BP за всё время)
+    try:
+        with sync_engine.connect() as connection:
+            if "postgresql" in DATABASE_URL or "postgres" in DATABASE_URL:
+                result = connection.execute(
+                    text("""
+                    SELECT EXISTS (
+                        SELECT FROM information_schema.columns 
+                        WHERE table_name='users' AND column_name='bp_total_earned'
+                    );
+                    """)
+                )
+                has_bp_total = result.scalar()
+            else:
+                result = connection.execute(
+                    text("PRAGMA table_info(users)")
+                )
+                has_bp_total = 'bp_total_earned' in [row[1] for row in result.fetchall()]
+            
+            if not has_bp_total:
+                # NULL = счётчик ещё не посчитан, заполняется при первом запросе статистики
+                logger.info("🔧 Adding bp_total_earned column to users table...")
+                connection.execute(
+                    text("ALTER TABLE users ADD COLUMN bp_total_earned INTEGER;")
+                )
+                connection.commit()
+                logger.info("✅ bp_total_earned column added")
+            else:
+                logger.info("✅ bp_total_earned column already exists")
+    except Exception as e:
+        logger.error(f"❌ Error adding bp_total_earned column: {e}")
+        import traceback
+        logger.error(traceback.format_exc())
+    
     # Проверяем и добавляем колонки item_id и sale_price в buy_prices
     try:
         with sync_engine.connect() as connection:
@@ -228,6 +294,46 @@ try:
         import traceback
         logger.error(traceback.format_exc())
     
+    # Добавляем rentals.total_income (доход аренды для SQL-агрегатов статистики)
+    try:
+        with sync_engine.begin() as connection:
+            add_rental_total_income(connection)
+    except Exception as e:
+        logger.error(f"❌ Error adding total_income column: {e}")
+        import traceback
+        logger.error(traceback.format_exc())
+    
+    # Все времена в БД - UTC (старые московские значения сдвигаются один раз)
+    try:
+        with sync_engine.begin() as connection:
+            normalize_timestamps_to_utc(connection)
+    except Exception as e:
+        logger.error(f"❌ Error normalizing timestamps to UTC: {e}")
+    
+    # Номер BP-дня у выполнений (bp_completions.bp_day) и история BP-дней битами (bp_day_bits)
+    try:
+        with sync_engine.begin() as connection:
+            add_bp_day(connection)
+            add_bp_task_bits(connection)
+            ensure_bp_day_bits(connection)
+    except Exception as e:
+        logger.error(f"❌ Error preparing BP history: {e}")
+    
+    # Заполняем daily_user_stats, если таблица только что создана
+    try:
+        with sync_engine.begin() as connection:
+            ensure_daily_stats(connection)
+    except Exception as e:
+        logger.error(f"❌ Error filling daily_user_stats: {e}")
+    
+    # Создаём индексы моделей, которых нет в уже существующих таблицах
+    try:
+        ensure_indexes(sync_engine)
+    except Exception as e:
+        logger.error(f"❌ Error creating indexes: {e}")
+        import traceback
+        logger.error(traceback.format_exc())
+    
     # Инициализируем BP задания
     try:
         session = SessionLocal()
@@ -314,6 +420,11 @@ try:
         session.close()
     except Exception as e:
         logger.warning(f"⚠️ Could not initialize BP tasks: {e}")
+    
+    # Прогреваем пул (под gunicorn - в каждом воркере после fork, см. gunicorn.conf.py;
+    # пул async-движка прогревает db.init)
+    if DB_POOL_WARMUP and WEB_SERVER not in ("gunicorn", "asgi"):
+        warm_up(sync_engine)
 except Exception as e:
     logger.error(f"❌ Database error: {e}")
     import traceback
@@ -321,6 +432,13 @@ except Exception as e:
     SessionLocal = None
 
 
+@app.teardown_appcontext
+def remove_session(exception=None):
+    """Вернуть соединение сессии запроса в пул"""
+    if SessionLocal is not None:
+        SessionLocal.remove()
+
+
 @app.before_request
 def log_request():
     """Логируем все входящие запросы"""
@@ -347,6 +465,24 @@ def handle_404(e):
 # Флаг для отслеживания, запущен ли бот
 _bot_started = False
 
+# Максимальный размер страницы для постраничных эндпоинтов
+MAX_PER_PAGE = 100
+
+
+def _encode_cursor(value, row_id):
+    """Упаковать ключ последней строки страницы в непрозрачный курсор"""
+    raw = json.dumps([value, row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def _decode_cursor(cursor):
+    """Распаковать курсор в (значение ключа сортировки, id)"""
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return value, int(row_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
 
 try:
     @app.route('/')
@@ -384,12 +520,7 @@ def add_item():
         session = SessionLocal()
         try:
             # Получаем или создаем пользователя
-            user = session.query(User).filter(User.telegram_id == user_id).first()
-            if not user:
-                user = User(telegram_id=user_id)
-                session.add(user)
-                session.flush()
-                logger.info(f"   Created new user: {user.id}")
+            user = get_or_create_user(session, user_id)
             
             # Создаем товар
             item = Item(
@@ -494,11 +625,7 @@ def add_car():
         session = SessionLocal()
         try:
             # Получаем пользователя или создаем
-            user = session.query(User).filter(User.telegram_id == user_id).first()
-            if not user:
-                user = User(telegram_id=user_id)
-                session.add(user)
-                session.flush()
+            user = get_or_create_user(session, user_id)
             
             # Создаем автомобиль
             car = Car(
@@ -508,6 +635,7 @@ def add_car():
             )
             session.add(car)
             session.commit()
+            payback_cache.invalidate(user.id)
             
             logger.info(f"Car added successfully: {car.id}")
             
@@ -537,11 +665,7 @@ def rent_car():
         session = SessionLocal()
         try:
             # Получаем пользователя или создаем
-            user = session.query(User).filter(User.telegram_id == user_id).first()
-            if not user:
-                user = User(telegram_id=user_id)
-                session.add(user)
-                session.flush()
+            user = get_or_create_user(session, user_id)
             
             # Парсим время окончания
             now_moscow = get_moscow_now()
@@ -597,6 +721,8 @@ def rent_car():
             )
             session.add(rental)
             session.commit()
+            payback_cache.invalidate(user.id)
+            schedule_rental(rental.id, rental_end_utc, bind=sync_engine)
             
             total_income = float(data['price_per_hour']) * int(data['hours'])
             past_label = " (прошлая аренда)" if is_past else ""
@@ -629,7 +755,7 @@ def get_cars():
         
         session = SessionLocal()
         try:
-            user = session.query(User).filter(User.telegram_id == user_id).first()
+            user = find_user(session, user_id)
             
             if not user:
                 return jsonify({
@@ -637,28 +763,43 @@ def get_cars():
                     'cars': []
                 })
             
-            # Получаем все машины пользователя (без фильтрации is_deleted для совместимости)
-            cars = session.query(Car).filter(Car.user_id == user.id).all()
-            
-            cars_list = []
-            for car in cars:
-                # Рассчитываем общий доход этого авто
-                rentals = session.query(Rental).filter(Rental.car_id == car.id).all()
-                total_income = sum(float(r.price_per_hour) * r.hours for r in rentals)
+            cars_list = payback_cache.get(user.id)
+            if cars_list is None:
+                # Один запрос: машины + сумма и количество аренд (LEFT JOIN, чтобы машины без аренд тоже попали)
+                income_expr = func.coalesce(func.sum(Rental.price_per_hour * Rental.hours), 0)
+                rows = session.query(
+                    Car.id,
+                    Car.name,
+                    Car.cost,
+                    income_expr.label('total_income'),
+                    func.count(Rental.id).label('rentals_count')
+                ).outerjoin(
+                    Rental, Rental.car_id == Car.id
+                ).filter(
+                    Car.user_id == user.id
+                ).group_by(
+                    Car.id, Car.name, Car.cost
+                ).order_by(Car.id).all()
                 
-                # Рассчитываем процент окупаемости
-                payback_percent = 0
-                if car.cost > 0:
-                    payback_percent = min(100, (total_income / car.cost) * 100)
+                cars_list = []
+                for car_id, name, cost, total_income, rentals_count in rows:
+                    total_income = float(total_income or 0)
+                    
+                    # Рассчитываем процент окупаемости
+                    payback_percent = 0
+                    if cost > 0:
+                        payback_percent = min(100, (total_income / cost) * 100)
+                    
+                    cars_list.append({
+                        'id': car_id,
+                        'name': name,
+                        'cost': float(cost),
+                        'total_income': total_income,
+                        'payback_percent': round(payback_percent, 1),
+                        'rentals_count': rentals_count
+                    })
                 
-                cars_list.append({
-                    'id': car.id,
-                    'name': car.name,
-                    'cost': float(car.cost),
-                    'total_income': total_income,
-                    'payback_percent': round(payback_percent, 1),
-                    'rentals_count': len(rentals)
-                })
+                payback_cache.set(user.id, cars_list)
             
             return jsonify({
                 'success': True,
@@ -682,7 +823,7 @@ def get_items():
         
         session = SessionLocal()
         try:
-            user = session.query(User).filter(User.telegram_id == user_id).first()
+            user = find_user(session, user_id)
             
             if not user:
                 logger.info(f"📭 No user found for telegram_id {user_id}")
@@ -721,8 +862,9 @@ def get_sales():
         user_id = int(request.headers.get('X-User-ID', 0))
         time_filter = request.args.get('time_filter', 'all')  # day, week, all
         deal_filter = request.args.get('deal_filter', 'all')  # best, worst, all
-        page = int(request.args.get('page', 1))  # Номер страницы
-        per_page = int(request.args.get('per_page', 15))  # Элементов на странице
+        page = max(1, int(request.args.get('page', 1)))  # Номер страницы
+        per_page = min(MAX_PER_PAGE, max(1, int(request.args.get('per_page', 15))))  # Элементов на странице
+        cursor = request.args.get('cursor')  # Keyset-курсор (вместо page)
         
         logger.info(f"📊 Statistics request: user_id={user_id}, time_filter={time_filter}, deal_filter={deal_filter}, page={page}")
         
@@ -731,7 +873,7 @@ def get_sales():
         
         session = SessionLocal()
         try:
-            user = session.query(User).filter(User.telegram_id == user_id).first()
+            user = find_user(session, user_id)
             
             if not user:
                 return jsonify({
@@ -741,75 +883,103 @@ def get_sales():
                     'total_profit': 0,
                     'total_sales': 0,
                     'page': 1,
-                    'total_pages': 0
+                    'total_pages': 0,
+                    'next_cursor': None
                 })
             
-            # Получаем все продажи для товаров пользователя
-            sales = session.query(Sale).join(Item).filter(Item.user_id == user.id).all()
-            
-            # Фильтруем по времени
+            # Фильтры по времени считаем заранее и отдаём в БД как диапазон по sale_date (UTC)
+            filters = [Item.user_id == user.id]
+            bounds = PeriodBounds()
             if time_filter == 'day':
-                from datetime import datetime, timedelta
-                # Получаем начало дня в Москве
-                today = get_moscow_now().replace(hour=0, minute=0, second=0, microsecond=0)
-                # Получаем конец дня в Москве
-                tomorrow = today + timedelta(days=1)
-                
-                logger.info(f"📅 Filtering for day: {today} to {tomorrow}")
-                
-                # Сравниваем без timezone для корректности
-                sales = [s for s in sales if s.sale_date and 
-                        today.replace(tzinfo=None) <= s.sale_date.replace(tzinfo=None) < tomorrow.replace(tzinfo=None)]
+                logger.info(f"📅 Filtering for day: {bounds.start('day')} to {bounds.end('day')}")
+                filters += bounds.filter(Sale.sale_date, 'day')
             elif time_filter == 'week':
-                from datetime import datetime, timedelta
-                week_ago = get_moscow_now() - timedelta(days=7)
-                # Убираем timezone для корректного сравнения
-                week_ago_naive = week_ago.replace(tzinfo=None)
-                now_naive = get_moscow_now().replace(tzinfo=None)
-                
-                logger.info(f"📊 Filtering for week: {week_ago_naive} to {now_naive}")
-                
-                sales = [s for s in sales if s.sale_date and 
-                        week_ago_naive <= s.sale_date.replace(tzinfo=None) <= now_naive]
+                week_ago = bounds.now - timedelta(days=7)
+                logger.info(f"📊 Filtering for week: {week_ago} to {bounds.now}")
+                filters += in_range(Sale.sale_date, week_ago)
+            
+            profit_expr = Sale.sale_price - Item.purchase_price
             
-            # Сортируем по типу сделок или по дате (по умолчанию новые первые)
+            # Итоги одним агрегирующим запросом
+            total_count, total_income, total_profit = session.query(
+                func.count(Sale.id),
+                func.coalesce(func.sum(Sale.sale_price), 0),
+                func.coalesce(func.sum(profit_expr), 0)
+            ).join(Item, Sale.item_id == Item.id).filter(*filters).one()
+            
+            # Сортируем по типу сделок или по дате (по умолчанию новые первые);
+            # id добавляется как tie-breaker, чтобы порядок (и курсор) был однозначным
             if deal_filter == 'best':
-                sales = sorted(sales, key=lambda s: float(s.sale_price) - float(s.item.purchase_price), reverse=True)
+                sort_expr, descending = profit_expr, True
             elif deal_filter == 'worst':
-                sales = sorted(sales, key=lambda s: float(s.sale_price) - float(s.item.purchase_price))
+                sort_expr, descending = profit_expr, False
             else:
-                # По умолчанию сортируем по дате (новые первые)
-                sales = sorted(sales, key=lambda s: s.sale_date if s.sale_date else datetime.min, reverse=True)
+                sort_expr, descending = Sale.sale_date, True
             
-            total_income = sum(float(sale.sale_price) for sale in sales)
-            total_profit = sum(float(sale.sale_price) - float(sale.item.purchase_price) for sale in sales)
-            total_count = len(sales)
+            if descending:
+                order_by = [sort_expr.desc(), Sale.id.desc()]
+            else:
+                order_by = [sort_expr.asc(), Sale.id.asc()]
+            
+            query = session.query(
+                Sale.id,
+                Item.name,
+                Sale.sale_price,
+                Item.purchase_price,
+                Sale.sale_date,
+                profit_expr.label('profit')
+            ).join(Item, Sale.item_id == Item.id).filter(*filters)
+            
+            if cursor:
+                # Keyset-пагинация: продолжаем строго после последней строки предыдущей страницы
+                last_value, last_id = _decode_cursor(cursor)
+                if deal_filter not in ('best', 'worst'):
+                    last_value = datetime.fromisoformat(last_value)
+                if descending:
+                    query = query.filter(or_(
+                        sort_expr < last_value,
+                        and_(sort_expr == last_value, Sale.id < last_id)
+                    ))
+                else:
+                    query = query.filter(or_(
+                        sort_expr > last_value,
+                        and_(sort_expr == last_value, Sale.id > last_id)
+                    ))
+                rows = query.order_by(*order_by).limit(per_page).all()
+            else:
+                rows = query.order_by(*order_by).limit(per_page).offset((page - 1) * per_page).all()
             
             # Пагинация
             total_pages = (total_count + per_page - 1) // per_page  # Округление вверх
-            start_idx = (page - 1) * per_page
-            end_idx = start_idx + per_page
-            paginated_sales = sales[start_idx:end_idx]
+            
+            next_cursor = None
+            if len(rows) == per_page:
+                last = rows[-1]
+                if deal_filter in ('best', 'worst'):
+                    next_cursor = _encode_cursor(float(last.profit), last.id)
+                elif last.sale_date is not None:
+                    next_cursor = _encode_cursor(last.sale_date.isoformat(), last.id)
             
             return jsonify({
                 'success': True,
                 'sales': [
                     {
-                        'id': sale.id,
-                        'item_name': sale.item.name,
-                        'sale_price': float(sale.sale_price),
-                        'purchase_price': float(sale.item.purchase_price),
-                        'profit': float(sale.sale_price) - float(sale.item.purchase_price),
-                        'created_at': sale.sale_date.isoformat() if sale.sale_date else None
+                        'id': row.id,
+                        'item_name': row.name,
+                        'sale_price': float(row.sale_price),
+                        'purchase_price': float(row.purchase_price),
+                        'profit': float(row.sale_price) - float(row.purchase_price),
+                        'created_at': row.sale_date.isoformat() if row.sale_date else None
                     }
-                    for sale in paginated_sales
+                    for row in rows
                 ],
-                'total_income': total_income,
-                'total_profit': total_profit,
+                'total_income': float(total_income),
+                'total_profit': float(total_profit),
                 'total_sales': total_count,
                 'page': page,
                 'per_page': per_page,
-                'total_pages': total_pages
+                'total_pages': total_pages,
+                'next_cursor': next_cursor
             })
         finally:
             session.close()
@@ -829,7 +999,7 @@ def get_rentals():
         
         session = SessionLocal()
         try:
-            user = session.query(User).filter(User.telegram_id == user_id).first()
+            user = find_user(session, user_id)
             
             if not user:
                 return jsonify({
@@ -846,24 +1016,9 @@ def get_rentals():
             
             logger.info(f"📊 Found {len(rentals)} active rentals for user {user_id}")
             
-            # Форматируем даты в московское время
+            # Форматируем даты в московское время (naive - это UTC, как мы сохраняем)
             def format_moscow_time(dt):
-                if not dt:
-                    return None
-                try:
-                    tz_moscow = pytz.timezone('Europe/Moscow')
-                    tz_utc = pytz.UTC
-                    
-                    # Если это naive datetime, предполагаем что это UTC (как мы сохраняем)
-                    if dt.tzinfo is None:
-                        dt = tz_utc.localize(dt)
-                    
-                    # Конвертируем в Moscow timezone
-                    dt_moscow = dt.astimezone(tz_moscow)
-                    return dt_moscow.strftime('%d.%m.%Y %H:%M')
-                except Exception as e:
-                    logger.error(f"❌ Error formatting date {dt}: {e}")
-                    return str(dt)
+                return format_datetime(dt) if dt else None
             
             rentals_data = []
             for rental in rentals:
@@ -896,13 +1051,19 @@ def get_rental_stats():
     try:
         user_id = int(request.headers.get('X-User-ID', 0))
         time_filter = request.args.get('time_filter', 'all')  # day, week, all
+        date_from = request.args.get('from')  # ISO дата/время (Москва), необязательно
+        date_to = request.args.get('to')
+        granularity = request.args.get('granularity')  # hour, day, week, month
         
         if not user_id:
             return jsonify({'success': False, 'error': 'User ID not provided'}), 400
         
+        if granularity and granularity not in GRANULARITIES:
+            return jsonify({'success': False, 'error': f'Unknown granularity: {granularity}'}), 400
+        
         session = SessionLocal()
         try:
-            user = session.query(User).filter(User.telegram_id == user_id).first()
+            user = find_user(session, user_id)
             
             if not user:
                 return jsonify({
@@ -914,109 +1075,99 @@ def get_rental_stats():
                     'chart_data': {'labels': [], 'values': []}
                 })
             
-            # Получаем все аренды пользователя
-            all_rentals = session.query(Rental).filter(Rental.user_id == user.id).all()
+            # Определяем диапазон статистики и окно графика (в московском времени)
+            bounds = PeriodBounds()
+            now = bounds.now
+            range_start = range_end = None
             
-            # Фильтруем по времени
-            now = get_moscow_now()
-            if time_filter == 'day':
-                today = now.replace(hour=0, minute=0, second=0, microsecond=0)
-                tomorrow = today + timedelta(days=1)
-                filtered_rentals = [r for r in all_rentals if r.rental_start and 
-                                   today.replace(tzinfo=None) <= r.rental_start.replace(tzinfo=None) < tomorrow.replace(tzinfo=None)]
+            if date_from or date_to:
+                def parse_moscow(value):
+                    dt = datetime.fromisoformat(value)
+                    return MOSCOW_TZ.localize(dt) if dt.tzinfo is None else dt.astimezone(MOSCOW_TZ)
+                
+                range_start = parse_moscow(date_from) if date_from else None
+                range_end = parse_moscow(date_to) if date_to else now
+                granularity = granularity or 'day'
+                chart_start = range_start or range_end - timedelta(days=29)
+                chart_end = range_end
+            elif time_filter == 'day':
+                # Для дня - по часам
+                range_start, range_end = bounds.start('day'), bounds.end('day')
+                granularity = granularity or 'hour'
+                chart_start, chart_end = range_start, range_end
             elif time_filter == 'week':
-                week_ago = now - timedelta(days=7)
-                filtered_rentals = [r for r in all_rentals if r.rental_start and 
-                                   r.rental_start.replace(tzinfo=None) >= week_ago.replace(tzinfo=None)]
-            else:  # all
-                filtered_rentals = all_rentals
-            
-            # Общая статистика
-            total_rentals = len(filtered_rentals)
-            total_income = sum(float(r.price_per_hour) * r.hours for r in filtered_rentals)
-            
-            # Статистика по каждому автомобилю
+                # Для недели - по дням за последние 7 дней
+                range_start = now - timedelta(days=7)
+                granularity = granularity or 'day'
+                chart_start, chart_end = now - timedelta(days=6), now
+            else:  # all - статистика за всё время, график за последние 30 дней
+                granularity = granularity or 'day'
+                chart_start, chart_end = now - timedelta(days=29), now
+            
+            buckets = iter_buckets(chart_start, chart_end, granularity)
+            
+            join_condition = [Rental.car_id == Car.id, Rental.user_id == user.id]
+            join_condition += in_range(Rental.rental_start, range_start, range_end)
+            
+            # Один запрос: машины пользователя × бакеты времени (LEFT JOIN, чтобы посчитать и машины без аренд)
+            offset_minutes = int(now.utcoffset().total_seconds() // 60)
+            bucket = bucket_key_expr(
+                Rental.rental_start, granularity, sync_engine.dialect.name, offset_minutes
+            ).label('bucket')
+            rows = session.query(
+                Car.id,
+                Car.name,
+                bucket,
+                func.count(Rental.id),
+                func.coalesce(func.sum(Rental.hours), 0),
+                func.coalesce(func.sum(Rental.price_per_hour * Rental.hours), 0)
+            ).outerjoin(
+                Rental, and_(*join_condition)
+            ).filter(
+                Car.user_id == user.id
+            ).group_by(Car.id, Car.name, bucket).all()
+            
+            # Статистика по каждому автомобилю и по бакетам графика
             cars_stats = {}
-            for rental in filtered_rentals:
-                car = rental.car
-                if not car:
-                    continue
-                    
-                car_key = f"{car.id}_{car.name}"
-                if car_key not in cars_stats:
-                    cars_stats[car_key] = {
-                        'car_id': car.id,
-                        'car_name': car.name,
+            bucket_income = {}
+            for car_id, car_name, bucket_value, rentals_count, hours, income in rows:
+                if car_id not in cars_stats:
+                    cars_stats[car_id] = {
+                        'car_id': car_id,
+                        'car_name': car_name,
                         'rentals_count': 0,
                         'total_hours': 0,
                         'total_income': 0
                     }
+                if not rentals_count:
+                    continue
                 
-                cars_stats[car_key]['rentals_count'] += 1
-                cars_stats[car_key]['total_hours'] += rental.hours
-                cars_stats[car_key]['total_income'] += float(rental.price_per_hour) * rental.hours
-            
-            # Сортируем по доходу (по убыванию)
-            cars_list = sorted(cars_stats.values(), key=lambda x: x['total_income'], reverse=True)
+                cars_stats[car_id]['rentals_count'] += rentals_count
+                cars_stats[car_id]['total_hours'] += int(hours)
+                cars_stats[car_id]['total_income'] += float(income)
+                bucket_income[bucket_value] = bucket_income.get(bucket_value, 0) + float(income)
             
             # Количество машин
-            cars_count = session.query(Car).filter(Car.user_id == user.id).count()
+            cars_count = len(cars_stats)
+            
+            # Общая статистика и сортировка по доходу (по убыванию)
+            cars_list = sorted(
+                (c for c in cars_stats.values() if c['rentals_count'] > 0),
+                key=lambda x: x['total_income'],
+                reverse=True
+            )
+            total_rentals = sum(c['rentals_count'] for c in cars_list)
+            total_income = sum(c['total_income'] for c in cars_list)
             
             # === ДАННЫЕ ДЛЯ ГРАФИКА ===
-            # Группируем доходы по дням за последние 7 дней (или за выбранный период)
             chart_data = {'labels': [], 'values': []}
-            
-            if time_filter == 'day':
-                # Для дня - показываем по часам
-                hours_income = {}
-                for rental in filtered_rentals:
-                    if rental.rental_start:
-                        hour_key = rental.rental_start.strftime('%H:00')
-                        income = float(rental.price_per_hour) * rental.hours
-                        hours_income[hour_key] = hours_income.get(hour_key, 0) + income
-                
-                # Заполняем все часы дня
-                for h in range(24):
-                    hour_label = f'{h:02d}:00'
-                    chart_data['labels'].append(hour_label)
-                    chart_data['values'].append(hours_income.get(hour_label, 0))
-                    
-            elif time_filter == 'week':
-                # Для недели - по дням
-                days_income = {}
-                day_names = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
-                
-                for rental in filtered_rentals:
-                    if rental.rental_start:
-                        day_key = rental.rental_start.strftime('%Y-%m-%d')
-                        income = float(rental.price_per_hour) * rental.hours
-                        days_income[day_key] = days_income.get(day_key, 0) + income
-                
-                # Заполняем последние 7 дней
-                for i in range(6, -1, -1):
-                    day = now - timedelta(days=i)
-                    day_key = day.strftime('%Y-%m-%d')
-                    day_name = day_names[day.weekday()]
-                    day_label = f"{day_name} {day.strftime('%d.%m')}"
-                    chart_data['labels'].append(day_label)
-                    chart_data['values'].append(days_income.get(day_key, 0))
-                    
-            else:  # all - за всё время по месяцам или по дням (последние 30 дней)
-                days_income = {}
-                
-                for rental in filtered_rentals:
-                    if rental.rental_start:
-                        day_key = rental.rental_start.strftime('%Y-%m-%d')
-                        income = float(rental.price_per_hour) * rental.hours
-                        days_income[day_key] = days_income.get(day_key, 0) + income
-                
-                # Показываем последние 30 дней
-                for i in range(29, -1, -1):
-                    day = now - timedelta(days=i)
-                    day_key = day.strftime('%Y-%m-%d')
-                    day_label = day.strftime('%d.%m')
-                    chart_data['labels'].append(day_label)
-                    chart_data['values'].append(days_income.get(day_key, 0))
+            multi_day = granularity == 'hour' and len(buckets) > 24
+            for bucket_start in buckets:
+                label = bucket_label(bucket_start, granularity, multi_day)
+                if time_filter == 'week' and granularity == 'day' and not (date_from or date_to):
+                    label = f"{DAY_NAMES[bucket_start.weekday()]} {label}"
+                chart_data['labels'].append(label)
+                chart_data['values'].append(bucket_income.get(bucket_key(bucket_start, granularity), 0))
             
             return jsonify({
                 'success': True,
@@ -1024,6 +1175,7 @@ def get_rental_stats():
                 'total_rentals': total_rentals,
                 'total_income': total_income,
                 'time_filter': time_filter,
+                'granularity': granularity,
                 'cars_stats': cars_list,
                 'chart_data': chart_data
             })
@@ -1052,7 +1204,7 @@ def edit_rental(rental_id):
             if not rental:
                 return jsonify({'success': False, 'error': 'Rental not found'}), 404
             
-            user = session.query(User).filter(User.telegram_id == user_id).first()
+            user = find_user(session, user_id)
             if not user or rental.user_id != user.id:
                 return jsonify({'success': False, 'error': 'Unauthorized'}), 403
             
@@ -1065,8 +1217,11 @@ def edit_rental(rental_id):
             rental.hours = int(data['hours'])
             
             new_income = rental.price_per_hour * rental.hours
+            rental_end = rental.rental_end
             
             session.commit()
+            payback_cache.invalidate(user.id)
+            schedule_rental(rental.id, rental_end, bind=sync_engine)
             
             logger.info(f"Rental {rental_id} updated: {old_price}×{old_hours}=${old_income} → {rental.price_per_hour}×{rental.hours}=${new_income}")
             
@@ -1097,13 +1252,14 @@ def delete_car(car_id):
             if not car:
                 return jsonify({'success': False, 'error': 'Car not found'}), 404
             
-            user = session.query(User).filter(User.telegram_id == user_id).first()
+            user = find_user(session, user_id)
             if not user or car.user_id != user.id:
                 return jsonify({'success': False, 'error': 'Unauthorized'}), 403
             
             # Обычное удаление (статистика аренды удалится вместе с машиной)
             session.delete(car)
             session.commit()
+            payback_cache.invalidate(user.id)
             
             return jsonify({'success': True, 'message': 'Машина удалена'})
         finally:
@@ -1129,7 +1285,7 @@ def delete_item(item_id):
             if not item:
                 return jsonify({'success': False, 'error': 'Item not found'}), 404
             
-            user = session.query(User).filter(User.telegram_id == user_id).first()
+            user = find_user(session, user_id)
             if not user or item.user_id != user.id:
                 return jsonify({'success': False, 'error': 'Unauthorized'}), 403
             
@@ -1148,9 +1304,85 @@ def delete_item(item_id):
 
 ADMIN_TELEGRAM_ID = 360028214  # ID администратора
 
+def _init_buy_price_totals(session):
+    """Создать строку итогов скупа из SUM по buy_prices одним INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+
+    На PostgreSQL перед этим берётся SHARE-блокировка buy_prices: она дожидается
+    начатых вставок и не пускает новые до commit, поэтому ни одна покупка не
+    проскочит между SUM и появлением строки (её UPDATE в _buy_price_inserted иначе
+    ничего бы не изменил). В SQLite запись и так одна на всю базу.
+    """
+    dialect_name = session.get_bind().dialect.name
+    if dialect_name == "postgresql":
+        session.execute(text("LOCK TABLE buy_prices IN SHARE MODE"))
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    totals = select(
+        literal(1),
+        func.count(BuyPrice.id),
+        func.coalesce(func.sum(BuyPrice.price), 0)
+    ).where(true())  # SQLite: без WHERE не разберёт ON CONFLICT после SELECT
+    session.execute(
+        insert(BuyPriceTotals).from_select(["id", "purchases_count", "total_price"], totals)
+        .on_conflict_do_nothing(index_elements=[BuyPriceTotals.id])
+    )
+    session.commit()
+
+
+def _get_buy_price_totals(session):
+    """Итоги ленты скупа (count, total) из строки-счётчика; при её отсутствии считаем и создаём"""
+    totals = session.query(BuyPriceTotals).filter(BuyPriceTotals.id == 1).first()
+    if totals is None:
+        _init_buy_price_totals(session)
+        totals = session.query(BuyPriceTotals).filter(BuyPriceTotals.id == 1).one()
+    return totals.purchases_count, float(totals.total_price)
+
+
+def _page_buy_prices(session):
+    """Страница ленты скупа по параметрам запроса (limit, cursor, since).
+
+    Лента отсортирована от новых к старым по (created_at, id).
+    cursor - продолжить после последней строки предыдущей страницы (старее),
+    since - только записи новее указанной (курсор newest_cursor из прошлого ответа).
+    """
+    limit = min(MAX_PER_PAGE, max(1, int(request.args.get('limit', 50))))
+    cursor = request.args.get('cursor')
+    since = request.args.get('since')
+    
+    query = session.query(BuyPrice)
+    if cursor:
+        created_at, last_id = _decode_cursor(cursor)
+        created_at = datetime.fromisoformat(created_at)
+        query = query.filter(or_(
+            BuyPrice.created_at < created_at,
+            and_(BuyPrice.created_at == created_at, BuyPrice.id < last_id)
+        ))
+    if since:
+        created_at, last_id = _decode_cursor(since)
+        created_at = datetime.fromisoformat(created_at)
+        query = query.filter(or_(
+            BuyPrice.created_at > created_at,
+            and_(BuyPrice.created_at == created_at, BuyPrice.id > last_id)
+        ))
+    
+    # Берём на одну строку больше, чтобы узнать, есть ли продолжение
+    rows = query.order_by(BuyPrice.created_at.desc(), BuyPrice.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    next_cursor = None
+    if has_more and rows[-1].created_at:
+        next_cursor = _encode_cursor(rows[-1].created_at.isoformat(), rows[-1].id)
+    
+    newest_cursor = since
+    if rows and rows[0].created_at:
+        newest_cursor = _encode_cursor(rows[0].created_at.isoformat(), rows[0].id)
+    
+    return rows, has_more, next_cursor, newest_cursor
+
+
 @app.route('/api/get-purchases', methods=['GET'])
 def get_purchases():
-    """Получить общую историю закупок всех пользователей"""
+    """Получить общую историю закупок всех пользователей (постранично)"""
     try:
         user_id = int(request.headers.get('X-User-ID', 0))
         
@@ -1159,16 +1391,16 @@ def get_purchases():
         
         session = SessionLocal()
         try:
-            # Получаем ВСЕ закупки всех пользователей, отсортированные по дате (новые первыми)
-            purchases = session.query(BuyPrice).order_by(BuyPrice.created_at.desc()).all()
+            total_count, total = _get_buy_price_totals(session)
             
-            total = sum(p.price for p in purchases)
+            # Страница закупок всех пользователей, отсортированных по дате (новые первыми)
+            purchases, has_more, next_cursor, newest_cursor = _page_buy_prices(session)
             
             # Проверяем, является ли текущий пользователь админом
             is_admin = (user_id == ADMIN_TELEGRAM_ID)
             
             # Получаем текущего пользователя для проверки авторства
-            current_user = session.query(User).filter(User.telegram_id == user_id).first()
+            current_user = find_user(session, user_id)
             current_user_id = current_user.id if current_user else None
             
             return jsonify({
@@ -1180,12 +1412,16 @@ def get_purchases():
                         'price': p.price,
                         'price_text': p.price_text,
                         'sale_price': p.sale_price,  # Цена продажи (null если не продано)
-                        'created_at': p.created_at.strftime('%d.%m.%Y %H:%M') if p.created_at else '',
+                        'created_at': format_datetime(p.created_at) if p.created_at else '',
                         'can_delete': is_admin or (current_user_id and p.user_id == current_user_id)
                     }
                     for p in purchases
                 ],
-                'total': total
+                'total': total,
+                'total_count': total_count,
+                'has_more': has_more,
+                'next_cursor': next_cursor,
+                'newest_cursor': newest_cursor
             })
         finally:
             session.close()
@@ -1205,7 +1441,7 @@ def delete_purchase(purchase_id):
         
         session = SessionLocal()
         try:
-            user = session.query(User).filter(User.telegram_id == user_id).first()
+            user = find_user(session, user_id)
             if not user:
                 return jsonify({'success': False, 'error': 'User not found'}), 404
             
@@ -1236,12 +1472,12 @@ def delete_purchase(purchase_id):
 
 @app.route('/api/get-buy-prices', methods=['GET'])
 def get_buy_prices():
-    """Получить ВСЕ цены скупа (общий список для всех пользователей)"""
+    """Получить цены скупа (общий список для всех пользователей, постранично)"""
     try:
         session = SessionLocal()
         try:
-            # Получаем все цены, отсортированные по дате (новые первыми)
-            prices = session.query(BuyPrice).order_by(BuyPrice.created_at.desc()).all()
+            # Страница цен, отсортированных по дате (новые первыми)
+            prices, has_more, next_cursor, newest_cursor = _page_buy_prices(session)
             
             return jsonify({
                 'success': True,
@@ -1255,7 +1491,10 @@ def get_buy_prices():
                         'created_at': price.created_at.isoformat()
                     }
                     for price in prices
-                ]
+                ],
+                'has_more': has_more,
+                'next_cursor': next_cursor,
+                'newest_cursor': newest_cursor
             })
         finally:
             session.close()
@@ -1276,14 +1515,11 @@ def add_buy_price():
         
         session = SessionLocal()
         try:
-            user = session.query(User).filter(User.telegram_id == user_id).first()
-            if not user:
-                user = User(telegram_id=user_id)
-                session.add(user)
-                session.flush()
+            user = get_or_create_user(session, user_id)
             
             # Получаем имя пользователя для отображения в списке
-            seller_name = user.username or f"Пользователь {user_id}"
+            username = session.query(User.username).filter(User.id == user.id).scalar()
+            seller_name = username or f"Пользователь {user_id}"
             
             price = BuyPrice(
                 user_id=user.id,
@@ -1319,7 +1555,7 @@ def delete_buy_price(price_id):
             if not price:
                 return jsonify({'success': False, 'error': 'Price not found'}), 404
             
-            user = session.query(User).filter(User.telegram_id == user_id).first()
+            user = find_user(session, user_id)
             if not user or price.user_id != user.id:
                 return jsonify({'success': False, 'error': 'Unauthorized'}), 403
             
@@ -1379,6 +1615,40 @@ def debug_db():
 
 # === BP ENDPOINTS ===
 
+# Каталог BP заданий меняется только при сидировании/сбросе, поэтому держим его в памяти.
+# Ключ кэша - версия каталога: сброс увеличивает версию. Сброс виден только этому
+# процессу, поэтому при разнесённых ролях кэш выключен (ProcessLocalCache).
+BP_CATALOG_TTL = 300
+_bp_catalog_version = 0
+_bp_catalog_cache = ProcessLocalCache(maxsize=1, ttl=BP_CATALOG_TTL)
+
+
+def _bump_bp_catalog_version():
+    """Сбросить закэшированный каталог BP заданий"""
+    global _bp_catalog_version
+    _bp_catalog_version += 1
+    _bp_catalog_cache.clear()
+
+
+def _get_bp_catalog(session):
+    """Получить каталог BP заданий (список dict в порядке id) из кэша или БД"""
+    version = _bp_catalog_version
+    catalog = _bp_catalog_cache.get(version)
+    if catalog is None:
+        catalog = [
+            {
+                'id': task.id,
+                'name': task.name,
+                'category': task.category,
+                'bp_without_vip': task.bp_without_vip,
+                'bp_with_vip': task.bp_with_vip
+            }
+            for task in session.query(BPTask).order_by(BPTask.id).all()
+        ]
+        _bp_catalog_cache.set(version, catalog)
+    return catalog
+
+
 @app.route('/api/get-bp-tasks', methods=['GET'])
 def get_bp_tasks():
     """Получить все BP задания с информацией о выполнении"""
@@ -1390,41 +1660,29 @@ def get_bp_tasks():
         
         session = SessionLocal()
         try:
-            user = session.query(User).filter(User.telegram_id == user_id).first()
+            user = get_or_create_user(session, user_id)
             
-            if not user:
-                user = User(telegram_id=user_id)
-                session.add(user)
-                session.flush()
-            
-            # Получаем сегодняшнюю дату (в Москве)
-            now_moscow = get_moscow_now()
-            today_start = now_moscow.replace(hour=0, minute=0, second=0, microsecond=0)
-            today_end = now_moscow.replace(hour=23, minute=59, second=59, microsecond=999999)
-            
-            # Получаем все задания, сгруппированные по категориям
-            all_tasks = session.query(BPTask).all()
-            
-            tasks_by_category = {}
-            for task in all_tasks:
-                # Проверяем выполнено ли задание сегодня
-                completion = session.query(BPCompletion).filter(
+            # Все выполненные в текущий BP-день задания одним запросом
+            completed_ids = {
+                task_id for (task_id,) in session.query(BPCompletion.task_id).filter(
                     BPCompletion.user_id == user.id,
-                    BPCompletion.task_id == task.id,
-                    BPCompletion.completed_date >= today_start,
-                    BPCompletion.completed_date <= today_end,
+                    BPCompletion.bp_day == PeriodBounds().bp_day,
                     BPCompletion.is_completed == True
-                ).first()
-                
-                if task.category not in tasks_by_category:
-                    tasks_by_category[task.category] = []
+                ).distinct()
+            }
+            
+            # Группируем задания по категориям
+            tasks_by_category = {}
+            for task in _get_bp_catalog(session):
+                if task['category'] not in tasks_by_category:
+                    tasks_by_category[task['category']] = []
                 
-                tasks_by_category[task.category].append({
-                    'id': task.id,
-                    'name': task.name,
-                    'bp_without_vip': task.bp_without_vip,
-                    'bp_with_vip': task.bp_with_vip,
-                    'is_completed': completion is not None
+                tasks_by_category[task['category']].append({
+                    'id': task['id'],
+                    'name': task['name'],
+                    'bp_without_vip': task['bp_without_vip'],
+                    'bp_with_vip': task['bp_with_vip'],
+                    'is_completed': task['id'] in completed_ids
                 })
             
             return jsonify({
@@ -1453,27 +1711,25 @@ def toggle_bp_task(task_id):
         
         session = SessionLocal()
         try:
-            user = session.query(User).filter(User.telegram_id == user_id).first()
-            if not user:
-                user = User(telegram_id=user_id)
-                session.add(user)
-                session.flush()
+            user = get_or_create_user(session, user_id)
             
             task = session.query(BPTask).filter(BPTask.id == task_id).first()
             if not task:
                 return jsonify({'success': False, 'error': 'Task not found'}), 404
             
-            # Получаем сегодняшнюю дату (в Москве)
-            now_moscow = get_moscow_now()
-            today_start = now_moscow.replace(hour=0, minute=0, second=0, microsecond=0)
+            # Текущий BP-день; completed_date - его начало
+            bounds = PeriodBounds()
             
             # Ищем существующее выполнение
             completion = session.query(BPCompletion).filter(
                 BPCompletion.user_id == user.id,
                 BPCompletion.task_id == task_id,
-                BPCompletion.completed_date >= today_start
+                BPCompletion.bp_day == bounds.bp_day
             ).first()
             
+            # Изменение счётчика BP за всё время
+            bp_delta = 0
+            
             if is_completed:
                 # Отмечаем как выполненное
                 if not completion:
@@ -1481,30 +1737,40 @@ def toggle_bp_task(task_id):
                     completion = BPCompletion(
                         user_id=user.id,
                         task_id=task_id,
-                        completed_date=today_start,
+                        completed_date=bounds.start('bp_day'),
+                        bp_day=bounds.bp_day,
                         is_completed=True,
                         bp_earned=bp_earned
                     )
                     session.add(completion)
+                    bp_delta = bp_earned
                     logger.info(f"BP task {task_id} marked as completed for user {user_id} (+{bp_earned} BP)")
                 else:
+                    if not completion.is_completed:
+                        bp_delta = completion.bp_earned
                     completion.is_completed = True
             else:
                 # Убираем галочку
                 if completion:
+                    if completion.is_completed:
+                        bp_delta = -completion.bp_earned
                     completion.is_completed = False
                     logger.info(f"BP task {task_id} marked as uncompleted for user {user_id}")
             
-            session.commit()
+            if bp_delta and BP_TOTAL_COUNTER:
+                # Атомарный инкремент в той же транзакции; NULL-счётчик не трогаем - его досчитает get-bp-stats
+                session.query(User).filter(
+                    User.id == user.id,
+                    User.bp_total_earned != None
+                ).update({User.bp_total_earned: User.bp_total_earned + bp_delta}, synchronize_session=False)
             
-            # Считаем сегодняшний BP
-            today_bp = session.query(BPCompletion).filter(
-                BPCompletion.user_id == user.id,
-                BPCompletion.completed_date >= today_start,
-                BPCompletion.is_completed == True
-            ).all()
+            session.commit()
             
-            total_bp_today = sum(c.bp_earned for c in today_bp)
+            # Сегодняшний BP - из дневных итогов (обновлены в этой же транзакции)
+            total_bp_today = session.query(DailyUserStats.bp_earned).filter(
+                DailyUserStats.user_id == user.id,
+                DailyUserStats.day == bp_day_date(bounds.bp_day)
+            ).scalar() or 0
             
             return jsonify({
                 'success': True,
@@ -1539,38 +1805,43 @@ def get_bp_stats():
                     'bp_total': 0
                 })
             
-            now_moscow = get_moscow_now()
-            
-            # За сегодня (с 07:00)
-            today_07 = now_moscow.replace(hour=7, minute=0, second=0, microsecond=0)
-            if now_moscow.hour < 7:
-                today_07 -= timedelta(days=1)
-            
-            # За неделю
-            week_start = now_moscow - timedelta(days=7)
-            
-            bp_today = session.query(BPCompletion).filter(
-                BPCompletion.user_id == user.id,
-                BPCompletion.completed_at >= today_07,
-                BPCompletion.is_completed == True
-            ).all()
-            
-            bp_week = session.query(BPCompletion).filter(
-                BPCompletion.user_id == user.id,
-                BPCompletion.completed_at >= week_start,
-                BPCompletion.is_completed == True
-            ).all()
-            
-            bp_total = session.query(BPCompletion).filter(
-                BPCompletion.user_id == user.id,
-                BPCompletion.is_completed == True
-            ).all()
+            # BP-дни: сегодня и последние 7 (тот же день, что у get-bp-tasks/toggle-bp-task)
+            today = PeriodBounds().bp_day
+            week_first_day = today - 6
+            
+            # Все периоды одним запросом по bp_day_bits (одна строка на BP-день,
+            # история сохраняется и после очистки старых bp_completions)
+            filters = [BPDayBits.user_id == user.id]
+            use_counter = BP_TOTAL_COUNTER and user.bp_total_earned is not None
+            if use_counter:
+                # Всё время берём из счётчика, поэтому читаем только последнюю неделю
+                filters.append(BPDayBits.bp_day >= week_first_day)
+            
+            bp_today, bp_week, bp_total = session.query(
+                func.coalesce(func.sum(case((BPDayBits.bp_day == today, BPDayBits.bp_earned), else_=0)), 0),
+                func.coalesce(func.sum(case((BPDayBits.bp_day >= week_first_day, BPDayBits.bp_earned), else_=0)), 0),
+                func.coalesce(func.sum(BPDayBits.bp_earned), 0)
+            ).filter(*filters).one()
+            
+            if use_counter:
+                bp_total = user.bp_total_earned
+            elif BP_TOTAL_COUNTER:
+                # Первый запрос после миграции - заполняем счётчик суммой из БД
+                # (подзапрос в самом UPDATE, чтобы не потерять параллельный toggle)
+                total_subquery = session.query(
+                    func.coalesce(func.sum(BPDayBits.bp_earned), 0)
+                ).filter(*filters).scalar_subquery()
+                session.query(User).filter(
+                    User.id == user.id,
+                    User.bp_total_earned == None
+                ).update({User.bp_total_earned: total_subquery}, synchronize_session=False)
+                session.commit()
             
             return jsonify({
                 'success': True,
-                'bp_today': sum(c.bp_earned for c in bp_today),
-                'bp_week': sum(c.bp_earned for c in bp_week),
-                'bp_total': sum(c.bp_earned for c in bp_total)
+                'bp_today': int(bp_today),
+                'bp_week': int(bp_week),
+                'bp_total': int(bp_total)
             })
         finally:
             session.close()
@@ -1579,6 +1850,49 @@ def get_bp_stats():
         return jsonify({'success': False, 'error': str(e)}), 400
 
 
+# Максимальная глубина истории BP для /api/get-bp-history (BP-дней)
+MAX_BP_HISTORY_DAYS = 3660
+
+
+@app.route('/api/get-bp-history', methods=['GET'])
+def get_bp_history():
+    """История BP: серии дней подряд, доля выполнения по заданиям и тепловая карта"""
+    try:
+        user_id = int(request.headers.get('X-User-ID', 0))
+        days = min(max(int(request.args.get('days', 365)), 1), MAX_BP_HISTORY_DAYS)
+        
+        if not user_id:
+            return jsonify({'success': False, 'error': 'User ID not provided'}), 400
+        
+        session = SessionLocal()
+        try:
+            today = PeriodBounds().bp_day
+            first_day = today - days + 1
+            
+            user = find_user(session, user_id)
+            rows = []
+            if user:
+                rows = session.query(
+                    BPDayBits.bp_day, BPDayBits.bits, BPDayBits.bp_earned
+                ).filter(
+                    BPDayBits.user_id == user.id,
+                    BPDayBits.bp_day >= first_day,
+                    BPDayBits.bp_day <= today
+                ).order_by(BPDayBits.bp_day).all()
+            
+            tasks = session.query(BPTask.id, BPTask.name, BPTask.bit).filter(
+                BPTask.bit != None
+            ).order_by(BPTask.id).all()
+            
+            history = summarize_bp_history(rows, tasks, first_day, today)
+            return jsonify({'success': True, **history})
+        finally:
+            session.close()
+    except Exception as e:
+        logger.error(f"Error getting BP history: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
 @app.route('/api/toggle-platinum-vip', methods=['POST'])
 def toggle_platinum_vip():
     """Включить/выключить платинум VIP"""
@@ -1593,19 +1907,19 @@ def toggle_platinum_vip():
         
         session = SessionLocal()
         try:
-            user = session.query(User).filter(User.telegram_id == user_id).first()
-            if not user:
-                user = User(telegram_id=user_id, has_platinum_vip=has_vip)
-                session.add(user)
-            else:
-                user.has_platinum_vip = has_vip
+            # Создание - через upsert: два одновременных запроса не создадут дубликат
+            user = get_or_create_user(session, user_id)
+            session.query(User).filter(User.id == user.id).update(
+                {User.has_platinum_vip: bool(has_vip)}, synchronize_session=False
+            )
             
             session.commit()
+            forget_user(user_id)
             logger.info(f"User {user_id} platinum VIP set to {has_vip}")
             
             return jsonify({
                 'success': True,
-                'has_platinum_vip': user.has_platinum_vip
+                'has_platinum_vip': bool(has_vip)
             })
         finally:
             session.close()
@@ -1628,12 +1942,16 @@ def admin_reset_bp_tasks():
             # Сначала удаляем все записи о выполнении (bp_completions)
             # Это нужно чтобы не было Foreign Key constraint violation
             deleted_completions = session.query(BPCompletion).delete()
+            session.query(User).update({User.bp_total_earned: 0}, synchronize_session=False)
+            session.query(DailyUserStats).update({DailyUserStats.bp_earned: 0}, synchronize_session=False)
+            session.query(BPDayBits).delete()
             session.commit()
             logger.info(f"Deleted {deleted_completions} completion records")
             
             # Теперь удаляем все старые задания
             deleted = session.query(BPTask).delete()
             session.commit()
+            _bump_bp_catalog_version()
             logger.info(f"Deleted {deleted} old BP tasks")
             
             # Добавляем новые задания
@@ -1707,6 +2025,7 @@ def admin_reset_bp_tasks():
                 session.add(task)
             
             session.commit()
+            _bump_bp_catalog_version()
             logger.info(f"✅ BP tasks reset successfully! Added {len(bp_tasks_data)} tasks")
             
             return jsonify({
@@ -1723,9 +2042,209 @@ def admin_reset_bp_tasks():
 
 # === УВЕДОМЛЕНИЯ ТАЙМЕРОВ ===
 
+# === ТАЙМЕРЫ ===
+
+# Максимальная длительность таймера, сек
+MAX_TIMER_DURATION = 7 * 24 * 3600
+
+
+def _timer_to_dict(timer, now):
+    """Таймер для клиента: клиент считает обратный отсчёт сам от remaining_seconds"""
+    if timer.is_paused:
+        remaining = timer.remaining or 0
+    else:
+        remaining = max(0.0, (timer.end_time - now).total_seconds())
+    return {
+        'id': timer.id,
+        'name': timer.name,
+        'duration': timer.duration,
+        'is_paused': timer.is_paused,
+        'end_time': timer.end_time.isoformat() if timer.end_time else None,
+        'remaining_seconds': remaining
+    }
+
+
+def _get_user_timer(session, user_id, timer_id):
+    """Таймер пользователя или (None, ответ с ошибкой)"""
+    timer = session.query(Timer).filter(Timer.id == timer_id).first()
+    if not timer:
+        return None, (jsonify({'success': False, 'error': 'Timer not found'}), 404)
+    
+    user = find_user(session, user_id)
+    if not user or timer.user_id != user.id:
+        return None, (jsonify({'success': False, 'error': 'Unauthorized'}), 403)
+    return timer, None
+
+
+@app.route('/api/get-timers', methods=['GET'])
+def get_timers():
+    """Получить таймеры пользователя"""
+    try:
+        user_id = int(request.headers.get('X-User-ID', 0))
+        
+        if not user_id:
+            return jsonify({'success': False, 'error': 'User ID not provided'}), 400
+        
+        session = SessionLocal()
+        try:
+            user = find_user(session, user_id)
+            if not user:
+                return jsonify({'success': True, 'timers': []})
+            
+            timers = session.query(Timer).filter(Timer.user_id == user.id).order_by(Timer.id).all()
+            now = utc_now()
+            
+            return jsonify({'success': True, 'timers': [_timer_to_dict(t, now) for t in timers]})
+        finally:
+            session.close()
+    except Exception as e:
+        logger.error(f"Error getting timers: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
+@app.route('/api/create-timer', methods=['POST'])
+def create_timer():
+    """Запустить таймер (уведомление в Telegram отправит бот)"""
+    try:
+        user_id = int(request.headers.get('X-User-ID', 0))
+        
+        if not user_id:
+            return jsonify({'success': False, 'error': 'User ID not provided'}), 400
+        
+        data = request.json
+        name = (data.get('name') or '').strip()
+        duration = int(data.get('duration', 0))
+        
+        if not name:
+            return jsonify({'success': False, 'error': 'Введите название таймера'}), 400
+        if duration <= 0 or duration > MAX_TIMER_DURATION:
+            return jsonify({'success': False, 'error': 'Некорректная длительность таймера'}), 400
+        
+        session = SessionLocal()
+        try:
+            user = get_or_create_user(session, user_id)
+            
+            exists = session.query(Timer.id).filter(
+                Timer.user_id == user.id,
+                Timer.name == name
+            ).first()
+            if exists:
+                return jsonify({'success': False, 'error': f'Таймер "{name}" уже запущен'}), 400
+            
+            now = utc_now()
+            timer = Timer(
+                user_id=user.id,
+                name=name[:255],
+                duration=duration,
+                end_time=now + timedelta(seconds=duration),
+                is_paused=False
+            )
+            session.add(timer)
+            session.commit()
+            schedule_timer(timer.id, timer.end_time, bind=sync_engine)
+            
+            logger.info(f"Timer {timer.id} '{name}' started for user {user_id}: {duration}s")
+            return jsonify({'success': True, 'timer': _timer_to_dict(timer, now)})
+        finally:
+            session.close()
+    except Exception as e:
+        logger.error(f"Error creating timer: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
+@app.route('/api/pause-timer/<int:timer_id>', methods=['POST'])
+def pause_timer(timer_id):
+    """Поставить таймер на паузу"""
+    try:
+        user_id = int(request.headers.get('X-User-ID', 0))
+        
+        if not user_id:
+            return jsonify({'success': False, 'error': 'User ID not provided'}), 400
+        
+        session = SessionLocal()
+        try:
+            timer, error = _get_user_timer(session, user_id, timer_id)
+            if error:
+                return error
+            
+            now = utc_now()
+            if not timer.is_paused:
+                timer.remaining = max(0.0, (timer.end_time - now).total_seconds())
+                timer.end_time = None
+                timer.is_paused = True
+                session.commit()
+                unschedule_timer(timer.id)
+            
+            return jsonify({'success': True, 'timer': _timer_to_dict(timer, now)})
+        finally:
+            session.close()
+    except Exception as e:
+        logger.error(f"Error pausing timer: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
+@app.route('/api/resume-timer/<int:timer_id>', methods=['POST'])
+def resume_timer(timer_id):
+    """Продолжить таймер после паузы"""
+    try:
+        user_id = int(request.headers.get('X-User-ID', 0))
+        
+        if not user_id:
+            return jsonify({'success': False, 'error': 'User ID not provided'}), 400
+        
+        session = SessionLocal()
+        try:
+            timer, error = _get_user_timer(session, user_id, timer_id)
+            if error:
+                return error
+            
+            now = utc_now()
+            if timer.is_paused:
+                timer.end_time = now + timedelta(seconds=timer.remaining or 0)
+                timer.remaining = None
+                timer.is_paused = False
+                session.commit()
+                schedule_timer(timer.id, timer.end_time, bind=sync_engine)
+            
+            return jsonify({'success': True, 'timer': _timer_to_dict(timer, now)})
+        finally:
+            session.close()
+    except Exception as e:
+        logger.error(f"Error resuming timer: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
+@app.route('/api/cancel-timer/<int:timer_id>', methods=['DELETE'])
+def cancel_timer(timer_id):
+    """Остановить таймер без уведомления"""
+    try:
+        user_id = int(request.headers.get('X-User-ID', 0))
+        
+        if not user_id:
+            return jsonify({'success': False, 'error': 'User ID not provided'}), 400
+        
+        session = SessionLocal()
+        try:
+            timer, error = _get_user_timer(session, user_id, timer_id)
+            if error:
+                return error
+            
+            session.delete(timer)
+            session.commit()
+            unschedule_timer(timer_id)
+            
+            return jsonify({'success': True})
+        finally:
+            session.close()
+    except Exception as e:
+        logger.error(f"Error cancelling timer: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
 @app.route('/api/send-timer-notification', methods=['POST'])
 def send_timer_notification():
-    """Отправить уведомление в Telegram о завершении таймера"""
+    """Отправить уведомление в Telegram о завершении таймера (для старых клиентов,
+    таймеры из /api/create-timer уведомляет планировщик бота)"""
     try:
         user_id = int(request.headers.get('X-User-ID', 0))
         data = request.json
@@ -1734,30 +2253,19 @@ def send_timer_notification():
         if not user_id:
             return jsonify({'success': False, 'error': 'User ID not provided'}), 400
         
-        # Получаем токен бота
-        bot_token = os.getenv('BOT_TOKEN')
-        if not bot_token:
-            logger.warning("BOT_TOKEN not set, cannot send timer notification")
-            return jsonify({'success': False, 'error': 'Bot token not configured'}), 500
-        
-        # Отправляем сообщение через Telegram API
-        import requests
-        
         message = f"⏰ Таймер \"{timer_name}\" завершён!"
         
-        telegram_url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-        response = requests.post(telegram_url, json={
-            'chat_id': user_id,
-            'text': message,
-            'parse_mode': 'HTML'
-        }, timeout=10)
+        # Ставим сообщение в outbox - отправит фоновая задача бота, запрос не ждёт Telegram
+        session = SessionLocal()
+        try:
+            enqueue_message(session, user_id, message)
+            session.commit()
+        finally:
+            session.close()
+        outbox_sender.wake()
         
-        if response.status_code == 200:
-            logger.info(f"Timer notification sent to user {user_id}: {timer_name}")
-            return jsonify({'success': True})
-        else:
-            logger.error(f"Failed to send timer notification: {response.text}")
-            return jsonify({'success': False, 'error': 'Failed to send message'}), 500
+        logger.info(f"Timer notification queued for user {user_id}: {timer_name}")
+        return jsonify({'success': True})
             
     except Exception as e:
         logger.error(f"Error sending timer notification: {e}", exc_info=True)
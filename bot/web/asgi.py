@@ -0,0 +1,273 @@
+"""
+ASGI-сервер API в event loop бота (WEB_SERVER=asgi).
+
+Маршруты и JSON остаются в Flask-приложении bot.web.app, но оно вызывается не в
+потоке, а внутри greenlet (greenlet_spawn SQLAlchemy - то же, на чём работает
+AsyncSession.run_sync). Синхронные сессии представлений привязаны к
+db.engine.sync_engine - фасаду async-движка бота, поэтому каждый запрос к БД
+уходит через asyncpg и общий пул, а пока он ждёт ответа, loop обслуживает другие
+запросы Mini App и апдейты Telegram.
+
+Запуск из бота: await serve_api(port) после db.init(); отдельным процессом:
+uvicorn bot.web.asgi:app (БД инициализируется в lifespan). В режиме
+BOT_UPDATES=webhook бот подключает сюда же приём апдейтов (mount_webhook).
+"""
+import asyncio
+import contextlib
+import hmac
+import importlib
+import io
+import json
+import logging
+import sys
+
+import uvicorn
+from sqlalchemy.util import greenlet_spawn
+
+from bot import config
+from bot.models.init_db import db
+
+logger = logging.getLogger(__name__)
+
+# Максимальный размер тела запроса к API (Mini App шлёт небольшие JSON)
+MAX_BODY_SIZE = 1024 * 1024
+
+_flask_app = None
+# False - сервер только для webhook (роль bot), Flask-приложение не загружается
+_api_enabled = True
+
+
+async def load_app():
+    """Импортировать bot.web.app внутри greenlet.
+
+    При импорте Flask-приложение создаёт таблицы, докатывает колонки и сидирует
+    BP задания через sync_engine - в режиме asgi это фасад db.engine, которому
+    нужен greenlet. Вызывать после db.init().
+    """
+    global _flask_app
+    if _flask_app is None:
+        module = await greenlet_spawn(importlib.import_module, "bot.web.app")
+        _flask_app = module.app
+    return _flask_app
+
+
+def _build_environ(scope, body: bytes) -> dict:
+    """WSGI environ (PEP 3333) из ASGI scope"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": False,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope["headers"]:
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        value = raw_value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            key = "CONTENT_TYPE"
+        elif name == "CONTENT_LENGTH":
+            key = "CONTENT_LENGTH"
+        else:
+            key = f"HTTP_{name}"
+        if key in environ:
+            value = f"{environ[key]},{value}"
+        environ[key] = value
+    return environ
+
+
+def _call_wsgi(app, environ):
+    """Вызвать WSGI-приложение целиком (выполняется в greenlet): (status, headers, body)"""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = headers
+
+    chunks = app(environ, start_response)
+    try:
+        body = b"".join(chunks)
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+    return response["status"], response["headers"], body
+
+
+async def _read_body(receive) -> bytes:
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ConnectionResetError("Client disconnected")
+        body.extend(message.get("body", b""))
+        if len(body) > MAX_BODY_SIZE:
+            raise ValueError("Request body is too large")
+        if not message.get("more_body"):
+            return bytes(body)
+
+
+async def _send_response(send, status: int, headers, body: bytes):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class TelegramWebhook:
+    """Приём апдейтов Telegram на секретном пути: апдейт передаётся в Dispatcher фоновой задачей.
+
+    Telegram получает 200 сразу, не дожидаясь обработчиков (как у polling, где
+    апдейты тоже обрабатываются задачами). Запрос без верного заголовка
+    X-Telegram-Bot-Api-Secret-Token отклоняется.
+    """
+
+    def __init__(self, path: str, secret: str, bot, dispatcher):
+        self.path = path
+        self.secret = secret
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.closing = False
+        self._tasks = set()
+
+    async def handle(self, scope, body: bytes):
+        """(status, body) ответа на запрос к пути webhook"""
+        if scope["method"] != "POST":
+            return 405, b""
+        if self.closing:
+            # Telegram повторит доставку - апдейт заберёт следующий процесс
+            return 503, b""
+        token = dict(scope["headers"]).get(b"x-telegram-bot-api-secret-token", b"")
+        if not hmac.compare_digest(token, self.secret.encode()):
+            return 401, b""
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return 400, b""
+
+        task = asyncio.create_task(self._feed(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return 200, b"{}"
+
+    async def _feed(self, update: dict):
+        try:
+            await self.dispatcher.feed_raw_update(
+                self.bot, update, dispatcher=self.dispatcher, bots=[self.bot]
+            )
+        except Exception as e:
+            logger.error(f"Error handling webhook update {update.get('update_id')}: {e}", exc_info=True)
+
+    async def close(self, timeout: float = 10):
+        """Перестать принимать апдейты и дождаться уже принятых (не дольше timeout)"""
+        self.closing = True
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+
+_webhook = None
+
+
+def mount_webhook(path: str, secret: str, bot, dispatcher) -> TelegramWebhook:
+    """Принимать апдейты Telegram на path этого сервера"""
+    global _webhook
+    _webhook = TelegramWebhook(path, secret, bot, dispatcher)
+    return _webhook
+
+
+async def app(scope, receive, send):
+    """ASGI-приложение: HTTP-запросы передаются во Flask внутри greenlet"""
+    if scope["type"] == "lifespan":
+        # Только для отдельного процесса uvicorn: в bot.main lifespan выключен, БД уже готова
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                if db.engine is None:
+                    # Отдельный процесс uvicorn - это роль web: бот работает в другом процессе
+                    if config.PROCESS_ROLE == "all":
+                        config.set_process_role("web")
+                    await db.init()
+                await load_app()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await db.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    try:
+        body = await _read_body(receive)
+    except ConnectionResetError:
+        return
+    except ValueError as e:
+        await _send_response(send, 413, [("Content-Type", "text/plain")], str(e).encode())
+        return
+
+    if _webhook is not None and scope["path"] == _webhook.path:
+        status, body = await _webhook.handle(scope, body)
+        await _send_response(send, status, [("Content-Type", "application/json")], body)
+        return
+
+    if not _api_enabled:
+        body = json.dumps({'error': 'Not Found', 'path': scope["path"]}).encode()
+        await _send_response(send, 404, [("Content-Type", "application/json")], body)
+        return
+
+    flask_app = await load_app()
+    status, headers, body = await greenlet_spawn(_call_wsgi, flask_app, _build_environ(scope, body))
+    await _send_response(send, status, headers, body)
+
+
+class _EmbeddedServer(uvicorn.Server):
+    """uvicorn.Server без своих обработчиков сигналов - сигналы обрабатывает aiogram"""
+
+    def capture_signals(self):
+        return contextlib.nullcontext()
+
+
+async def serve_api(port: int, cert_file: str = None, key_file: str = None, api: bool = True):
+    """Обслуживать API на 0.0.0.0:port в текущем event loop до отмены задачи.
+
+    api=False - только webhook Telegram (mount_webhook), без Flask-приложения.
+    При отмене сервер перестаёт принимать соединения и дожидается текущих запросов.
+    """
+    global _api_enabled
+    _api_enabled = api
+    if api:
+        await load_app()
+    server_config = uvicorn.Config(
+        app,
+        host="0.0.0.0",
+        port=port,
+        lifespan="off",
+        access_log=False,
+        log_config=None,
+        proxy_headers=True,
+        forwarded_allow_ips="*",
+        ssl_certfile=cert_file,
+        ssl_keyfile=key_file,
+        timeout_graceful_shutdown=10,
+    )
+    server = _EmbeddedServer(server_config)
+    logger.info(f"🚀 ASGI API listening on 0.0.0.0:{port} (SSL: {'Enabled' if cert_file else 'Disabled'})")
+    serving = asyncio.ensure_future(server.serve())
+    try:
+        await asyncio.shield(serving)
+    except asyncio.CancelledError:
+        server.should_exit = True
+        await serving
+        raise
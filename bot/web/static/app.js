@@ -137,6 +137,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // Загрузка данных
     loadItems();
     loadCars();
+    loadTimers();
 });
 
 // Переключение вкладок
@@ -169,6 +170,8 @@ function switchTab(tabName) {
     } else if (tabName === 'bp-farm') {
         loadBPTasks();
         loadBPStats();
+    } else if (tabName === 'timers') {
+        loadTimers();
     }
 }
 
@@ -692,6 +695,34 @@ function hidePurchases() {
     document.getElementById('purchasesView').classList.add('hidden');
 }
 
+// Курсор следующей страницы скупа (null - больше нет)
+let purchasesNextCursor = null;
+
+function renderPurchaseCard(p) {
+    const profit = p.sale_price ? (p.sale_price - p.price) : null;
+    const profitClass = profit !== null ? (profit >= 0 ? 'positive' : 'negative') : '';
+    
+    return `
+    <div class="item-card">
+        <div class="item-header">
+            <h4><i class="fas fa-box"></i> ${p.item_name}</h4>
+            ${p.can_delete ? `<button class="delete-btn" onclick="deletePurchase(${p.id})" title="Удалить"><i class="fas fa-xmark"></i></button>` : ''}
+        </div>
+        <p class="item-price"><i class="fas fa-coins"></i> Куплено: ${formatPrice(p.price)}$</p>
+        ${p.sale_price ? `
+            <p class="item-price" style="color: var(--success-color);"><i class="fas fa-receipt"></i> Продано: ${formatPrice(p.sale_price)}$</p>
+            <p class="profit ${profitClass}" style="font-weight: 600;"><i class="fas fa-chart-line"></i> Прибыль: ${profit >= 0 ? '+' : ''}${formatPrice(profit)}$</p>
+        ` : `<p class="item-price" style="color: var(--text-secondary);"><i class="fas fa-hourglass-half"></i> Не продано</p>`}
+        <p class="small" style="color: var(--text-secondary); margin-top: 4px;"><i class="fas fa-calendar"></i> ${p.created_at}</p>
+    </div>
+`;
+}
+
+function renderPurchasesMoreButton() {
+    if (!purchasesNextCursor) return '';
+    return `<button id="purchasesMoreBtn" class="btn btn-small" onclick="loadMorePurchases()" style="width: 100%; margin-top: 10px;"><i class="fas fa-chevron-down"></i> Загрузить ещё</button>`;
+}
+
 async function loadPurchases() {
     const purchasesList = document.getElementById('purchasesList');
     purchasesList.innerHTML = '<p class="loading">Загрузка...</p>';
@@ -704,37 +735,24 @@ async function loadPurchases() {
         const data = await response.json();
         
         if (data.success && data.purchases.length > 0) {
+            purchasesNextCursor = data.next_cursor;
+            
             let html = `
                 <div class="stats-summary" style="background: var(--bg-tertiary); padding: 12px; border-radius: 8px; margin-bottom: 15px;">
                     <p style="margin: 0; font-size: 14px;">
-                        <i class="fas fa-shopping-cart"></i> Всего закупок: <strong>${data.purchases.length}</strong>
+                        <i class="fas fa-shopping-cart"></i> Всего закупок: <strong>${data.total_count}</strong>
                         &nbsp;|&nbsp;
                         <i class="fas fa-coins"></i> На сумму: <strong>${formatPrice(data.total)}$</strong>
                     </p>
                 </div>
             `;
             
-            html += data.purchases.map(p => {
-                const profit = p.sale_price ? (p.sale_price - p.price) : null;
-                const profitClass = profit !== null ? (profit >= 0 ? 'positive' : 'negative') : '';
-                
-                return `
-                <div class="item-card">
-                    <div class="item-header">
-                        <h4><i class="fas fa-box"></i> ${p.item_name}</h4>
-                        ${p.can_delete ? `<button class="delete-btn" onclick="deletePurchase(${p.id})" title="Удалить"><i class="fas fa-xmark"></i></button>` : ''}
-                    </div>
-                    <p class="item-price"><i class="fas fa-coins"></i> Куплено: ${formatPrice(p.price)}$</p>
-                    ${p.sale_price ? `
-                        <p class="item-price" style="color: var(--success-color);"><i class="fas fa-receipt"></i> Продано: ${formatPrice(p.sale_price)}$</p>
-                        <p class="profit ${profitClass}" style="font-weight: 600;"><i class="fas fa-chart-line"></i> Прибыль: ${profit >= 0 ? '+' : ''}${formatPrice(profit)}$</p>
-                    ` : `<p class="item-price" style="color: var(--text-secondary);"><i class="fas fa-hourglass-half"></i> Не продано</p>`}
-                    <p class="small" style="color: var(--text-secondary); margin-top: 4px;"><i class="fas fa-calendar"></i> ${p.created_at}</p>
-                </div>
-            `}).join('');
+            html += data.purchases.map(renderPurchaseCard).join('');
+            html += renderPurchasesMoreButton();
             
             purchasesList.innerHTML = html;
         } else {
+            purchasesNextCursor = null;
             purchasesList.innerHTML = '<p class="empty"><i class="fas fa-shopping-cart"></i> Закупок пока нет. Добавьте товар в инвентарь — он автоматически появится здесь.</p>';
         }
     } catch (error) {
@@ -743,6 +761,34 @@ async function loadPurchases() {
     }
 }
 
+async function loadMorePurchases() {
+    if (!purchasesNextCursor) return;
+    
+    const purchasesList = document.getElementById('purchasesList');
+    const moreBtn = document.getElementById('purchasesMoreBtn');
+    if (moreBtn) moreBtn.disabled = true;
+    
+    try {
+        const response = await fetch(`/api/get-purchases?cursor=${encodeURIComponent(purchasesNextCursor)}`, {
+            headers: {'X-User-ID': userId}
+        });
+        
+        const data = await response.json();
+        
+        if (data.success) {
+            purchasesNextCursor = data.next_cursor;
+            if (moreBtn) moreBtn.remove();
+            purchasesList.insertAdjacentHTML('beforeend', data.purchases.map(renderPurchaseCard).join('') + renderPurchasesMoreButton());
+            searchPurchases();
+        } else if (moreBtn) {
+            moreBtn.disabled = false;
+        }
+    } catch (error) {
+        console.error('Error loading more purchases:', error);
+        if (moreBtn) moreBtn.disabled = false;
+    }
+}
+
 async function deletePurchase(purchaseId) {
     if (!confirm('Удалить эту запись из скупа?')) return;
     
@@ -1381,47 +1427,108 @@ function togglePlatinumVip() {
 
 // ========== ТАЙМЕРЫ ==========
 
-// Объект для хранения активных таймеров
+// Объект для хранения активных таймеров (по названию).
+// Таймеры хранятся на сервере, клиент только отрисовывает остаток времени
 let activeTimers = {};
 
+// Один общий интервал отрисовки на все таймеры
+let timersTicker = null;
+
+// Преобразовать таймер из API в локальное состояние
+function applyServerTimer(timer) {
+    const timerData = {
+        id: timer.id,
+        name: timer.name,
+        duration: timer.duration,
+        remaining: timer.remaining_seconds * 1000,
+        // Считаем от remaining_seconds, а не от end_time - так не важна разница часов клиента и сервера
+        endTime: Date.now() + timer.remaining_seconds * 1000,
+        paused: timer.is_paused
+    };
+    activeTimers[timer.name] = timerData;
+    return timerData;
+}
+
+// Загрузить таймеры с сервера
+async function loadTimers() {
+    try {
+        const response = await fetch('/api/get-timers', {
+            headers: {'X-User-ID': userId}
+        });
+        const data = await response.json();
+        if (!data.success) return;
+        
+        // Убираем с экрана таймеры, которых больше нет
+        const serverNames = new Set(data.timers.map(t => t.name));
+        Object.keys(activeTimers).forEach(name => {
+            if (!serverNames.has(name)) {
+                removeTimerElement(name);
+            }
+        });
+        
+        data.timers.forEach(timer => {
+            applyServerTimer(timer);
+            setTimerButtonActive(timer.name, true);
+            renderActiveTimer(timer.name);
+            updatePauseButton(timer.name);
+            updateTimerDisplay(timer.name);
+        });
+        
+        updateTimersContainer();
+        startTimersTicker();
+    } catch (error) {
+        console.error('Error loading timers:', error);
+    }
+}
+
 // Функция запуска таймера
-function startTimer(timerName, duration) {
+async function startTimer(timerName, duration) {
     // Если таймер уже запущен, не запускаем еще один
     if (activeTimers[timerName]) {
         showNotification(`⏱️ Таймер "${timerName}" уже запущен!`, 'warning');
         return;
     }
     
-    const timerData = {
-        name: timerName,
-        duration: duration,
-        remaining: duration,
-        startTime: Date.now(),
-        endTime: Date.now() + (duration * 1000),
-        interval: null,
-        paused: false
-    };
-    
-    activeTimers[timerName] = timerData;
+    try {
+        const response = await fetch('/api/create-timer', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-User-ID': userId
+            },
+            body: JSON.stringify({
+                name: timerName,
+                duration: duration
+            })
+        });
+        const data = await response.json();
+        
+        if (!data.success) {
+            showNotification(`❌ ${data.error}`, 'danger');
+            return;
+        }
+        
+        applyServerTimer(data.timer);
+    } catch (error) {
+        showNotification('❌ Ошибка при запуске таймера', 'danger');
+        return;
+    }
     
     // Показываем контейнер активных таймеров
-    document.getElementById('activeTimersContainer').classList.remove('hidden');
+    updateTimersContainer();
     
     // Отмечаем кнопку как активную
-    document.querySelectorAll('.timer-btn').forEach(btn => {
-        if (btn.dataset.timerName === timerName) {
-            btn.classList.add('active');
-        }
-    });
+    setTimerButtonActive(timerName, true);
     
     // Показываем уведомление
     showNotification(`⏱️ Запущен таймер "${timerName}"`, 'success');
     
     // Отрисовываем таймер
     renderActiveTimer(timerName);
+    updateTimerDisplay(timerName);
     
     // Начинаем обратный отсчет
-    startTimerCountdown(timerName);
+    startTimersTicker();
 }
 
 // Функция для отрисовки активного таймера
@@ -1457,30 +1564,84 @@ function renderActiveTimer(timerName) {
     }
 }
 
-// Функция для обратного отсчета
-function startTimerCountdown(timerName) {
-    const timerData = activeTimers[timerName];
+// Функция для обратного отсчета: один интервал раз в секунду на все идущие таймеры
+function startTimersTicker() {
+    if (timersTicker) return;
     
-    // Если интервал уже существует, очищаем его
-    if (timerData.interval) {
-        clearInterval(timerData.interval);
-    }
-    
-    // Обновляем дисплей каждые 100ms для плавности
-    timerData.interval = setInterval(() => {
+    timersTicker = setInterval(() => {
         const now = Date.now();
-        const remaining = timerData.endTime - now;
+        let running = 0;
         
-        if (remaining <= 0) {
-            // Таймер завершён
-            clearInterval(timerData.interval);
-            completeTimer(timerName);
-        } else {
-            // Обновляем оставшееся время
-            timerData.remaining = remaining;
-            updateTimerDisplay(timerName);
+        Object.keys(activeTimers).forEach(timerName => {
+            const timerData = activeTimers[timerName];
+            if (timerData.paused) return;
+            
+            const remaining = timerData.endTime - now;
+            if (remaining <= 0) {
+                // Таймер завершён (сообщение в Telegram отправит бот)
+                completeTimer(timerName);
+            } else {
+                running++;
+                timerData.remaining = remaining;
+                updateTimerDisplay(timerName);
+            }
+        });
+        
+        if (running === 0) {
+            stopTimersTicker();
         }
-    }, 100);
+    }, 1000);
+}
+
+function stopTimersTicker() {
+    if (timersTicker) {
+        clearInterval(timersTicker);
+        timersTicker = null;
+    }
+}
+
+// После возврата в Mini App сверяем таймеры с сервером (могли завершиться, пока приложение было свёрнуто)
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'visible') {
+        loadTimers();
+    }
+});
+
+// Отметить кнопку таймера как активную/неактивную
+function setTimerButtonActive(timerName, active) {
+    document.querySelectorAll('.timer-btn').forEach(btn => {
+        if (btn.dataset.timerName === timerName) {
+            btn.classList.toggle('active', active);
+        }
+    });
+}
+
+// Показать/скрыть контейнер активных таймеров
+function updateTimersContainer() {
+    const container = document.getElementById('activeTimersContainer');
+    if (Object.keys(activeTimers).length === 0) {
+        container.classList.add('hidden');
+    } else {
+        container.classList.remove('hidden');
+    }
+}
+
+// Убрать таймер с экрана
+function removeTimerElement(timerName) {
+    delete activeTimers[timerName];
+    
+    // Удаляем элемент из DOM
+    const timerElement = document.getElementById(`timer-${timerName}`);
+    if (timerElement) {
+        timerElement.style.animation = 'slideOut 0.3s ease';
+        setTimeout(() => timerElement.remove(), 300);
+    }
+    
+    // Убираем активный статус кнопки
+    setTimerButtonActive(timerName, false);
+    
+    // Если нет активных таймеров, скрываем контейнер
+    updateTimersContainer();
 }
 
 // Функция обновления отображения таймера
@@ -1517,67 +1678,39 @@ function updateTimerDisplay(timerName) {
 
 // Функция завершения таймера
 function completeTimer(timerName) {
-    const timerData = activeTimers[timerName];
-    
     // Звуковое уведомление
     playTimerSound();
     
     // Показываем уведомление
     showNotification(`✅ Таймер "${timerName}" завершён!`, 'success');
     
-    // Отправляем сообщение в телеграм
-    sendTimerNotificationToTelegram(timerName);
-    
     // Удаляем из активных
-    delete activeTimers[timerName];
-    
-    // Удаляем элемент из DOM
-    const timerElement = document.getElementById(`timer-${timerName}`);
-    if (timerElement) {
-        timerElement.style.animation = 'slideOut 0.3s ease';
-        setTimeout(() => timerElement.remove(), 300);
-    }
-    
-    // Убираем активный статус кнопки
-    document.querySelectorAll('.timer-btn').forEach(btn => {
-        if (btn.dataset.timerName === timerName) {
-            btn.classList.remove('active');
-        }
-    });
-    
-    // Если нет активных таймеров, скрываем контейнер
-    if (Object.keys(activeTimers).length === 0) {
-        document.getElementById('activeTimersContainer').classList.add('hidden');
-    }
+    removeTimerElement(timerName);
 }
 
 // Функция остановки таймера
-function stopTimer(timerName) {
-    if (activeTimers[timerName]) {
-        clearInterval(activeTimers[timerName].interval);
-        delete activeTimers[timerName];
-        
-        // Удаляем элемент из DOM
-        const timerElement = document.getElementById(`timer-${timerName}`);
-        if (timerElement) {
-            timerElement.style.animation = 'slideOut 0.3s ease';
-            setTimeout(() => timerElement.remove(), 300);
-        }
-        
-        // Убираем активный статус кнопки
-        document.querySelectorAll('.timer-btn').forEach(btn => {
-            if (btn.dataset.timerName === timerName) {
-                btn.classList.remove('active');
-            }
+async function stopTimer(timerName) {
+    const timerData = activeTimers[timerName];
+    if (!timerData) return;
+    
+    try {
+        const response = await fetch(`/api/cancel-timer/${timerData.id}`, {
+            method: 'DELETE',
+            headers: {'X-User-ID': userId}
         });
+        const data = await response.json();
         
-        showNotification(`⏹️ Таймер "${timerName}" остановлен`, 'info');
-        
-        // Если нет активных таймеров, скрываем контейнер
-        if (Object.keys(activeTimers).length === 0) {
-            document.getElementById('activeTimersContainer').classList.add('hidden');
+        if (!data.success && response.status !== 404) {
+            showNotification(`❌ ${data.error}`, 'danger');
+            return;
         }
+    } catch (error) {
+        showNotification('❌ Ошибка при остановке таймера', 'danger');
+        return;
     }
+    
+    removeTimerElement(timerName);
+    showNotification(`⏹️ Таймер "${timerName}" остановлен`, 'info');
 }
 
 // Функция для воспроизведения звука
@@ -1634,22 +1767,6 @@ function playFallbackSound() {
     }
 }
 
-// Функция отправки уведомления в телеграм
-function sendTimerNotificationToTelegram(timerName) {
-    // Отправляем запрос к серверу для отправки сообщения в телеграм
-    fetch('/api/send-timer-notification', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-            'X-User-ID': userId
-        },
-        body: JSON.stringify({
-            timer_name: timerName
-        })
-    })
-    .catch(err => console.error('Error sending timer notification:', err));
-}
-
 // Функция показа формы создания собственного таймера
 function showCustomTimerForm() {
     document.getElementById('customTimerForm').classList.remove('hidden');
@@ -1698,26 +1815,49 @@ function startCustomTimer() {
     startTimer(name, totalSeconds);
 }
 
+// Обновить кнопку паузы по состоянию таймера
+function updatePauseButton(timerName) {
+    const timerData = activeTimers[timerName];
+    const pauseBtn = document.getElementById(`pause-btn-${timerName}`);
+    if (!timerData || !pauseBtn) return;
+    
+    pauseBtn.innerHTML = timerData.paused
+        ? '<i class="fas fa-play"></i> Продолжить'
+        : '<i class="fas fa-pause"></i> Пауза';
+}
+
 // Функция паузы/продолжения таймера
-function togglePauseTimer(timerName) {
+async function togglePauseTimer(timerName) {
     const timerData = activeTimers[timerName];
     if (!timerData) return;
     
-    const pauseBtn = document.getElementById(`pause-btn-${timerName}`);
+    const action = timerData.paused ? 'resume' : 'pause';
+    try {
+        const response = await fetch(`/api/${action}-timer/${timerData.id}`, {
+            method: 'POST',
+            headers: {'X-User-ID': userId}
+        });
+        const data = await response.json();
+        
+        if (!data.success) {
+            showNotification(`❌ ${data.error}`, 'danger');
+            return;
+        }
+        
+        applyServerTimer(data.timer);
+    } catch (error) {
+        showNotification('❌ Ошибка при изменении таймера', 'danger');
+        return;
+    }
     
-    if (timerData.paused) {
-        // Продолжаем таймер
-        timerData.paused = false;
-        timerData.endTime = Date.now() + timerData.remaining;
-        pauseBtn.innerHTML = '<i class="fas fa-pause"></i> Пауза';
-        showNotification(`▶️ Таймер "${timerName}" продолжен`, 'info');
-        startTimerCountdown(timerName);
-    } else {
-        // Ставим на паузу
-        timerData.paused = true;
-        clearInterval(timerData.interval);
-        pauseBtn.innerHTML = '<i class="fas fa-play"></i> Продолжить';
+    updatePauseButton(timerName);
+    updateTimerDisplay(timerName);
+    
+    if (activeTimers[timerName].paused) {
         showNotification(`⏸️ Таймер "${timerName}" на паузе`, 'warning');
+    } else {
+        showNotification(`▶️ Таймер "${timerName}" продолжен`, 'info');
+        startTimersTicker();
     }
 }
 
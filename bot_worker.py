@@ -1,6 +1,7 @@
 """
 Bot-only entry point (для worker процесса)
-Запускает только aiogram бота БЕЗ Flask сервера
+Запускает только aiogram бота: обработчики апдейтов (polling или webhook),
+без веб-сервера API, планировщика и отправки outbox (см. scheduler_worker.py)
 """
 
 import asyncio
@@ -9,4 +10,4 @@ from bot.main import main
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
-    asyncio.run(main())
+    asyncio.run(main("bot"))
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Очистка старых записей bp_completions (SQLite или PostgreSQL). История BP
+при этом остаётся в bp_day_bits: один BIGINT с битами заданий и сумма BP на
+пользователя за BP-день, из них же считаются /api/get-bp-stats и
+/api/get-bp-history.
+
+Запуск:  python compact_bp_history.py              - оставить последние 30 BP-дней
+         python compact_bp_history.py --keep-days 7
+"""
+import sys
+import logging
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from bot.models.database import Base
+from bot.models.migrations import add_bp_day, add_bp_task_bits, ensure_bp_day_bits, compact_bp_history
+from migrate_indexes import get_sync_engine
+
+
+def main(keep_days=30):
+    engine = get_sync_engine()
+    try:
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as connection:
+            # bp_day_bits должна быть заполнена до удаления - иначе история потеряется
+            add_bp_day(connection)
+            add_bp_task_bits(connection)
+            ensure_bp_day_bits(connection)
+
+            logger.info(f"🔧 Удаляем bp_completions старше {keep_days} BP-дней...")
+            deleted = compact_bp_history(connection, keep_days)
+        logger.info(f"✅ Удалено записей: {deleted}")
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    keep_days = 30
+    if "--keep-days" in sys.argv:
+        keep_days = int(sys.argv[sys.argv.index("--keep-days") + 1])
+    main(keep_days)
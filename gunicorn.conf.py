@@ -0,0 +1,42 @@
+"""
+Конфигурация gunicorn для production-режима веб-сервера.
+
+Запуск:  gunicorn -c gunicorn.conf.py bot.web.app:app
+Или из бота: WEB_SERVER=gunicorn python -m bot.main
+"""
+import os
+
+# Запуск gunicorn напрямую тоже считается режимом gunicorn: под него бюджет пула
+# (WEB_WORKERS движков) и выключенные кэши процесса (bot.utils.cache.ProcessLocalCache)
+os.environ.setdefault("WEB_SERVER", "gunicorn")
+
+from bot.config import WEB_WORKERS, WEB_THREADS, DB_POOL_WARMUP
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# Процессы × потоки: каждый поток обслуживает один запрос к API
+workers = WEB_WORKERS
+threads = WEB_THREADS
+worker_class = "gthread"
+timeout = int(os.getenv("WEB_TIMEOUT", "30"))
+graceful_timeout = 10
+
+# Импортируем приложение один раз в master-процессе: create_all, миграции колонок
+# и сидирование BP заданий выполняются однократно, а не в каждом воркере
+preload_app = True
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("WEB_LOG_LEVEL", "info")
+
+
+def post_fork(server, worker):
+    """Не делим соединения master-процесса между воркерами и прогреваем пул воркера"""
+    from bot.web import app as web_app
+    from bot.models.pool import warm_up
+
+    engine = getattr(web_app, "sync_engine", None)
+    if engine is not None:
+        engine.dispose(close=False)
+        if DB_POOL_WARMUP:
+            warm_up(engine)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Миграция: добавляет индексы горячих запросов в существующую БД (SQLite или PostgreSQL)
+и проверяет через EXPLAIN, что эти запросы не делают полный скан таблиц.
+
+Запуск:  python migrate_indexes.py          - создать индексы и проверить планы
+         python migrate_indexes.py --check  - только проверить планы
+"""
+import sys
+import logging
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from sqlalchemy import create_engine
+from bot.config import DATABASE_URL
+from bot.models.database import Base
+from bot.models.indexes import ensure_indexes, explain_hot_queries
+
+
+def get_sync_engine():
+    """Sync-движок для текущего DATABASE_URL"""
+    if "postgresql" in DATABASE_URL or "postgres" in DATABASE_URL:
+        sync_url = DATABASE_URL.replace("postgresql+asyncpg://", "postgresql+psycopg2://")
+        if "+psycopg2" not in sync_url:
+            sync_url = sync_url.replace("postgresql://", "postgresql+psycopg2://")
+        return create_engine(sync_url)
+    return create_engine(DATABASE_URL.replace("sqlite+aiosqlite://", "sqlite://"))
+
+
+def migrate_indexes(check_only=False):
+    """Создаёт недостающие индексы и проверяет планы. True если полных сканов нет"""
+    engine = get_sync_engine()
+    try:
+        if not check_only:
+            logger.info("🔧 Создаём недостающие таблицы и индексы...")
+            Base.metadata.create_all(bind=engine)
+            ensure_indexes(engine)
+
+        logger.info("🔍 Проверяем планы горячих запросов (EXPLAIN)...")
+        ok = True
+        for name, table, plan, full_scan in explain_hot_queries(engine):
+            status = "❌ полный скан" if full_scan else "✅ индекс"
+            logger.info(f"{status}  {name} ({table})")
+            for line in plan.splitlines():
+                logger.info(f"      {line}")
+            ok = ok and not full_scan
+
+        if ok:
+            logger.info("✅ Все горячие запросы используют индексы")
+        else:
+            logger.error("❌ Есть запросы с полным сканом таблицы")
+        return ok
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    success = migrate_indexes(check_only="--check" in sys.argv)
+    sys.exit(0 if success else 1)
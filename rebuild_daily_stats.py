@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Пересчёт дневных итогов daily_user_stats по всем товарам, продажам, арендам
+и BP-заданиям (SQLite или PostgreSQL). Обычно таблица ведётся автоматически;
+запускать после ручных правок в БД или если итоги разошлись с данными.
+
+Запуск:  python rebuild_daily_stats.py
+"""
+import sys
+import logging
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from bot.models.database import Base
+from bot.models.migrations import rebuild_daily_stats
+from migrate_indexes import get_sync_engine
+
+
+def main():
+    engine = get_sync_engine()
+    try:
+        Base.metadata.create_all(bind=engine)
+        logger.info("🔧 Пересчитываем daily_user_stats...")
+        with engine.begin() as connection:
+            count = rebuild_daily_stats(connection)
+        logger.info(f"✅ Готово: {count} дней")
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
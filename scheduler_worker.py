@@ -0,0 +1,13 @@
+"""
+Scheduler-only entry point (для worker процесса)
+Запускает планировщик (окончание аренды, таймеры) и отправку сообщений из outbox
+без обработки апдейтов и веб-сервера
+"""
+
+import asyncio
+import logging
+from bot.main import main
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main("scheduler"))
@@ -0,0 +1,12 @@
+"""
+Web-only entry point (для web процесса)
+Запускает только ASGI API для Mini App, без бота и фоновых задач
+"""
+
+import asyncio
+import logging
+from bot.main import main
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main("web"))